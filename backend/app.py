@@ -1,34 +1,53 @@
+import copy
 import json
 import os
 import time
 import traceback
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Dict, List
 import pandas as pd
-from helpers import compress_json
-from heatmap import create_heatmap
+from cost_model import (
+    estimate_heatmap_cost,
+    fit_settings_to_latency_budget,
+    record_stage_timings,
+)
+from helpers import compress_json, get_dataset_fingerprint
+from heatmap import create_heatmap, get_attribute_dissimilarities
 from heatmap_types import HeatmapSettings, custom_encoder
+from request_body import (
+    MAX_REQUEST_BODY_SIZE,
+    RequestBodyTooLarge,
+    StringReader,
+    read_json_body,
+)
+from selection import get_selection_size
 from flask import Flask, request, jsonify, Response, stream_with_context
+from werkzeug.exceptions import RequestEntityTooLarge
 from flask_cors import CORS
-from io import StringIO
 import logging
 from flask_compress import Compress
-import hashlib
 from dotenv import load_dotenv
 
 
 app = Flask(__name__)
+app.config["MAX_CONTENT_LENGTH"] = MAX_REQUEST_BODY_SIZE
 CORS(app)
 Compress(app)
 
 logger = logging.getLogger("IHECH Logger")
 logger.setLevel(logging.DEBUG)
 
-file_handler = logging.FileHandler("ihech.log")
-file_handler.setLevel(logging.DEBUG)
 file_formatter = logging.Formatter(
     "%(asctime)s - %(name)s - %(levelname)s - %(message)s", datefmt="%Y-%m-%d %H:%M:%S"
 )
-file_handler.setFormatter(file_formatter)
-logger.addHandler(file_handler)
+
+# an empty IHECH_LOG_FILE only logs to the console
+log_file = os.getenv("IHECH_LOG_FILE", "ihech.log")
+if log_file:
+    file_handler = logging.FileHandler(log_file)
+    file_handler.setLevel(logging.DEBUG)
+    file_handler.setFormatter(file_formatter)
+    logger.addHandler(file_handler)
 
 console_handler = logging.StreamHandler()
 console_handler.setLevel(logging.DEBUG)
@@ -47,6 +66,27 @@ heatmap_cache = {}
 
 logger.info("MAX_CACHE_SIZE: " + str(MAX_CACHE_SIZE))
 
+# Full heatmaps which are still being computed after a preview was returned
+background_executor = ThreadPoolExecutor(max_workers=1)
+pending_heatmaps: Dict[str, Future] = {}
+
+# Uploaded CSVs by their fingerprint, each is hashed once when it is registered
+MAX_REGISTERED_DATASETS = int(os.getenv("MAX_REGISTERED_DATASETS", 4))
+
+
+class RegisteredDataset:
+    def __init__(self, fingerprint: str, csv_file: str, columns: pd.Index):
+        self.fingerprint = fingerprint
+        self.csvFile = csv_file
+        # to key selected column names like their positions
+        self.columns = columns
+
+
+class UnknownDataset(Exception):
+    pass
+
+
+registered_datasets: Dict[str, RegisteredDataset] = {}
 
 @app.route("/")
 def index():
@@ -61,6 +101,101 @@ def health_check():
 isComputing = False
 
 
+def store_in_cache(cache_key: str, heatmap_json) -> None:
+    # Before adding to cache, ensure we do not exceed MAX_CACHE_SIZE
+    if len(heatmap_cache) >= MAX_CACHE_SIZE:
+        # Remove the oldest inserted item
+        oldest_key = next(iter(heatmap_cache))
+        heatmap_cache.pop(oldest_key)
+
+    heatmap_cache[cache_key] = heatmap_json
+
+
+def register_dataset(csv_file: str) -> RegisteredDataset:
+    fingerprint = get_dataset_fingerprint(csv_file)
+    dataset = registered_datasets.pop(fingerprint, None)
+    if dataset is None:
+        columns = pd.read_csv(StringReader(csv_file), nrows=0).columns
+        dataset = RegisteredDataset(fingerprint, csv_file, columns)
+        if len(registered_datasets) >= MAX_REGISTERED_DATASETS:
+            # Remove the least recently used dataset
+            registered_datasets.pop(next(iter(registered_datasets)))
+    registered_datasets[fingerprint] = dataset
+    return dataset
+
+
+def get_registered_dataset(settings_dict: Dict) -> RegisteredDataset:
+    """Dataset named by the datasetFingerprint of a request, its CSV is only
+    hashed if it is sent without a registered fingerprint."""
+    fingerprint = settings_dict.get("datasetFingerprint")
+    csv_file = settings_dict.get("csvFile")
+    dataset = registered_datasets.pop(fingerprint, None) if fingerprint else None
+    if dataset is None:
+        if csv_file is None:
+            raise UnknownDataset(f"Dataset {fingerprint} is not registered")
+        dataset = register_dataset(csv_file)
+    else:
+        registered_datasets[fingerprint] = dataset
+    # comparing the strings is much cheaper than hashing the CSV again
+    if (fingerprint and dataset.fingerprint != fingerprint) or (
+        csv_file is not None and csv_file != dataset.csvFile
+    ):
+        raise ValueError("datasetFingerprint does not match csvFile")
+    return dataset
+
+
+@app.route("/api/dataset", methods=["POST"])
+def post_dataset():
+    """Registers an uploaded CSV, heatmap requests can then send its
+    fingerprint instead of the CSV."""
+    try:
+        request_json = read_json_body(request.stream, request.content_encoding)
+        dataset = register_dataset(request_json["csvFile"])
+        return jsonify({"datasetFingerprint": dataset.fingerprint}), 200
+
+    except (RequestBodyTooLarge, RequestEntityTooLarge) as e:
+        logger.error(f"Error: {e}")
+        return str(e), 413
+
+    except Exception as e:
+        logger.error(f"Error: {traceback.format_exc()}")
+        return str(e), 400
+
+
+def stream_heatmap_json(heatmap_json) -> Response:
+    def generate():
+        for chunk in json.JSONEncoder(default=custom_encoder).iterencode(
+            heatmap_json
+        ):
+            yield chunk
+
+    return Response(stream_with_context(generate()), mimetype="application/json")
+
+
+def compute_heatmap_in_background(
+    cache_key: str,
+    original_df: pd.DataFrame,
+    heatmap_settings: HeatmapSettings,
+) -> None:
+    def compute_and_cache():
+        start_background = time.perf_counter()
+        heatmap_json = create_heatmap(original_df, heatmap_settings, start_background)
+        heatmap_json.resultId = cache_key
+        store_in_cache(cache_key, heatmap_json)
+        logger.info(
+            f"Full heatmap computed in background: {round(time.perf_counter() - start_background, 2)} seconds"
+        )
+
+    def on_done(future: Future):
+        pending_heatmaps.pop(cache_key, None)
+        if future.exception() is not None:
+            logger.error(f"Background heatmap failed: {future.exception()}")
+
+    future = background_executor.submit(compute_and_cache)
+    pending_heatmaps[cache_key] = future
+    future.add_done_callback(on_done)
+
+
 @app.route("/api/heatmap", methods=["POST"])
 def get_heatmap():
     global isComputing
@@ -70,47 +205,89 @@ def get_heatmap():
         logger.info("Starting to build heatmap...")
         start_heatmap = time.perf_counter()
 
-        # Parse and represent settings in a unique way for caching
-        settings_data = request.json["settings"]
-        heatmap_settings = HeatmapSettings(settings_data)        
+        request_json = read_json_body(request.stream, request.content_encoding)
+        dataset = get_registered_dataset(request_json["settings"])
+        heatmap_settings = HeatmapSettings(
+            {
+                **request_json["settings"],
+                "csvFile": dataset.csvFile,
+                "datasetFingerprint": dataset.fingerprint,
+            }
+        )
+
+        # the budget adjusts a copy, heatmap_settings stay those of the full heatmap
+        budget_settings = heatmap_settings
+        item_sample_size = None
+        adjustments: List[str] = []
+        if heatmap_settings.maxLatencyMs is not None:
+            budget_settings = copy.deepcopy(heatmap_settings)
+            item_sample_size, adjustments = fit_settings_to_latency_budget(
+                get_selection_size(heatmap_settings.selectedItemsRowIndexes),
+                get_selection_size(heatmap_settings.selectedAttributesColumnNames),
+                budget_settings,
+            )
+            if adjustments:
+                logger.info(
+                    "Adjusted settings to meet latency budget: " + ", ".join(adjustments)
+                )
+
+        # Equal for all requests with the same result, the dataset enters by its fingerprint.
+        # A preview is never cached, the budget only applies to it.
+        if heatmap_settings.previewMode:
+            cache_key = heatmap_settings.get_cache_key(columns=dataset.columns)
+        else:
+            cache_key = budget_settings.get_cache_key(
+                item_sample_size, columns=dataset.columns
+            )
 
-        # Create a unique cache key: hashing the JSON-serialized settings
-        settings_str = json.dumps(settings_data, sort_keys=True)
-        cache_key = hashlib.sha256(settings_str.encode("utf-8")).hexdigest()
+        # A preview for these settings was returned earlier, wait for the full result
+        pending_heatmap = pending_heatmaps.get(cache_key)
+        if pending_heatmap is not None:
+            logger.info("Waiting for full heatmap computed in background...")
+            wait([pending_heatmap])
 
         # Check if we have a cached response for these settings
         if cache_key in heatmap_cache:
             logger.info("Cache hit. Returning cached result.")
-            cached_heatmap_json = heatmap_cache[cache_key]
-
-            def cached_generate():
-                for chunk in json.JSONEncoder(default=custom_encoder).iterencode(
-                    cached_heatmap_json
-                ):
-                    yield chunk
-
-            return Response(
-                stream_with_context(cached_generate()), mimetype="application/json"
-            )
+            return stream_heatmap_json(heatmap_cache[cache_key])
 
         # Not cached, we must compute
-        csv_file = StringIO(heatmap_settings.csvFile)
-        original_df = pd.read_csv(csv_file)
+        # parsed from the decoded string itself, without copying it into a buffer
+        original_df = pd.read_csv(StringReader(heatmap_settings.csvFile))
 
         logger.info(
             f"Finished reading csv file: {round(time.perf_counter() - start_heatmap, 2)}"
         )
 
-        heatmap_json = create_heatmap(original_df, heatmap_settings, start_heatmap)
-
-        # Before adding to cache, ensure we do not exceed MAX_CACHE_SIZE
-        if len(heatmap_cache) >= MAX_CACHE_SIZE:
-            # Remove the oldest inserted item
-            oldest_key = next(iter(heatmap_cache))
-            heatmap_cache.pop(oldest_key)
-
-        # Store result in cache
-        heatmap_cache[cache_key] = heatmap_json
+        if heatmap_settings.previewMode:
+            preview_sample_size = heatmap_settings.previewSampleSize
+            if item_sample_size is not None:
+                preview_sample_size = min(preview_sample_size, item_sample_size)
+            # create_heatmap modifies the settings, the full heatmap needs them unchanged
+            if budget_settings is heatmap_settings:
+                budget_settings = copy.deepcopy(heatmap_settings)
+            heatmap_json = create_heatmap(
+                original_df,
+                budget_settings,
+                start_heatmap,
+                item_sample_size=preview_sample_size,
+            )
+            heatmap_json.resultId = cache_key
+            if heatmap_json.isSampled or adjustments:
+                # only a preview, the full heatmap is cached once it is computed
+                heatmap_json.isApproximate = True
+                compute_heatmap_in_background(cache_key, original_df, heatmap_settings)
+            else:
+                store_in_cache(cache_key, heatmap_json)
+        else:
+            heatmap_json = create_heatmap(
+                original_df,
+                budget_settings,
+                start_heatmap,
+                item_sample_size=item_sample_size,
+            )
+            heatmap_json.resultId = cache_key
+            store_in_cache(cache_key, heatmap_json)
 
         logger.info("Starting to generate json...")
         start_json = time.perf_counter()
@@ -120,8 +297,15 @@ def get_heatmap():
                 heatmap_json
             ):
                 yield chunk
-            logger.info(
-                f"Generating JSON Done: {round(time.perf_counter() - start_json, 2)} seconds"
+            json_seconds = time.perf_counter() - start_json
+            logger.info(f"Generating JSON Done: {round(json_seconds, 2)} seconds")
+            # the sizes and settings create_heatmap recorded the other stages with
+            number_of_items, number_of_attributes = heatmap_json.get_cost_sizes()
+            record_stage_timings(
+                number_of_items,
+                number_of_attributes,
+                budget_settings,
+                {"json": json_seconds},
             )
             logger.info(
                 f"Time to generate entire heatmap: {round(time.perf_counter() - start_heatmap, 2)} seconds"
@@ -133,9 +317,93 @@ def get_heatmap():
 
         return response
 
+    except (RequestBodyTooLarge, RequestEntityTooLarge) as e:
+        logger.error(f"Error: {e}")
+        return str(e), 413
+
+    except UnknownDataset as e:
+        # the client registers the dataset again and repeats the request
+        logger.info(str(e))
+        return str(e), 404
+
     except Exception as e:
         logger.error(f"Error: {traceback.format_exc()}")
         return str(e), 400
 
     finally:
         isComputing = False
+
+
+@app.route("/api/heatmap/dissimilarities", methods=["POST"])
+def get_heatmap_dissimilarities():
+    """Attribute dissimilarities of a cached heatmap for other sticky items,
+    without recomputing the heatmap."""
+    try:
+        request_json = read_json_body(request.stream, request.content_encoding)
+        result_id = request_json["resultId"]
+
+        pending_heatmap = pending_heatmaps.get(result_id)
+        if pending_heatmap is not None:
+            wait([pending_heatmap])
+
+        heatmap_json = heatmap_cache.get(result_id)
+        dissimilarity_data = (
+            heatmap_json.get_dissimilarity_data() if heatmap_json is not None else None
+        )
+        if dissimilarity_data is None:
+            return "Heatmap is not cached anymore", 404
+
+        raw_data_df, attribute_stds = dissimilarity_data
+        attribute_dissimilarities = get_attribute_dissimilarities(
+            raw_data_df,
+            attribute_stds,
+            request_json["stickyItemsRowIndexes"],
+            request_json.get("sortAttributesBasedOnStickyItems", True),
+        )
+        return jsonify({"attributeDissimilarities": attribute_dissimilarities}), 200
+
+    except Exception as e:
+        logger.error(f"Error: {traceback.format_exc()}")
+        return str(e), 400
+
+
+@app.route("/api/heatmap/estimate", methods=["POST"])
+def estimate_heatmap():
+    try:
+        # The estimate only depends on the selection sizes, sending the CSV is optional
+        request_json = read_json_body(request.stream, request.content_encoding)
+        heatmap_settings = HeatmapSettings({"csvFile": "", **request_json["settings"]})
+        number_of_items = get_selection_size(heatmap_settings.selectedItemsRowIndexes)
+        number_of_attributes = get_selection_size(
+            heatmap_settings.selectedAttributesColumnNames
+        )
+
+        stage_seconds = estimate_heatmap_cost(
+            number_of_items, number_of_attributes, heatmap_settings
+        )
+        estimate = {
+            "estimatedMs": round(sum(stage_seconds.values()) * 1000),
+            "stagesMs": {
+                stage: round(seconds * 1000) for stage, seconds in stage_seconds.items()
+            },
+        }
+
+        if heatmap_settings.maxLatencyMs is not None:
+            item_sample_size, adjustments = fit_settings_to_latency_budget(
+                number_of_items, number_of_attributes, heatmap_settings
+            )
+            adjusted_stage_seconds = estimate_heatmap_cost(
+                item_sample_size or number_of_items,
+                number_of_attributes,
+                heatmap_settings,
+            )
+            estimate["adjustments"] = adjustments
+            estimate["adjustedEstimatedMs"] = round(
+                sum(adjusted_stage_seconds.values()) * 1000
+            )
+
+        return jsonify(estimate), 200
+
+    except Exception as e:
+        logger.error(f"Error: {traceback.format_exc()}")
+        return str(e), 400
@@ -0,0 +1,45 @@
+import logging
+from typing import Union
+
+import pandas as pd
+from sklearn.random_projection import SparseRandomProjection
+from helpers import stratified_sample_positions
+from heatmap_types import HeatmapSettings
+
+
+logger = logging.getLogger("IHECH Logger")
+
+
+def get_attribute_signatures(
+    rotated_scaled_raw_data_df: pd.DataFrame,
+    settings: HeatmapSettings,
+    strata: Union[pd.Series, None] = None,
+) -> pd.DataFrame:
+    """Compact rows standing in for the attributes of rotated_scaled_raw_data_df,
+    to build the attribute hierarchy on. Ward's distances then scale with
+    attributeSignatureSize instead of the items, the aggregate columns and stds
+    of every cluster are still computed from all items.
+
+    SAMPLE keeps a stratified sample of the items, RANDOM_PROJECTION projects
+    all items, which roughly preserves the distances between the attributes."""
+    size = settings.attributeSignatureSize
+    number_of_items = rotated_scaled_raw_data_df.shape[1]
+    if settings.attributeSignature == "FULL" or number_of_items <= size:
+        return rotated_scaled_raw_data_df
+
+    if settings.attributeSignature == "SAMPLE":
+        positions = stratified_sample_positions(
+            strata, number_of_items, size, random_state=42
+        )
+        signatures = rotated_scaled_raw_data_df.iloc[:, positions]
+    elif settings.attributeSignature == "RANDOM_PROJECTION":
+        projected = SparseRandomProjection(
+            n_components=size, dense_output=True, random_state=42
+        ).fit_transform(rotated_scaled_raw_data_df.values)
+        signatures = pd.DataFrame(projected, index=rotated_scaled_raw_data_df.index)
+    else:
+        raise ValueError(f"Unknown attribute signature: {settings.attributeSignature}")
+    logger.info(
+        f"Clustering attributes on {signatures.shape[1]} of {number_of_items} item dimensions"
+    )
+    return signatures
@@ -2,26 +2,34 @@ from typing import List
 from heatmap_types import ItemNameAndData, HierarchicalAttribute
 import numpy as np
 
-
-def get_list_of_item_values_idx(
-    item_name_and_data: List[ItemNameAndData], index: int
-) -> List[float]:
+def get_list_of_item_values_idx(item_name_and_data: List[ItemNameAndData], index) -> List[float]:
     l = []
-    for item in item_name_and_data:
+    stack = list(reversed(item_name_and_data))
+    while stack:
+        item = stack.pop()
         l.append(item.data[index])
         if item.children is not None:
-            l = l + get_list_of_item_values_idx(item.children, index)
+            stack.extend(reversed(item.children))
     return l
 
+def get_item_values_matrix(item_name_and_data: List[ItemNameAndData]) -> np.ndarray:
+    # one row per node of the item tree, in the same order as get_list_of_item_values_idx
+    rows = []
+    stack = list(reversed(item_name_and_data))
+    while stack:
+        item = stack.pop()
+        rows.append(item.data)
+        if item.children is not None:
+            stack.extend(reversed(item.children))
+    return np.array(rows, dtype=np.float64)
 
-def calculate_attribute_std(
-    item_name_and_data: List[ItemNameAndData],
-    hierarchical_attributes: List[HierarchicalAttribute],
-) -> None:
+def set_attribute_std(hierarchical_attributes: List[HierarchicalAttribute], stds: np.ndarray) -> None:
     for attribute in hierarchical_attributes:
-        list_of_values = get_list_of_item_values_idx(
-            item_name_and_data, attribute.dataAttributeIndex
-        )
-        attribute.std = np.std(list_of_values)
+        attribute.std = stds[attribute.dataAttributeIndex]
         if attribute.children is not None:
-            calculate_attribute_std(item_name_and_data, attribute.children)
+            set_attribute_std(attribute.children, stds)
+
+def calculate_attribute_std(item_name_and_data: List[ItemNameAndData], hierarchical_attributes: List[HierarchicalAttribute]) -> None:
+    # walk the item tree once and reduce all attribute columns together
+    stds = np.std(get_item_values_matrix(item_name_and_data), axis=0)
+    set_attribute_std(hierarchical_attributes, stds)
@@ -0,0 +1,218 @@
+import logging
+from typing import Callable, Dict, Union
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+from sklearn.cluster import (
+    AgglomerativeClustering,
+    Birch,
+    BisectingKMeans,
+    MiniBatchKMeans,
+)
+from dendrogram import Dendrogram
+from duplicates import get_duplicate_groups
+from knn_graph import KnnGraph
+
+
+logger = logging.getLogger("IHECH Logger")
+
+# AUTO uses ward up to this many rows and a linear-time backend above.
+MAX_AUTO_WARD_SIZE = 5000
+
+# AUTO uses mini-batch k-means up to this many rows and BIRCH above, whose
+# CF-tree summarizes the rows in one pass and bounds the global step. Weighted
+# rows use k-means at any size, and bisecting k-means above.
+MAX_AUTO_KMEANS_SIZE = 200000
+
+# The BIRCH threshold starts at this fraction of the data's spread and is
+# adapted until the CF-tree holds between cluster_size and
+# BIRCH_MAX_SUBCLUSTERS subclusters for the global step.
+BIRCH_THRESHOLD_FACTOR = 0.1
+BIRCH_MAX_SUBCLUSTERS = 2000
+BIRCH_MAX_REFITS = 8
+
+
+def cluster_ward(
+    data: np.ndarray,
+    cluster_size: int,
+    connectivity: Union[csr_matrix, None],
+    sample_weight: Union[np.ndarray, None] = None,
+) -> np.ndarray:
+    hierarchical = AgglomerativeClustering(
+        n_clusters=cluster_size, linkage="ward", connectivity=connectivity
+    )
+    return hierarchical.fit_predict(data)
+
+
+def cluster_kmeans(
+    data: np.ndarray,
+    cluster_size: int,
+    connectivity: Union[csr_matrix, None],
+    sample_weight: Union[np.ndarray, None] = None,
+) -> np.ndarray:
+    kmeans = MiniBatchKMeans(n_clusters=cluster_size, n_init=1, random_state=42)
+    return kmeans.fit_predict(data, sample_weight=sample_weight)
+
+
+def cluster_birch(
+    data: np.ndarray,
+    cluster_size: int,
+    connectivity: Union[csr_matrix, None],
+    sample_weight: Union[np.ndarray, None] = None,
+) -> np.ndarray:
+    spread = np.sqrt(np.var(data, axis=0).sum())
+    threshold = max(BIRCH_THRESHOLD_FACTOR * spread, 1e-9)
+    for _ in range(BIRCH_MAX_REFITS):
+        birch = Birch(threshold=threshold, n_clusters=None).fit(data)
+        number_of_subclusters = len(birch.subcluster_centers_)
+        if number_of_subclusters > BIRCH_MAX_SUBCLUSTERS:
+            threshold *= 2
+        elif number_of_subclusters < cluster_size:
+            threshold /= 2
+        else:
+            break
+
+    if number_of_subclusters > cluster_size:
+        # only run the global step, which groups the CF-tree leaves with ward
+        birch.set_params(n_clusters=AgglomerativeClustering(n_clusters=cluster_size))
+        birch.partial_fit()
+    return birch.predict(data)
+
+
+def cluster_bisecting_kmeans(
+    data: np.ndarray,
+    cluster_size: int,
+    connectivity: Union[csr_matrix, None],
+    sample_weight: Union[np.ndarray, None] = None,
+) -> np.ndarray:
+    bisecting_kmeans = BisectingKMeans(
+        n_clusters=cluster_size,
+        random_state=42,
+        bisecting_strategy="largest_cluster",
+    )
+    return bisecting_kmeans.fit_predict(data, sample_weight=sample_weight)
+
+
+def cluster_kd_tree(
+    data: np.ndarray,
+    cluster_size: int,
+    connectivity: Union[csr_matrix, None],
+    sample_weight: Union[np.ndarray, None] = None,
+) -> np.ndarray:
+    """Splits the rows at the median of their widest coordinate, like the top
+    levels of a KD-tree, until there are cluster_size groups of balanced size.
+    Every split is linear, so the item hierarchy is built in O(n log n).
+    With sample weights the split is at the weighted median instead."""
+    labels = np.empty(data.shape[0], dtype=np.int64)
+    next_label = 0
+    stack = [(np.arange(data.shape[0]), cluster_size)]
+    while stack:
+        offsets, number_of_groups = stack.pop()
+        if number_of_groups == 1 or len(offsets) <= 1:
+            labels[offsets] = next_label
+            next_label += 1
+            continue
+        rows = data[offsets]
+        axis = np.argmax(np.ptp(rows, axis=0))
+        left_groups = number_of_groups // 2
+        if sample_weight is None:
+            split = len(offsets) * left_groups // number_of_groups
+            order = np.argpartition(rows[:, axis], split)
+        else:
+            order = np.argsort(rows[:, axis], kind="stable")
+            cumulative_weights = np.cumsum(sample_weight[offsets][order])
+            split = max(
+                int(
+                    np.searchsorted(
+                        cumulative_weights,
+                        cumulative_weights[-1] * left_groups / number_of_groups,
+                        side="right",
+                    )
+                ),
+                1,
+            )
+        # the left half is labeled first, so labels follow the split order
+        stack.append((offsets[order[split:]], number_of_groups - left_groups))
+        stack.append((offsets[order[:split]], left_groups))
+    return labels
+
+
+# Ward and BIRCH ignore sample weights, sklearn does not support them there.
+CLUSTERING_BACKENDS: Dict[
+    str,
+    Callable[
+        [np.ndarray, int, Union[csr_matrix, None], Union[np.ndarray, None]],
+        np.ndarray,
+    ],
+] = {
+    "WARD": cluster_ward,
+    "KMEANS": cluster_kmeans,
+    "BIRCH": cluster_birch,
+    "BISECTING_KMEANS": cluster_bisecting_kmeans,
+    "KD_TREE": cluster_kd_tree,
+}
+
+
+def cluster_rows(
+    data: np.ndarray,
+    item_indexes: pd.Index,
+    cluster_size: int,
+    clustering_backend: str,
+    knn_graph: Union[KnnGraph, None] = None,
+    dendrogram: Union[Dendrogram, None] = None,
+    duplicate_ids: Union[np.ndarray, None] = None,
+    sample_weight: Union[np.ndarray, None] = None,
+) -> np.ndarray:
+    """Labels splitting the rows of data, labeled by item_indexes, into at most
+    cluster_size clusters.
+
+    Rows with equal duplicate_ids are clustered as one row weighted by their
+    number and get the same label.
+    """
+    if duplicate_ids is not None and clustering_backend != "DENDROGRAM":
+        representatives, inverse, counts = get_duplicate_groups(duplicate_ids)
+        if len(representatives) < data.shape[0]:
+            if len(representatives) <= cluster_size:
+                # every distinct row is a cluster of its own
+                return inverse
+            representative_labels = cluster_rows(
+                data[representatives],
+                item_indexes[representatives],
+                cluster_size,
+                clustering_backend,
+                knn_graph=knn_graph,
+                sample_weight=counts,
+            )
+            return representative_labels[inverse]
+
+    if clustering_backend == "DENDROGRAM":
+        if dendrogram is not None:
+            return dendrogram.split(item_indexes, cluster_size)
+        # the matrix was too large for a dendrogram
+        clustering_backend = "AUTO"
+
+    connectivity = None
+    if knn_graph is not None and data.shape[0] > MAX_AUTO_WARD_SIZE:
+        connectivity = knn_graph.get_connectivity(item_indexes)
+
+    if clustering_backend == "AUTO":
+        if sample_weight is not None:
+            # collapsed duplicates, ward and BIRCH would count each of them once
+            if data.shape[0] <= MAX_AUTO_KMEANS_SIZE:
+                clustering_backend = "KMEANS"
+            else:
+                clustering_backend = "BISECTING_KMEANS"
+        elif data.shape[0] <= MAX_AUTO_WARD_SIZE or connectivity is not None:
+            # Ward restricted to neighboring items scales with the graph, not n^2
+            clustering_backend = "WARD"
+        elif data.shape[0] <= MAX_AUTO_KMEANS_SIZE:
+            clustering_backend = "KMEANS"
+        else:
+            clustering_backend = "BIRCH"
+
+    if clustering_backend not in CLUSTERING_BACKENDS:
+        raise ValueError(f"Unknown clustering backend: {clustering_backend}")
+    return CLUSTERING_BACKENDS[clustering_backend](
+        data, cluster_size, connectivity, sample_weight
+    )
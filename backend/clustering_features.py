@@ -0,0 +1,75 @@
+import hashlib
+import logging
+from typing import Dict
+
+import pandas as pd
+from sklearn.decomposition import PCA
+from sklearn.random_projection import GaussianRandomProjection
+from dim_reduction import pca_svd_solver
+from heatmap_types import HeatmapSettings
+
+
+logger = logging.getLogger("IHECH Logger")
+
+MAX_CLUSTERING_FEATURES = 5
+clustering_features: Dict[str, pd.DataFrame] = {}
+
+
+def get_clustering_features_key(
+    scaled_raw_data_df: pd.DataFrame, settings: HeatmapSettings
+) -> str:
+    key_parts = [
+        settings.get_dataset_fingerprint(),
+        settings.scaling,
+        settings.clusteringFeatureSpace,
+        str(settings.clusteringFeatureDimensions),
+        ",".join(map(str, scaled_raw_data_df.columns)),
+        ",".join(map(str, scaled_raw_data_df.index)),
+    ]
+    return hashlib.sha256("|".join(key_parts).encode("utf-8")).hexdigest()
+
+
+def get_clustering_features(
+    scaled_raw_data_df: pd.DataFrame, settings: HeatmapSettings
+) -> pd.DataFrame:
+    """The scaled items projected to clusteringFeatureDimensions dimensions, to
+    compute the item clusters on. Ward's distances then scale with the
+    dimensions instead of the attributes, the aggregates still use all of them."""
+    dimensions = settings.clusteringFeatureDimensions
+    if (
+        settings.clusteringFeatureSpace == "FULL"
+        or scaled_raw_data_df.shape[1] <= dimensions
+        or scaled_raw_data_df.shape[0] <= dimensions
+    ):
+        return scaled_raw_data_df
+
+    key = get_clustering_features_key(scaled_raw_data_df, settings)
+    if key in clustering_features:
+        logger.info("Reusing cached clustering features")
+        return clustering_features[key]
+
+    if settings.clusteringFeatureSpace == "PCA":
+        pca = PCA(
+            n_components=dimensions,
+            svd_solver=pca_svd_solver(scaled_raw_data_df.shape[1]),
+            random_state=42,
+        )
+        projected = pca.fit_transform(scaled_raw_data_df.values)
+        logger.info(
+            f"Clustering features keep {sum(pca.explained_variance_ratio_) * 100:.2f}% of the variance"
+        )
+    elif settings.clusteringFeatureSpace == "RANDOM_PROJECTION":
+        projected = GaussianRandomProjection(
+            n_components=dimensions, random_state=42
+        ).fit_transform(scaled_raw_data_df.values)
+    else:
+        raise ValueError(
+            f"Unknown clustering feature space: {settings.clusteringFeatureSpace}"
+        )
+    features = pd.DataFrame(projected, index=scaled_raw_data_df.index)
+
+    if len(clustering_features) >= MAX_CLUSTERING_FEATURES:
+        oldest_key = next(iter(clustering_features))
+        clustering_features.pop(oldest_key)
+    clustering_features[key] = features
+    return features
@@ -1,11 +1,18 @@
 import logging
 import time
-from typing import List, Tuple, Union
+from concurrent.futures import Future
+from typing import Dict, List, Set, Tuple, Union
 import numpy as np
 import pandas as pd
-from sklearn.cluster import AgglomerativeClustering, KMeans, MiniBatchKMeans
 from sklearn.exceptions import ConvergenceWarning
-from heatmap_types import ItemNameAndData, HierarchicalAttribute
+from clustering_backends import cluster_rows
+from dendrogram import Dendrogram
+from duplicates import get_duplicate_ids
+from heatmap_types import ItemNameAndData, HierarchicalAttribute, ItemTree
+from knn_graph import KnnGraph
+from collection_index import CollectionIndex, split_by_labels
+from item_matrices import MERGE_FUNCTIONS, ItemMatrices, ItemStatistics
+from parallel_clustering import ParallelClustering, SharedArray, get_shared_object
 import warnings
 
 
@@ -16,8 +23,12 @@ logger = logging.getLogger("IHECH Logger")
 rounding_precision = 3
 
 
-def all_rows_same(df):
-    return (df == df.iloc[0]).all().all()
+def all_rows_same(rows: np.ndarray, chunk_size: int = 64) -> bool:
+    # compare in chunks, most clusters differ within their first rows
+    for start in range(1, rows.shape[0], chunk_size):
+        if (rows[start : start + chunk_size] != rows[0]).any():
+            return False
+    return True
 
 
 def insert_value_in_list_at_index(
@@ -36,91 +47,153 @@ def insert_value_in_item_name_and_data_at_index(
         insert_value_in_item_name_and_data_at_index(value, index, child)
 
 
-def append_average_item_by_attribute_indexes(
-    indexes: List[int],
-    item_name_and_data: ItemNameAndData,
-    attribute_aggregate_method: str = "mean",
-) -> None:
-    if item_name_and_data is None:
-        return
-    data = item_name_and_data.data
+ATTRIBUTE_AGGREGATE_METHODS = ("mean", "sum", "max", "min", "median", "binary")
 
-    # NOTE: initially, we just took the average by default. Later we added the option to use other aggregation methods.
-    # the method & function are still named 'avg'. this is confusing and should be changed.
-    if attribute_aggregate_method == "mean":
-        avg_data = np.round(np.mean([data[i] for i in indexes]), rounding_precision)
-    elif attribute_aggregate_method == "sum":
-        avg_data = np.round(np.sum([data[i] for i in indexes]), rounding_precision)
-    elif attribute_aggregate_method == "max":
-        avg_data = np.round(np.max([data[i] for i in indexes]), rounding_precision)
-    elif attribute_aggregate_method == "min":
-        avg_data = np.round(np.min([data[i] for i in indexes]), rounding_precision)
-    elif attribute_aggregate_method == "median":
-        avg_data = np.round(np.median([data[i] for i in indexes]), rounding_precision)
-    elif attribute_aggregate_method == "binary":
-        avg_data = float(any(data[i] > 0 for i in indexes))
-    else:
-        raise ValueError(f"Unknown aggregation method: {attribute_aggregate_method}")
+# Most gathered member cells held at once while appending the aggregate columns
+AGGREGATE_BLOCK_CELLS = 1 << 24
 
-    item_name_and_data.data.append(avg_data)
-    if item_name_and_data.children is None:
-        return
-    for child in item_name_and_data.children:
-        if child is not None:
-            append_average_item_by_attribute_indexes(
-                indexes, child, attribute_aggregate_method
-            )
 
-
-def append_all_average_items_by_attribute_indexes(
-    indexes: List[int],
-    item_names_and_data: List[ItemNameAndData],
+def reduce_segments(
+    segments_data: np.ndarray,
+    starts: np.ndarray,
+    counts: np.ndarray,
     attribute_aggregate_method: str,
-):
-    for item_name_and_data in item_names_and_data:
-        append_average_item_by_attribute_indexes(
-            indexes, item_name_and_data, attribute_aggregate_method
+) -> np.ndarray:
+    """Aggregate of every segment of rows segments_data[start:start + count], one
+    row per segment, NaN for empty segments."""
+    aggregates = np.full((len(counts), segments_data.shape[1]), np.nan)
+    non_empty = counts > 0
+    if not non_empty.any():
+        return aggregates
+
+    if attribute_aggregate_method == "median":
+        # no ufunc to reduce with, segments of equal length are reduced together
+        for count in np.unique(counts[non_empty]):
+            segments = np.flatnonzero(counts == count)
+            positions = starts[segments, None] + np.arange(count)
+            aggregates[segments] = np.median(segments_data[positions], axis=1)
+        return aggregates
+
+    if attribute_aggregate_method == "binary":
+        segments_data = (segments_data > 0).astype(float)
+    ufunc = {
+        "mean": np.add,
+        "sum": np.add,
+        "max": np.maximum,
+        "min": np.minimum,
+        "binary": np.maximum,
+    }[attribute_aggregate_method]
+    # reduceat reduces up to the next start, so empty segments are left out
+    reduced = ufunc.reduceat(segments_data, starts[non_empty], axis=0)
+    if attribute_aggregate_method == "mean":
+        reduced /= counts[non_empty, None]
+    aggregates[non_empty] = reduced
+    return aggregates
+
+
+class AttributeAggregateColumns:
+    """Collects the attribute clusters while they are built and appends all
+    their aggregate columns to the item nodes at once afterwards."""
+
+    number_of_attributes: int
+    attribute_indexes: List[np.ndarray]
+
+    def __init__(self, number_of_attributes: int):
+        self.number_of_attributes = number_of_attributes
+        self.attribute_indexes = []
+
+    def add(self, indexes) -> int:
+        """Registers an attribute cluster and returns the data index of its column."""
+        self.attribute_indexes.append(np.asarray(indexes, dtype=np.int64))
+        return self.number_of_attributes + len(self.attribute_indexes) - 1
+
+    def append_to_items(
+        self,
+        item_tree: ItemTree,
+        attribute_aggregate_method: str = "mean",
+    ) -> None:
+        # NOTE: initially, we just took the average by default. Later we added the option to use other aggregation methods.
+        if attribute_aggregate_method not in ATTRIBUTE_AGGREGATE_METHODS:
+            raise ValueError(f"Unknown aggregation method: {attribute_aggregate_method}")
+
+        # the members of all clusters one after another, every cluster is a segment
+        counts = np.array(
+            [len(indexes) for indexes in self.attribute_indexes], dtype=np.int64
         )
-
-
-def get_current_data_length(item_names_and_data: List[ItemNameAndData]):
-    return len(item_names_and_data[0].data)
+        members = np.concatenate(self.attribute_indexes + [np.empty(0, dtype=np.int64)])
+        starts = np.cumsum(counts) - counts
+
+        data = item_tree.get_data(self.number_of_attributes)
+        columns = np.empty((data.shape[0], len(counts)))
+        # attributes as rows, so gathering and reducing them moves whole rows, for a
+        # block of item nodes at a time to bound the memory of the gathered members
+        block_size = max(AGGREGATE_BLOCK_CELLS // max(len(members), 1), 1)
+        for block_start in range(0, data.shape[0], block_size):
+            block = slice(block_start, block_start + block_size)
+            rotated_block = np.ascontiguousarray(data[block].T)
+            columns[block] = reduce_segments(
+                rotated_block[members], starts, counts, attribute_aggregate_method
+            ).T
+
+        if attribute_aggregate_method in ("sum", "max", "min"):
+            # aggregates of integer data stay integers
+            integer_rows = item_tree.get_integer_rows()
+        else:
+            integer_rows = np.zeros(data.shape[0], dtype=bool)
+        item_tree.append_columns(columns, integer_rows)
 
 
 def cluster_attributes_recursively(
-    rotated_raw_data_df: pd.DataFrame,
+    attribute_stds: np.ndarray,
     rotated_scaled_raw_data_df: pd.DataFrame,
     rotated_hierarchical_columns_metadata_df: pd.DataFrame,
     rotated_column_names_df: pd.DataFrame,
-    item_names_and_data: List[ItemNameAndData],
+    item_tree: ItemTree,
     cluster_size: int,
     cluster_by_collections: bool,
     attribute_aggregate_method: str,
     hierarchical_column_metadata_row_indexes: List[int],
     level: int,
-    selected_attributes: List[str],
+    selected_attributes: Set[str],
+    dendrogram: Union[Dendrogram, None] = None,
+    clustering_backend: str = "AUTO",
+    aggregate_columns: Union[AttributeAggregateColumns, None] = None,
+    collection_index: Union[CollectionIndex, None] = None,
+    collapse_duplicates: bool = False,
+    duplicate_ids: Union[np.ndarray, None] = None,
 ) -> Union[List[ItemNameAndData], None]:
     # Case: root level
     if level == 0:
+        aggregate_columns = AttributeAggregateColumns(item_tree.data.shape[1])
+        if collapse_duplicates:
+            # attributes with identical scaled columns are clustered as one
+            duplicate_ids = get_duplicate_ids(rotated_scaled_raw_data_df.values)
+        if cluster_by_collections:
+            collection_index = CollectionIndex.from_frame(
+                rotated_hierarchical_columns_metadata_df,
+                [str(row_index) for row_index in hierarchical_column_metadata_row_indexes],
+            )
         indexes = list(range(rotated_scaled_raw_data_df.shape[0]))
-        new_attribute_index = get_current_data_length(item_names_and_data)
-        append_all_average_items_by_attribute_indexes(
-            indexes, item_names_and_data, attribute_aggregate_method
-        )
+        new_attribute_index = aggregate_columns.add(indexes)
         new_attribute_name = f""
 
         children_0 = cluster_attributes_recursively(
-            rotated_raw_data_df,
+            attribute_stds,
             rotated_scaled_raw_data_df,
             rotated_hierarchical_columns_metadata_df,
             rotated_column_names_df,
-            item_names_and_data,
+            item_tree,
             cluster_size,
             cluster_by_collections,
             attribute_aggregate_method,
             hierarchical_column_metadata_row_indexes,
             level + 1,
             selected_attributes,
+            dendrogram=dendrogram,
+            clustering_backend=clustering_backend,
+            aggregate_columns=aggregate_columns,
+            collection_index=collection_index,
+            duplicate_ids=duplicate_ids,
         )
 
         new_hierarchical_attribute = HierarchicalAttribute(
@@ -133,35 +206,32 @@ def cluster_attributes_recursively(
             children=children_0,
         )
 
+        aggregate_columns.append_to_items(
+            item_tree, attribute_aggregate_method
+        )
         return [new_hierarchical_attribute]
 
     # Case: Cluster by collections
     if cluster_by_collections and len(hierarchical_column_metadata_row_indexes) > 0:
         new_collection_hierarchical_attributes: List[Tuple[ItemNameAndData, float]] = []
         collection_row_index = hierarchical_column_metadata_row_indexes[0]
+        collection_level = collection_index.column_names.index(str(collection_row_index))
 
-        for (
-            collection,
-            rotated_hierarchical_columns_metadata_group_df,
-        ) in rotated_hierarchical_columns_metadata_df.groupby(
-            str(collection_row_index)
+        for code, indexes_of_current_group in collection_index.get_runs(
+            rotated_hierarchical_columns_metadata_df.index.values,
+            str(collection_row_index),
         ):
-            indexes_of_current_group = (
-                rotated_hierarchical_columns_metadata_group_df.index
-            )
-            group_data_attribute_index = get_current_data_length(item_names_and_data)
-            append_all_average_items_by_attribute_indexes(
-                indexes_of_current_group,
-                item_names_and_data,
-                attribute_aggregate_method,
+            if code < 0:
+                continue
+            collection = collection_index.collections[collection_level][code]
+            rotated_hierarchical_columns_metadata_group_df = (
+                rotated_hierarchical_columns_metadata_df.loc[indexes_of_current_group]
             )
+            group_data_attribute_index = aggregate_columns.add(indexes_of_current_group)
             remaining_collection_row_indexes = hierarchical_column_metadata_row_indexes[
                 1:
             ]
 
-            rotated_raw_data_group_df = rotated_raw_data_df.loc[
-                indexes_of_current_group
-            ]
             rotated_scaled_raw_data_group_df = rotated_scaled_raw_data_df.loc[
                 indexes_of_current_group
             ]
@@ -169,8 +239,8 @@ def cluster_attributes_recursively(
                 indexes_of_current_group
             ]
 
-            new_hierarchical_attribute_std = rotated_raw_data_group_df.std(
-                axis=1
+            new_hierarchical_attribute_std = attribute_stds.take(
+                indexes_of_current_group
             ).mean()
             new_hierarchical_attribute_names = str(collection)
 
@@ -182,7 +252,7 @@ def cluster_attributes_recursively(
                 solo_child_attribute_index = (
                     rotated_hierarchical_columns_metadata_group_df.index[0]
                 )
-                solo_child_std = rotated_raw_data_group_df.iloc[0, :].std()
+                solo_child_std = attribute_stds[solo_child_attribute_index]
                 new_children = [
                     HierarchicalAttribute(
                         attributeName=solo_child_name,
@@ -196,17 +266,22 @@ def cluster_attributes_recursively(
                 ]
             else:
                 new_children = cluster_attributes_recursively(
-                    rotated_raw_data_group_df,
+                    attribute_stds,
                     rotated_scaled_raw_data_group_df,
                     rotated_hierarchical_columns_metadata_group_df,
                     rotated_column_names_group_df,
-                    item_names_and_data,
+                    item_tree,
                     cluster_size,
                     cluster_by_collections,
                     attribute_aggregate_method,
                     remaining_collection_row_indexes,
                     level + 1,
                     selected_attributes,
+                    dendrogram=dendrogram,
+                    clustering_backend=clustering_backend,
+                    aggregate_columns=aggregate_columns,
+                    collection_index=collection_index,
+                    duplicate_ids=duplicate_ids,
                 )
 
             average_hierarchical_attribute_index = np.mean(
@@ -230,7 +305,7 @@ def cluster_attributes_recursively(
     # Case: Only few items left or all items are the same or cluster size set to <= 1
     if (
         rotated_scaled_raw_data_df.shape[0] <= cluster_size
-        or all_rows_same(rotated_scaled_raw_data_df)
+        or all_rows_same(rotated_scaled_raw_data_df.values)
         or cluster_size <= 1
     ):
         if rotated_scaled_raw_data_df.shape[0] == 0:
@@ -244,7 +319,7 @@ def cluster_attributes_recursively(
 
         for i in range(rotated_scaled_raw_data_df.shape[0]):
             new_attribute_index = new_attribute_indexes[i]
-            new_attribute_std = rotated_raw_data_df.iloc[i, :].std()
+            new_attribute_std = attribute_stds[new_attribute_index]
             new_attribute = HierarchicalAttribute(
                 attributeName=new_attribute_names[i],
                 dataAttributeIndex=new_attribute_index,
@@ -261,14 +336,18 @@ def cluster_attributes_recursively(
 
     # Case: Dynamic clustering based on item similarity
     else:
-        if rotated_scaled_raw_data_df.shape[0] > 5000:
-            kmeans = MiniBatchKMeans(n_clusters=cluster_size, n_init=1, random_state=42)
-            labels = kmeans.fit_predict(rotated_scaled_raw_data_df)
-        else:
-            hierarchical = AgglomerativeClustering(
-                n_clusters=cluster_size, linkage="ward"
-            )
-            labels = hierarchical.fit_predict(rotated_scaled_raw_data_df)
+        labels = cluster_rows(
+            rotated_scaled_raw_data_df.values,
+            rotated_scaled_raw_data_df.index,
+            cluster_size,
+            clustering_backend,
+            dendrogram=dendrogram,
+            duplicate_ids=(
+                duplicate_ids[rotated_scaled_raw_data_df.index.values]
+                if duplicate_ids is not None
+                else None
+            ),
+        )
 
         new_clustered_hierarchical_attributes: List[HierarchicalAttribute] = []
 
@@ -278,9 +357,6 @@ def cluster_attributes_recursively(
         }
 
         for _, current_cluster_indexes in cluster_indices.items():
-            rotated_raw_data_cluster_df = rotated_raw_data_df.loc[
-                current_cluster_indexes
-            ]
             rotated_scaled_raw_data_cluster_df = rotated_scaled_raw_data_df.loc[
                 current_cluster_indexes
             ]
@@ -304,7 +380,9 @@ def cluster_attributes_recursively(
                 )
 
                 for i in range(rotated_scaled_raw_data_cluster_df.shape[0]):
-                    new_attribute_std = rotated_raw_data_cluster_df.iloc[i, :].std()
+                    new_attribute_std = attribute_stds[
+                        rotated_scaled_raw_data_cluster_df.index[i]
+                    ]
                     new_attribute = HierarchicalAttribute(
                         attributeName=new_cluster_attribute_names[i],
                         dataAttributeIndex=rotated_scaled_raw_data_cluster_df.index[i],
@@ -324,7 +402,9 @@ def cluster_attributes_recursively(
 
             if rotated_scaled_raw_data_cluster_df.shape[0] == 1:
                 new_attribute_name = rotated_column_names_cluster_df.iloc[0, 0]
-                new_attribute_std = rotated_raw_data_cluster_df.iloc[0, :].std()
+                new_attribute_std = attribute_stds[
+                    rotated_scaled_raw_data_cluster_df.index[0]
+                ]
                 new_attribute = HierarchicalAttribute(
                     attributeName=new_attribute_name,
                     dataAttributeIndex=rotated_scaled_raw_data_cluster_df.index[0],
@@ -338,27 +418,29 @@ def cluster_attributes_recursively(
                 continue
 
             children = cluster_attributes_recursively(
-                rotated_raw_data_cluster_df,
+                attribute_stds,
                 rotated_scaled_raw_data_cluster_df,
                 rotated_hierarchical_columns_metadata_cluster_df,
                 rotated_column_names_cluster_df,
-                item_names_and_data,
+                item_tree,
                 cluster_size,
                 cluster_by_collections,
                 attribute_aggregate_method,
                 hierarchical_column_metadata_row_indexes,
                 level + 1,
                 selected_attributes,
+                dendrogram=dendrogram,
+                clustering_backend=clustering_backend,
+                aggregate_columns=aggregate_columns,
+                collection_index=collection_index,
+                duplicate_ids=duplicate_ids,
             )
             indices_list = list(current_cluster_indexes)
-            new_index = get_current_data_length(item_names_and_data)
-            append_all_average_items_by_attribute_indexes(
-                indices_list, item_names_and_data, attribute_aggregate_method
-            )
+            new_index = aggregate_columns.add(indices_list)
             average_index = np.mean(indices_list)
             new_hierarchical_attribute_name = ""
-            new_hierarchical_attribute_std = rotated_raw_data_cluster_df.std(
-                axis=1
+            new_hierarchical_attribute_std = attribute_stds.take(
+                current_cluster_indexes
             ).mean()
             new_hierarchical_attribute = HierarchicalAttribute(
                 attributeName=new_hierarchical_attribute_name,
@@ -374,316 +456,418 @@ def cluster_attributes_recursively(
         return new_clustered_hierarchical_attributes
 
 
+def create_leaf_items(
+    matrices: ItemMatrices, positions: np.ndarray
+) -> List[ItemNameAndData]:
+    new_item_names_and_data: List[ItemNameAndData] = []
+    new_item_names = matrices.item_names[positions].astype(str).tolist()
+    dimReductionsX = np.round(matrices.dim_red[0, positions], rounding_precision).tolist()
+    dimReductionsY = np.round(matrices.dim_red[1, positions], rounding_precision).tolist()
+    all_data = np.round(matrices.raw_data.take(positions, axis=1).T, rounding_precision)
+    item_indexes = matrices.item_indexes[positions]
+
+    for i in range(len(positions)):
+        new_item_name_and_data = ItemNameAndData(
+            index=item_indexes[i],
+            itemName=new_item_names[i],
+            isOpen=False,
+            data=all_data[i],
+            amountOfDataPoints=1,
+            dimReductionX=dimReductionsX[i],
+            dimReductionY=dimReductionsY[i],
+            children=None,
+        )
+
+        new_item_names_and_data.append(new_item_name_and_data)
+
+    return new_item_names_and_data
+
+
 def cluster_items_recursively(
-    raw_data_df: pd.DataFrame,
-    hierarchical_rows_metadata_df: pd.DataFrame,
-    item_names_df: pd.DataFrame,
-    scaled_raw_data_df: pd.DataFrame,
-    dim_red_df: pd.DataFrame,
+    matrices: ItemMatrices,
+    positions: np.ndarray,
     cluster_size: int,
     cluster_by_collections: bool,
     aggregate_method: str, # 'mean' | 'sum' | 'max' | 'min' | 'median' | 'binary'
     hierarchical_rows_metadata_column_names: List[str],
     level: int,
+    knn_graph: Union[KnnGraph, None] = None,
+    dendrogram: Union[Dendrogram, None] = None,
+    clustering_backend: str = "AUTO",
+    parallel_clustering: Union[ParallelClustering, None] = None,
+    cluster_after_dim_red: bool = False,
 ) -> Union[List[ItemNameAndData], None]:
+    """Builds the item hierarchy of the items at `positions` of the matrices.
+
+    With cluster_after_dim_red the clustered rows are the 2-D embedding, which
+    is split at medians like a KD-tree in O(n log n) instead of with
+    clustering_backend."""
+    if cluster_after_dim_red:
+        clustering_backend = "KD_TREE"
+    children, statistics = cluster_item_children(
+        matrices,
+        positions,
+        cluster_size,
+        cluster_by_collections,
+        aggregate_method,
+        hierarchical_rows_metadata_column_names,
+        level + 1 if level == 0 else level,
+        knn_graph=knn_graph,
+        dendrogram=dendrogram,
+        clustering_backend=clustering_backend,
+        parallel_clustering=parallel_clustering,
+    )
+    if level > 0:
+        return children
+
     # Case: root level
-    if level == 0:
-        tag_data_0_aggregated, dim_reduction_0_aggregated = (
-            compute_item_aggregated_statistics(
-                raw_data_df, dim_red_df, aggregate_method
-            )
+    tag_data_0_aggregated, dim_reduction_0_aggregated = (
+        get_item_aggregated_statistics(
+            statistics, matrices, positions, aggregate_method
         )
+    )
 
-        new_item_name_0 = ""
-
-        children_0 = cluster_items_recursively(
-            raw_data_df,
-            hierarchical_rows_metadata_df,
-            item_names_df,
-            scaled_raw_data_df,
-            dim_red_df,
-            cluster_size,
-            cluster_by_collections,
-            aggregate_method,
-            hierarchical_rows_metadata_column_names,
-            level + 1,
-        )
+    new_item_name_0 = ""
+
+    new_aggregated_item_name_and_data = ItemNameAndData(
+        index=None,
+        itemName=new_item_name_0,
+        isOpen=True,
+        data=tag_data_0_aggregated,
+        amountOfDataPoints=len(positions),
+        dimReductionX=dim_reduction_0_aggregated[0],
+        dimReductionY=dim_reduction_0_aggregated[1],
+        children=children,
+    )
 
-        new_aggregated_item_name_and_data = ItemNameAndData(
-            index=None,
-            itemName=new_item_name_0,
-            isOpen=True,
-            data=tag_data_0_aggregated,
-            amountOfDataPoints=raw_data_df.shape[0],
-            dimReductionX=dim_reduction_0_aggregated[0],
-            dimReductionY=dim_reduction_0_aggregated[1],
-            children=children_0,
-        )
+    return [new_aggregated_item_name_and_data]
 
-        return [new_aggregated_item_name_and_data]
 
+def cluster_item_children(
+    matrices: ItemMatrices,
+    positions: np.ndarray,
+    cluster_size: int,
+    cluster_by_collections: bool,
+    aggregate_method: str,
+    hierarchical_rows_metadata_column_names: List[str],
+    level: int,
+    knn_graph: Union[KnnGraph, None] = None,
+    dendrogram: Union[Dendrogram, None] = None,
+    clustering_backend: str = "AUTO",
+    parallel_clustering: Union[ParallelClustering, None] = None,
+) -> Tuple[List[ItemNameAndData], ItemStatistics]:
+    """Children of the node holding the items at `positions`, together with the
+    statistics of those items, merged bottom-up from the children."""
     is_open = False
 
     # Case: Cluster by collections
     if cluster_by_collections and len(hierarchical_rows_metadata_column_names) > 0:
-        new_collection_item_names_and_data: List[Tuple[ItemNameAndData, float]] = []
+        new_collection_item_names_and_data: List[ItemNameAndData] = []
+        subtrees: List[Tuple[ItemNameAndData, np.ndarray, object]] = []
         collection_column_name = hierarchical_rows_metadata_column_names[0]
-        for (
-            collection,
-            hierarchical_rows_metadata_group_df,
-        ) in hierarchical_rows_metadata_df.groupby(collection_column_name):
-            indexes_of_current_group = hierarchical_rows_metadata_group_df.index
-            remaining_collection_column_names = hierarchical_rows_metadata_column_names[
-                1:
-            ]
-
-            raw_data_group_df = raw_data_df.loc[indexes_of_current_group]
-            scaled_raw_data_group_df = scaled_raw_data_df.loc[indexes_of_current_group]
-            dim_red_group_df = dim_red_df.loc[indexes_of_current_group]
-            item_names_group_df = item_names_df.loc[indexes_of_current_group]
+        remaining_collection_column_names = hierarchical_rows_metadata_column_names[1:]
+        groups, positions_without_collection = matrices.group_by_collection(
+            positions, collection_column_name
+        )
+        # items without a collection are not shown but still count for the parent
+        statistics = ItemStatistics.from_positions(
+            matrices, positions_without_collection, aggregate_method
+        )
 
-            tag_data_aggregated, dim_reduction_aggregated = (
-                compute_item_aggregated_statistics(
-                    raw_data_group_df, dim_red_group_df, aggregate_method
+        for collection, group_positions in groups:
+            if len(group_positions) == 1 and len(remaining_collection_column_names) == 0:
+                subtree = (
+                    create_leaf_items(matrices, group_positions),
+                    ItemStatistics.from_positions(
+                        matrices, group_positions, aggregate_method
+                    ),
                 )
-            )
-            new_item_name = str(collection)
-
-            if (
-                raw_data_group_df.shape[0] == 1
-                and len(remaining_collection_column_names) == 0
-            ):
-                solo_child_name = str(item_names_group_df.iloc[0, 0])
-                solo_child_data = np.round(
-                    raw_data_group_df.iloc[0], rounding_precision
-                ).tolist()
-                new_children = [
-                    ItemNameAndData(
-                        index=raw_data_group_df.index[0],
-                        itemName=solo_child_name,
-                        isOpen=is_open,
-                        data=solo_child_data,
-                        amountOfDataPoints=1,
-                        dimReductionX=np.round(
-                            dim_red_group_df.iloc[0][0],
-                            rounding_precision,
-                        ),
-                        dimReductionY=np.round(
-                            dim_red_group_df.iloc[0][1],
-                            rounding_precision,
-                        ),
-                        children=None,
-                    )
-                ]
             else:
-                new_children = cluster_items_recursively(
-                    raw_data_group_df,
-                    hierarchical_rows_metadata_group_df,
-                    item_names_group_df,
-                    scaled_raw_data_group_df,
-                    dim_red_group_df,
+                subtree = cluster_items_subtree_or_submit(
+                    matrices,
+                    group_positions,
                     cluster_size,
                     cluster_by_collections,
                     aggregate_method,
                     remaining_collection_column_names,
                     level + 1,
+                    knn_graph=knn_graph,
+                    dendrogram=dendrogram,
+                    clustering_backend=clustering_backend,
+                    parallel_clustering=parallel_clustering,
                 )
 
             new_item_name_and_data = ItemNameAndData(
                 index=None,
-                itemName=new_item_name,
+                itemName=str(collection),
                 isOpen=is_open,
-                data=tag_data_aggregated,
-                amountOfDataPoints=hierarchical_rows_metadata_group_df.shape[0],
-                dimReductionX=dim_reduction_aggregated[0],
-                dimReductionY=dim_reduction_aggregated[1],
-                children=new_children,
+                data=None,
+                amountOfDataPoints=len(group_positions),
+                dimReductionX=None,
+                dimReductionY=None,
+                children=None,
             )
 
             new_collection_item_names_and_data.append(new_item_name_and_data)
+            subtrees.append((new_item_name_and_data, group_positions, subtree))
+
+        finish_subtrees(subtrees, statistics, matrices, aggregate_method)
+        return new_collection_item_names_and_data, statistics
 
-        return new_collection_item_names_and_data
+    scaled_rows = matrices.get_scaled_rows(positions)
 
     # Case: Only few items left or all items are the same or cluster size set to <= 1
     if (
-        raw_data_df.shape[0] <= cluster_size
-        or all_rows_same(scaled_raw_data_df)
+        len(positions) <= cluster_size
+        or all_rows_same(scaled_rows)
         or cluster_size <= 1
     ):
-        if raw_data_df.shape[0] == 0:
+        if len(positions) == 0:
             raise Exception("No items in cluster")
-        if raw_data_df.shape[0] == 1:
+        if len(positions) == 1:
             raise Exception("Only one item in cluster")
 
-        new_item_names_and_data: List[Tuple[ItemNameAndData, float]] = []
-        new_item_names = item_names_df[item_names_df.columns[0]].astype(str).tolist()
-        dimReductionsX = np.round(dim_red_df[0], rounding_precision).tolist()
-        dimReductionsY = np.round(dim_red_df[1], rounding_precision).tolist()
-        all_data = np.round(raw_data_df.values, rounding_precision).tolist()
-
-        for i in range(raw_data_df.shape[0]):
-
-            new_item_name_and_data = ItemNameAndData(
-                index=raw_data_df.index[i],
-                itemName=new_item_names[i],
-                isOpen=is_open,
-                data=all_data[i],
-                amountOfDataPoints=1,
-                dimReductionX=dimReductionsX[i],
-                dimReductionY=dimReductionsY[i],
-                children=None,
-            )
-
-            new_item_names_and_data.append(new_item_name_and_data)
-
-        return new_item_names_and_data
+        return (
+            create_leaf_items(matrices, positions),
+            ItemStatistics.from_positions(matrices, positions, aggregate_method),
+        )
 
     # Case: Dynamic clustering based on item similarity
     else:
-        if scaled_raw_data_df.shape[0] > 5000:
-            kmeans = MiniBatchKMeans(n_clusters=cluster_size, n_init=1, random_state=42)
-            labels = kmeans.fit_predict(scaled_raw_data_df)
-        else:
-            hierarchical = AgglomerativeClustering(
-                n_clusters=cluster_size, linkage="ward"
-            )
-            labels = hierarchical.fit_predict(scaled_raw_data_df)
-
-        new_clustered_item_names_and_data: List[Tuple[ItemNameAndData, float]] = []
-
-        cluster_indices = {
-            cluster_id: raw_data_df.index[labels == cluster_id]
-            for cluster_id in np.unique(labels)
-        }
-
-        for _, current_cluster_indexes in cluster_indices.items():
-
-            raw_data_cluster_df = raw_data_df.loc[current_cluster_indexes]
-            scaled_raw_data_cluster_df = scaled_raw_data_df.loc[current_cluster_indexes]
-            dim_red_cluster_df = dim_red_df.loc[current_cluster_indexes]
-            item_names_cluster_df = item_names_df.loc[current_cluster_indexes]
-            hierarchical_rows_metadata_cluster_df = hierarchical_rows_metadata_df.loc[
-                current_cluster_indexes
-            ]
+        labels = cluster_rows(
+            scaled_rows,
+            matrices.item_indexes[positions],
+            cluster_size,
+            clustering_backend,
+            knn_graph=knn_graph,
+            dendrogram=dendrogram,
+            duplicate_ids=(
+                matrices.duplicate_ids[positions]
+                if matrices.duplicate_ids is not None
+                else None
+            ),
+        )
 
-            if raw_data_cluster_df.shape[0] <= 0:
-                continue
+        new_clustered_item_names_and_data: List[ItemNameAndData] = []
+        subtrees: List[Tuple[ItemNameAndData, np.ndarray, object]] = []
+        leaf_positions: List[np.ndarray] = []
 
-            if raw_data_cluster_df.shape[0] == raw_data_df.shape[0]:
+        for cluster_offsets in split_by_labels(labels):
+            cluster_positions = positions[cluster_offsets]
 
-                new__cluster_item_names = (
-                    item_names_cluster_df[item_names_cluster_df.columns[0]]
-                    .astype(str)
-                    .tolist()
+            if len(cluster_positions) == len(positions):
+                new_clustered_item_names_and_data.extend(
+                    create_leaf_items(matrices, cluster_positions)
                 )
-                dimReductionsX = np.round(
-                    dim_red_cluster_df[0], rounding_precision
-                ).tolist()
-                dimReductionsY = np.round(
-                    dim_red_cluster_df[1], rounding_precision
-                ).tolist()
-                all_data = np.round(
-                    raw_data_cluster_df.values, rounding_precision
-                ).tolist()
-
-                for i in range(raw_data_cluster_df.shape[0]):
-                    new_item_name_and_data = ItemNameAndData(
-                        index=raw_data_cluster_df.index[i],
-                        itemName=new__cluster_item_names[i],
-                        isOpen=is_open,
-                        data=all_data[i],
-                        amountOfDataPoints=1,
-                        dimReductionX=dimReductionsX[i],
-                        dimReductionY=dimReductionsY[i],
-                        children=None,
-                    )
-
-                    new_clustered_item_names_and_data.append(new_item_name_and_data)
+                leaf_positions.append(cluster_positions)
                 continue
 
-            if raw_data_cluster_df.shape[0] == 1:
-                new_item_name = item_names_cluster_df[
-                    item_names_cluster_df.columns[0]
-                ].iloc[0]
-                new_data = np.round(
-                    raw_data_cluster_df.iloc[0], rounding_precision
-                ).tolist()
+            if len(cluster_positions) == 1:
+                position = cluster_positions[0]
                 new_item_name_and_data = ItemNameAndData(
-                    index=raw_data_cluster_df.index[0],
-                    itemName=new_item_name,
+                    index=matrices.item_indexes[position],
+                    itemName=matrices.item_names[position],
                     isOpen=is_open,
-                    data=new_data,
+                    data=np.round(
+                        matrices.raw_data[:, position], rounding_precision
+                    ),
                     amountOfDataPoints=1,
                     dimReductionX=np.round(
-                        dim_red_cluster_df.iloc[0][0], rounding_precision
+                        matrices.dim_red[0, position], rounding_precision
                     ),
                     dimReductionY=np.round(
-                        dim_red_cluster_df.iloc[0][1], rounding_precision
+                        matrices.dim_red[1, position], rounding_precision
                     ),
                     children=None,
                 )
                 new_clustered_item_names_and_data.append(new_item_name_and_data)
+                leaf_positions.append(cluster_positions)
                 continue
 
-            tag_data_aggregated, dim_reduction_aggregated = (
-                compute_item_aggregated_statistics(
-                    raw_data_cluster_df, dim_red_cluster_df, aggregate_method
-                )
-            )
-
-            new_item_name = ""
-            children = cluster_items_recursively(
-                raw_data_cluster_df,
-                hierarchical_rows_metadata_cluster_df,
-                item_names_cluster_df,
-                scaled_raw_data_cluster_df,
-                dim_red_cluster_df,
+            subtree = cluster_items_subtree_or_submit(
+                matrices,
+                cluster_positions,
                 cluster_size,
                 cluster_by_collections,
                 aggregate_method,
                 hierarchical_rows_metadata_column_names,
                 level + 1,
+                knn_graph=knn_graph,
+                dendrogram=dendrogram,
+                clustering_backend=clustering_backend,
+                parallel_clustering=parallel_clustering,
             )
 
             new_aggregated_item_name_and_data = ItemNameAndData(
                 index=None,
-                itemName=new_item_name,
+                itemName="",
                 isOpen=is_open,
-                data=tag_data_aggregated,
-                amountOfDataPoints=raw_data_cluster_df.shape[0],
-                dimReductionX=dim_reduction_aggregated[0],
-                dimReductionY=dim_reduction_aggregated[1],
-                children=children,
+                data=None,
+                amountOfDataPoints=len(cluster_positions),
+                dimReductionX=None,
+                dimReductionY=None,
+                children=None,
             )
             new_clustered_item_names_and_data.append(new_aggregated_item_name_and_data)
+            subtrees.append((new_aggregated_item_name_and_data, cluster_positions, subtree))
 
-        return new_clustered_item_names_and_data
+        # items directly below this node are read once, everything else is merged
+        statistics = ItemStatistics.from_positions(
+            matrices,
+            np.concatenate(leaf_positions) if leaf_positions else positions[:0],
+            aggregate_method,
+        )
+        finish_subtrees(subtrees, statistics, matrices, aggregate_method)
+        return new_clustered_item_names_and_data, statistics
+
+
+def finish_subtrees(
+    subtrees: List[Tuple[ItemNameAndData, np.ndarray, object]],
+    statistics: ItemStatistics,
+    matrices: ItemMatrices,
+    aggregate_method: str,
+) -> None:
+    """Attaches the children of every subtree node, waiting for the ones built
+    by a worker in submission order, aggregates the nodes from the children's
+    statistics and merges those into `statistics`."""
+    for item_name_and_data, subtree_positions, subtree in subtrees:
+        if isinstance(subtree, Future):
+            subtree = subtree.result()
+        children, subtree_statistics = subtree
+        tag_data_aggregated, dim_reduction_aggregated = (
+            get_item_aggregated_statistics(
+                subtree_statistics, matrices, subtree_positions, aggregate_method
+            )
+        )
+        item_name_and_data.data = tag_data_aggregated
+        item_name_and_data.dimReductionX = dim_reduction_aggregated[0]
+        item_name_and_data.dimReductionY = dim_reduction_aggregated[1]
+        item_name_and_data.children = children
+        statistics.merge(subtree_statistics)
+
+
+def cluster_items_subtree_or_submit(
+    matrices: ItemMatrices,
+    positions: np.ndarray,
+    cluster_size: int,
+    cluster_by_collections: bool,
+    aggregate_method: str,
+    hierarchical_rows_metadata_column_names: List[str],
+    level: int,
+    knn_graph: Union[KnnGraph, None] = None,
+    dendrogram: Union[Dendrogram, None] = None,
+    clustering_backend: str = "AUTO",
+    parallel_clustering: Union[ParallelClustering, None] = None,
+) -> Union[Tuple[List[ItemNameAndData], ItemStatistics], Future]:
+    """Clusters a subtree inline, or returns the Future of a worker clustering it."""
+    args = (
+        cluster_size,
+        cluster_by_collections,
+        aggregate_method,
+        hierarchical_rows_metadata_column_names,
+        level,
+    )
+    if parallel_clustering is not None and parallel_clustering.should_submit(
+        len(positions), level
+    ):
+        # the worker reads the kNN graph and the dendrogram from shared memory
+        return parallel_clustering.submit(
+            cluster_items_subtree,
+            positions,
+            matrices.take_labels(positions),
+            *args,
+            clustering_backend=clustering_backend,
+        )
+    return cluster_item_children(
+        matrices,
+        positions,
+        *args,
+        knn_graph=knn_graph,
+        dendrogram=dendrogram,
+        clustering_backend=clustering_backend,
+        parallel_clustering=parallel_clustering,
+    )
+
+
+def cluster_items_subtree(
+    arrays: Dict[str, SharedArray],
+    positions: np.ndarray,
+    labels: ItemMatrices,
+    *args,
+    **kwargs,
+) -> Tuple[List[ItemNameAndData], ItemStatistics]:
+    """Worker side of ParallelClustering: clusters one subtree sequentially."""
+    matrices = labels.with_numeric(
+        arrays["raw_data"].take(positions, axis=1),
+        arrays["scaled_raw_data"].take(positions, axis=1),
+        arrays["dim_red"].take(positions, axis=1),
+    )
+    return cluster_item_children(
+        matrices,
+        np.arange(len(positions)),
+        *args,
+        knn_graph=get_shared_object(arrays, "knn_graph", KnnGraph.from_shared_arrays),
+        dendrogram=get_shared_object(
+            arrays, "dendrogram", Dendrogram.from_shared_arrays
+        ),
+        **kwargs,
+    )
+
+
+def get_item_aggregated_statistics(
+    statistics: ItemStatistics,
+    matrices: ItemMatrices,
+    positions: np.ndarray,
+    method: str,
+) -> Tuple[np.ndarray, List[float]]:
+    """Aggregated data of a node from its merged statistics. Methods that cannot
+    be merged, like the exact median, are computed from the rows of the node."""
+    if statistics.median_sketch is not None:
+        tag_data = statistics.median_sketch.get_median()
+    elif method not in MERGE_FUNCTIONS:
+        return compute_item_aggregated_statistics(matrices, positions, method)
+    elif method == "mean":
+        tag_data = statistics.values / statistics.count
+    elif method == "binary":
+        tag_data = statistics.values.astype(float)
+    else:
+        tag_data = statistics.values
+    tag_data = np.round(tag_data, rounding_precision)
+    dim_reduction = np.round(
+        statistics.dim_red_sum / statistics.count, rounding_precision
+    ).tolist()
+
+    return tag_data, dim_reduction
 
 
 def compute_item_aggregated_statistics(
-    raw_data: pd.DataFrame, dim_red_data: pd.DataFrame, method: str = "mean"
-) -> Tuple[List[float], List[float]]:
+    matrices: ItemMatrices, positions: np.ndarray, method: str = "mean"
+) -> Tuple[np.ndarray, List[float]]:
     """Compute aggregated statistics for raw data and dimension reduction values."""
     if method == "mean":
-        agg_func = lambda df: df.mean()
+        agg_func = lambda rows: rows.mean(axis=1)
     elif method == "sum":
-        agg_func = lambda df: df.sum()
+        agg_func = lambda rows: rows.sum(axis=1)
     elif method == "max":
-        agg_func = lambda df: df.max()
+        agg_func = lambda rows: rows.max(axis=1)
     elif method == "min":
-        agg_func = lambda df: df.min()
+        agg_func = lambda rows: rows.min(axis=1)
     elif method == "median":
-        agg_func = lambda df: df.median()
+        agg_func = lambda rows: np.median(rows, axis=1)
     elif method == "binary":
-        agg_func = lambda df: (df > 0).any().astype(float)  # Returns 1.0 if any value > 0, else 0.0
+        agg_func = lambda rows: (rows > 0).any(axis=1).astype(float)  # Returns 1.0 if any value > 0, else 0.0
     else:
         raise ValueError(f"Unknown aggregation method: {method}")
 
-    tag_data = np.round(agg_func(raw_data), rounding_precision).tolist()
+    tag_data = np.round(
+        agg_func(matrices.raw_data.take(positions, axis=1)), rounding_precision
+    )
     # NOTE: is this desired behavior? aggregating dim red values seems weird ?!
     # CONCLUSION: taking anything else than 'mean' for dim red values does not make sense!
     # this problem was only introduced with the new 'aggregate_method' parameter, which allowed to use other aggregation methods than 'mean'.
     # dim_reduction = np.round(agg_func(dim_red_data), rounding_precision).tolist()
-    dim_reduction = np.round(dim_red_data.mean(), rounding_precision).tolist()
+    dim_reduction = np.round(
+        matrices.dim_red.take(positions, axis=1).mean(axis=1), rounding_precision
+    ).tolist()
 
     return tag_data, dim_reduction
@@ -0,0 +1,137 @@
+from typing import List, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+
+class CollectionIndex:
+    """Hierarchical metadata factorized once into a nested group index.
+
+    Level l orders all positions by their codes in the first l + 1 metadata
+    columns, stable in the position. Every path of metadata values is then one
+    ascending run of that order, split into the runs of its child paths on
+    level l + 1. A collection level is produced by looking up these runs
+    instead of grouping the metadata of a node again.
+    """
+
+    column_names: List[str]
+    codes: List[np.ndarray]
+    collections: List[np.ndarray]
+    orders: List[np.ndarray]
+    ranks: List[np.ndarray]
+    run_starts: List[np.ndarray]
+    run_codes: List[np.ndarray]
+
+    def __init__(
+        self,
+        column_names: List[str],
+        codes: List[np.ndarray],
+        collections: List[np.ndarray],
+    ):
+        self.column_names = column_names
+        self.codes = codes
+        self.collections = collections
+        self.orders = []
+        self.ranks = []
+        self.run_starts = []
+        self.run_codes = []
+
+        number_of_positions = len(codes[0]) if codes else 0
+        for level in range(len(codes)):
+            # lexsort sorts by the last key first and keeps ties in position order
+            order = np.lexsort(codes[level::-1])
+            path_changes = np.zeros(max(number_of_positions - 1, 0), dtype=bool)
+            for parent_level in range(level + 1):
+                path_changes |= np.diff(codes[parent_level][order]) != 0
+            run_starts = np.concatenate(
+                [[0], np.flatnonzero(path_changes) + 1, [number_of_positions]]
+            )
+            if number_of_positions == 0:
+                run_starts = run_starts[1:]
+            ranks = np.empty_like(order)
+            ranks[order] = np.arange(number_of_positions)
+            self.orders.append(order)
+            self.ranks.append(ranks)
+            self.run_starts.append(run_starts)
+            self.run_codes.append(codes[level][order[run_starts[:-1]]])
+
+    @classmethod
+    def from_frame(
+        cls, metadata_df: pd.DataFrame, column_names: List[str]
+    ) -> "CollectionIndex":
+        codes: List[np.ndarray] = []
+        collections: List[np.ndarray] = []
+        for column_name in column_names:
+            # sorted like groupby, missing collections get code -1 and are dropped
+            column_codes, uniques = pd.factorize(metadata_df[column_name], sort=True)
+            codes.append(column_codes)
+            collections.append(np.asarray(uniques, dtype=object))
+        return cls(list(column_names), codes, collections)
+
+    def take(self, positions: np.ndarray) -> "CollectionIndex":
+        """Index of the given positions only, renumbered from 0."""
+        return CollectionIndex(
+            self.column_names,
+            [codes[positions] for codes in self.codes],
+            self.collections,
+        )
+
+    def get_runs(
+        self, positions: np.ndarray, column_name: str
+    ) -> List[Tuple[int, np.ndarray]]:
+        """Code and positions of every collection of column_name among positions,
+        in code order, with -1 for the positions without a collection."""
+        level = self.column_names.index(column_name)
+        run_range = self.get_run_range(positions, level)
+        if run_range is None:
+            # not a whole path of the levels above, group its codes directly
+            codes = self.codes[level][positions]
+            return [
+                (codes[group[0]], positions[group]) for group in split_by_labels(codes)
+            ]
+
+        run_starts = self.run_starts[level]
+        first_run, last_run = run_range
+        return [
+            (
+                self.run_codes[level][run],
+                self.orders[level][run_starts[run] : run_starts[run + 1]],
+            )
+            for run in range(first_run, last_run)
+        ]
+
+    def get_run_range(
+        self, positions: np.ndarray, level: int
+    ) -> Union[Tuple[int, int], None]:
+        """Runs of the given level making up positions, if positions are all
+        positions of one path of the levels above. This is what the recursion
+        passes to a collection level, checked in linear time."""
+        if level == 0:
+            low, high = 0, len(self.codes[0])
+            if not np.array_equal(positions, np.arange(high)):
+                return None
+        else:
+            if len(positions) == 0:
+                return None
+            parent_starts = self.run_starts[level - 1]
+            low = int(self.ranks[level - 1][positions[0]])
+            high = low + len(positions)
+            parent_run = np.searchsorted(parent_starts, low)
+            if (
+                parent_starts[parent_run] != low
+                or parent_run + 1 == len(parent_starts)
+                or parent_starts[parent_run + 1] != high
+                or not np.array_equal(self.orders[level - 1][low:high], positions)
+            ):
+                return None
+        first_run, last_run = np.searchsorted(self.run_starts[level], [low, high])
+        return int(first_run), int(last_run)
+
+
+def split_by_labels(labels: np.ndarray) -> List[np.ndarray]:
+    """Offsets of every distinct label, ordered by label and stable within it."""
+    if len(labels) == 0:
+        return []
+    order = np.argsort(labels, kind="stable")
+    boundaries = np.flatnonzero(np.diff(labels[order])) + 1
+    return np.split(order, boundaries)
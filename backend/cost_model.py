@@ -0,0 +1,180 @@
+import logging
+from collections import deque
+from typing import Deque, Dict, List, Tuple, Union
+
+import numpy as np
+from heatmap_types import HeatmapSettings
+
+
+logger = logging.getLogger("IHECH Logger")
+
+# Seconds per unit of the stage's cost feature (see get_cost_features). The
+# defaults are fitted to thesis-plots/performance_plots/results.csv (20
+# attributes, up to 500k items) and replaced by the server's own recorded
+# timings once enough requests were measured.
+DEFAULT_COEFFICIENTS = {
+    "filtering": 1.7e-7,
+    "dimReduction:PCA": 1.1e-6,
+    "dimReduction:UMAP": 4e-5,
+    "dimReduction:TSNE": 4e-4,
+    "clusteringItems": 9e-7,
+    "clusteringAttributes": 3e-7,
+    "json": 3.6e-6,
+}
+
+PRESET_COST_FACTORS = {"EXACT": 1.0, "BALANCED": 0.6, "FAST": 0.35}
+
+AGGREGATE_COST_FACTORS = {"median": 2.0}
+
+MIN_OBSERVATIONS = 3
+MAX_OBSERVATIONS = 100
+
+MIN_BUDGET_SAMPLE_SIZE = 100
+
+observations: Dict[str, Deque[Tuple[float, float]]] = {
+    key: deque(maxlen=MAX_OBSERVATIONS) for key in DEFAULT_COEFFICIENTS
+}
+
+
+def get_tree_depth(number_of_leaves: int, cluster_size: int) -> float:
+    if cluster_size <= 1 or number_of_leaves <= cluster_size:
+        return 1.0
+    return np.log(number_of_leaves) / np.log(cluster_size)
+
+
+def get_dim_reduction_feature(
+    number_of_items: int, number_of_attributes: int, settings: HeatmapSettings
+) -> float:
+    fitted_items = number_of_items
+    if settings.scalableDimReduction:
+        fitted_items = min(number_of_items, settings.dimReductionSampleSize)
+        number_of_attributes = min(
+            number_of_attributes, settings.dimReductionPcaComponents
+        )
+
+    if settings.dimReductionAlgo == "PCA":
+        feature = number_of_items * number_of_attributes
+    else:
+        feature = fitted_items * np.log2(max(fitted_items, 2))
+        feature += number_of_items - fitted_items
+    return feature * PRESET_COST_FACTORS.get(settings.dimReductionPreset, 1.0)
+
+
+def get_cost_features(
+    number_of_items: int, number_of_attributes: int, settings: HeatmapSettings
+) -> Dict[str, float]:
+    """Maps each coefficient key to the size of the work it is multiplied with."""
+    cells = number_of_items * number_of_attributes
+    items_depth = get_tree_depth(number_of_items, settings.itemsClusterSize)
+    attributes_depth = get_tree_depth(
+        number_of_attributes, settings.attributesClusterSize
+    )
+    clustering_attributes = number_of_attributes
+    if settings.clusterAfterDimRed:
+        clustering_attributes = 2
+    elif settings.clusteringFeatureSpace != "FULL":
+        clustering_attributes = min(
+            number_of_attributes, settings.clusteringFeatureDimensions
+        )
+    signature_items = number_of_items
+    if settings.attributeSignature != "FULL":
+        signature_items = min(number_of_items, settings.attributeSignatureSize)
+    aggregate_factor = AGGREGATE_COST_FACTORS.get(settings.itemAggregateMethod, 1.0)
+
+    return {
+        "filtering": cells,
+        f"dimReduction:{settings.dimReductionAlgo}": get_dim_reduction_feature(
+            number_of_items, number_of_attributes, settings
+        ),
+        "clusteringItems": number_of_items
+        * (clustering_attributes + number_of_attributes * aggregate_factor)
+        * items_depth,
+        "clusteringAttributes": number_of_attributes
+        * signature_items
+        * attributes_depth,
+        "json": cells,
+    }
+
+
+def get_coefficient(key: str) -> float:
+    key_observations = observations[key]
+    if len(key_observations) < MIN_OBSERVATIONS:
+        return DEFAULT_COEFFICIENTS[key]
+    # least squares fit of seconds = coefficient * feature
+    features, seconds = np.array(key_observations).T
+    return float(np.dot(features, seconds) / np.dot(features, features))
+
+
+def get_stage(key: str) -> str:
+    return key.split(":")[0]
+
+
+def estimate_heatmap_cost(
+    number_of_items: int, number_of_attributes: int, settings: HeatmapSettings
+) -> Dict[str, float]:
+    """Estimated seconds per stage."""
+    features = get_cost_features(number_of_items, number_of_attributes, settings)
+    return {
+        get_stage(key): get_coefficient(key) * feature
+        for key, feature in features.items()
+    }
+
+
+def record_stage_timings(
+    number_of_items: int,
+    number_of_attributes: int,
+    settings: HeatmapSettings,
+    stage_timings: Dict[str, float],
+) -> None:
+    features = get_cost_features(number_of_items, number_of_attributes, settings)
+    for key, feature in features.items():
+        stage = get_stage(key)
+        if stage in stage_timings and feature > 0:
+            observations[key].append((feature, stage_timings[stage]))
+
+
+def fit_settings_to_latency_budget(
+    number_of_items: int, number_of_attributes: int, settings: HeatmapSettings
+) -> Tuple[Union[int, None], List[str]]:
+    """Switch to cheaper options until the estimate meets settings.maxLatencyMs.
+
+    Modifies the settings in place and returns the number of items to sample
+    (None to keep all items) together with a description of the adjustments.
+    """
+    adjustments: List[str] = []
+    budget = settings.maxLatencyMs / 1000
+
+    def estimate(items: int) -> float:
+        return sum(
+            estimate_heatmap_cost(items, number_of_attributes, settings).values()
+        )
+
+    if estimate(number_of_items) <= budget:
+        return None, adjustments
+
+    if settings.dimReductionAlgo != "PCA" and settings.dimReductionPreset != "FAST":
+        settings.dimReductionPreset = "FAST"
+        adjustments.append("dimReductionPreset: FAST")
+        if estimate(number_of_items) <= budget:
+            return None, adjustments
+
+    if settings.dimReductionAlgo != "PCA":
+        adjustments.append(
+            f"dimReductionAlgo: PCA instead of {settings.dimReductionAlgo}"
+        )
+        settings.dimReductionAlgo = "PCA"
+        if estimate(number_of_items) <= budget:
+            return None, adjustments
+
+    # the estimate grows with the number of items, search the largest sample within budget
+    low, high = min(MIN_BUDGET_SAMPLE_SIZE, number_of_items), number_of_items
+    while low < high:
+        middle = (low + high + 1) // 2
+        if estimate(middle) <= budget:
+            low = middle
+        else:
+            high = middle - 1
+    if low == number_of_items:
+        return None, adjustments
+    adjustments.append(f"items sampled: {low} of {number_of_items}")
+    return low, adjustments
@@ -0,0 +1,166 @@
+import hashlib
+import heapq
+import logging
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+import pandas as pd
+from scipy.cluster.hierarchy import linkage
+from sklearn.cluster import ward_tree
+from knn_graph import KnnGraph
+
+
+logger = logging.getLogger("IHECH Logger")
+
+# Unconstrained ward needs the full condensed distance matrix, 8 * n^2 / 2 bytes
+# (100 MB at 5000 rows, like the ward limit of the AUTO backend). Above this many
+# rows a dendrogram is only built along the kNN graph.
+MAX_UNCONSTRAINED_DENDROGRAM_SIZE = 5000
+
+MAX_DENDROGRAMS = 10
+dendrograms: Dict[str, "Dendrogram"] = {}
+
+
+class Dendrogram:
+    """Full ward linkage tree of a matrix, cut into `cluster_size` groups per node
+    instead of re-clustering every subtree."""
+
+    item_indexes: pd.Index
+    children: np.ndarray
+    heights: np.ndarray
+    starts: np.ndarray
+    leaf_ranks: np.ndarray
+
+    def __init__(self, item_indexes: pd.Index, children: np.ndarray, heights: np.ndarray):
+        number_of_leaves = len(item_indexes)
+        number_of_nodes = 2 * number_of_leaves - 1
+        self.item_indexes = item_indexes
+        self.children = children.astype(np.int64)
+        self.heights = heights
+
+        counts = np.ones(number_of_nodes, dtype=np.int64)
+        for i, (left, right) in enumerate(self.children):
+            counts[number_of_leaves + i] = counts[left] + counts[right]
+
+        # every node covers a contiguous interval of the left-to-right leaf order
+        self.starts = np.zeros(number_of_nodes, dtype=np.int64)
+        for i in range(number_of_leaves - 2, -1, -1):
+            left, right = self.children[i]
+            self.starts[left] = self.starts[number_of_leaves + i]
+            self.starts[right] = self.starts[number_of_leaves + i] + counts[left]
+        self.leaf_ranks = self.starts[:number_of_leaves]
+
+    def get_shared_arrays(self) -> Dict[str, np.ndarray]:
+        """What clustering workers need of the dendrogram, see from_shared_arrays."""
+        return {
+            "item_indexes": np.asarray(self.item_indexes),
+            "children": self.children,
+            "heights": self.heights,
+            "starts": self.starts,
+        }
+
+    @classmethod
+    def from_shared_arrays(cls, arrays: Dict[str, np.ndarray]) -> "Dendrogram":
+        dendrogram = cls.__new__(cls)
+        dendrogram.item_indexes = pd.Index(arrays["item_indexes"])
+        dendrogram.children = arrays["children"]
+        dendrogram.heights = arrays["heights"]
+        dendrogram.starts = arrays["starts"]
+        dendrogram.leaf_ranks = dendrogram.starts[: len(dendrogram.item_indexes)]
+        return dendrogram
+
+    def is_leaf(self, node: int) -> bool:
+        return node < len(self.item_indexes)
+
+    def narrow(
+        self, node: int, sorted_ranks: np.ndarray, low: int, high: int
+    ) -> Tuple[int, Union[int, None]]:
+        """Descend to the lowest node containing all ranks in sorted_ranks[low:high].
+
+        Returns that node and where its right child's ranks start, or None for a leaf.
+        """
+        while not self.is_leaf(node):
+            left, right = self.children[node - len(self.item_indexes)]
+            split = low + int(
+                np.searchsorted(sorted_ranks[low:high], self.starts[right])
+            )
+            if split == low:
+                node = right
+            elif split == high:
+                node = left
+            else:
+                return node, split
+        return node, None
+
+    def split(self, item_indexes: pd.Index, cluster_size: int) -> np.ndarray:
+        """Labels grouping the given items into at most `cluster_size` clusters by
+        cutting the dendrogram restricted to them at its highest merges."""
+        number_of_leaves = len(self.item_indexes)
+        positions = self.item_indexes.get_indexer(item_indexes)
+        ranks = self.leaf_ranks[positions]
+        order = np.argsort(ranks)
+        sorted_ranks = ranks[order]
+
+        root, split = self.narrow(
+            2 * number_of_leaves - 2, sorted_ranks, 0, len(sorted_ranks)
+        )
+        # max-heap of splittable nodes by merge height
+        heap: List[Tuple[float, int, int, int, int]] = []
+        groups: List[Tuple[int, int]] = []
+
+        def add(node: int, split: Union[int, None], low: int, high: int):
+            if split is None:
+                groups.append((low, high))
+            else:
+                height = self.heights[node - number_of_leaves]
+                heapq.heappush(heap, (-height, node, split, low, high))
+
+        add(root, split, 0, len(sorted_ranks))
+        while heap and len(heap) + len(groups) < cluster_size:
+            _, node, split, low, high = heapq.heappop(heap)
+            left, right = self.children[node - number_of_leaves]
+            add(*self.narrow(left, sorted_ranks, low, split), low, split)
+            add(*self.narrow(right, sorted_ranks, split, high), split, high)
+        groups.extend((low, high) for _, _, _, low, high in heap)
+
+        labels = np.empty(len(sorted_ranks), dtype=np.int64)
+        for label, (low, high) in enumerate(sorted(groups)):
+            labels[order[low:high]] = label
+        return labels
+
+
+def get_dendrogram(
+    data_df: pd.DataFrame, knn_graph: Union[KnnGraph, None] = None
+) -> Union[Dendrogram, None]:
+    """Cached ward dendrogram of the rows of data_df, None if it is too large to
+    build without a kNN graph."""
+    if data_df.shape[0] < 2:
+        return None
+    if data_df.shape[0] > MAX_UNCONSTRAINED_DENDROGRAM_SIZE and knn_graph is None:
+        logger.info("Too many rows for an unconstrained dendrogram")
+        return None
+
+    data = np.ascontiguousarray(data_df.values, dtype=np.float64)
+    key_hash = hashlib.sha256(data.tobytes())
+    key_hash.update(",".join(map(str, data_df.index)).encode("utf-8"))
+    key = key_hash.hexdigest()
+    if key in dendrograms:
+        logger.info("Reusing cached dendrogram")
+        return dendrograms[key]
+
+    if data_df.shape[0] <= MAX_UNCONSTRAINED_DENDROGRAM_SIZE:
+        linkage_matrix = linkage(data, method="ward")
+        children, heights = linkage_matrix[:, :2], linkage_matrix[:, 2]
+    else:
+        positions = knn_graph.item_indexes.get_indexer(data_df.index)
+        connectivity = knn_graph.adjacency[positions][:, positions]
+        children, _, _, _, heights = ward_tree(
+            data, connectivity=connectivity, return_distance=True
+        )
+    dendrogram = Dendrogram(data_df.index, children, heights)
+
+    if len(dendrograms) >= MAX_DENDROGRAMS:
+        oldest_key = next(iter(dendrograms))
+        dendrograms.pop(oldest_key)
+    dendrograms[key] = dendrogram
+    return dendrogram
@@ -0,0 +1,343 @@
+import hashlib
+import logging
+import threading
+from typing import Dict, Tuple, Union
+
+import numpy as np
+import pandas as pd
+from sklearn.decomposition import PCA
+from sklearn.manifold import TSNE
+from sklearn.neighbors import NearestNeighbors
+from umap import UMAP
+from duplicates import get_duplicate_groups, get_duplicate_ids
+from helpers import stratified_sample_positions
+from heatmap_types import HeatmapSettings
+from knn_graph import KnnGraph
+
+
+logger = logging.getLogger("IHECH Logger")
+
+# Above this many attributes PCA uses the randomized SVD solver.
+WIDE_DATA_ATTRIBUTES_THRESHOLD = 500
+
+MIN_DIM_REDUCTION_SAMPLE_SIZE = 100
+
+# Number of embedded sample items used to place an out-of-sample item for TSNE.
+OUT_OF_SAMPLE_NEIGHBORS = 10
+
+# Embeddings of previous requests, keyed by session, dataset and dim reduction
+# inputs. Requests and background previews read and write them concurrently.
+MAX_PREVIOUS_EMBEDDINGS = 10
+previous_embeddings: Dict[str, Tuple[pd.Index, np.ndarray]] = {}
+previous_embeddings_lock = threading.Lock()
+
+# Re-embed from scratch when more than this share of the items was added or removed.
+MAX_INCREMENTAL_CHANGE_FRACTION = 0.2
+
+# Arguments replacing the preset ones when refining a warm-started embedding.
+REFINEMENT_ARGUMENTS = {
+    "UMAP": {"n_epochs": 50},
+    "TSNE": {"n_iter": 250, "early_exaggeration": 1.0},
+}
+
+DIM_REDUCTION_ALGOS = {"UMAP": UMAP, "TSNE": TSNE, "PCA": PCA}
+
+# Constructor arguments per speed/quality preset. Only EXACT is reproducible:
+# a fixed random_state forces UMAP onto a single thread, so the other presets
+# drop it to let numba/TSNE use all cores and additionally cut epochs/iterations.
+# n_iter of TSNE includes the 250 iterations of its early exaggeration phase, so
+# the presets keep 250 normal iterations after it. FAST lowers the exaggeration
+# instead, which leaves the normal iterations less distortion to undo.
+DIM_REDUCTION_PRESETS = {
+    "EXACT": {
+        "UMAP": {"random_state": 42},
+        "TSNE": {"random_state": 42},
+        "PCA": {"random_state": 42},
+    },
+    "BALANCED": {
+        "UMAP": {"n_epochs": 200, "n_jobs": -1},
+        "TSNE": {"n_iter": 500, "n_jobs": -1},
+        "PCA": {"random_state": 42},
+    },
+    "FAST": {
+        "UMAP": {"n_epochs": 100, "n_jobs": -1},
+        "TSNE": {"n_iter": 500, "n_jobs": -1, "angle": 0.8, "early_exaggeration": 4.0},
+        "PCA": {"random_state": 42, "svd_solver": "randomized"},
+    },
+}
+
+
+def pca_svd_solver(number_of_attributes: int) -> str:
+    if number_of_attributes > WIDE_DATA_ATTRIBUTES_THRESHOLD:
+        return "randomized"
+    return "auto"
+
+
+def get_pca_arguments(
+    dim_reduction_algo: str, preset: str, number_of_attributes: int
+) -> Dict:
+    """Randomized SVD for wide data, unless the preset picks the solver."""
+    if dim_reduction_algo != "PCA" or "svd_solver" in DIM_REDUCTION_PRESETS.get(
+        preset, {}
+    ).get("PCA", {}):
+        return {}
+    return {"svd_solver": pca_svd_solver(number_of_attributes)}
+
+
+def create_dim_reduction(
+    dim_reduction_algo: str, preset: str, **overrides
+) -> Union[UMAP, TSNE, PCA]:
+    if dim_reduction_algo not in DIM_REDUCTION_ALGOS:
+        raise ValueError("Invalid dim reduction algorithm")
+    if preset not in DIM_REDUCTION_PRESETS:
+        raise ValueError(f"Unknown dim reduction preset: {preset}")
+    arguments = {**DIM_REDUCTION_PRESETS[preset][dim_reduction_algo], **overrides}
+    return DIM_REDUCTION_ALGOS[dim_reduction_algo](n_components=2, **arguments)
+
+
+def get_embedding_key(scaled_raw_data_df: pd.DataFrame, settings: HeatmapSettings) -> str:
+    """Identifies everything an embedding depends on except the item selection.
+    Without a session the selection is part of it, so clients of the same
+    dataset do not warm-start from each other's embeddings."""
+    if settings.sessionId is not None:
+        owner = f"session:{settings.sessionId}"
+    else:
+        owner = "items:" + ",".join(map(str, np.sort(scaled_raw_data_df.index)))
+    key_parts = [
+        owner,
+        settings.get_dataset_fingerprint(),
+        settings.dimReductionAlgo,
+        settings.dimReductionPreset,
+        settings.scaling,
+        ",".join(map(str, scaled_raw_data_df.columns)),
+    ]
+    return hashlib.sha256("|".join(key_parts).encode("utf-8")).hexdigest()
+
+
+def store_previous_embedding(
+    embedding_key: str, item_indexes: pd.Index, dim_red: np.ndarray
+) -> None:
+    with previous_embeddings_lock:
+        previous_embeddings.pop(embedding_key, None)
+        if len(previous_embeddings) >= MAX_PREVIOUS_EMBEDDINGS:
+            oldest_key = next(iter(previous_embeddings))
+            previous_embeddings.pop(oldest_key)
+        previous_embeddings[embedding_key] = (item_indexes, dim_red)
+
+
+def get_knn_graph_arguments(
+    dim_reduction_algo: str, knn_graph: Union[KnnGraph, None]
+) -> Dict:
+    if dim_reduction_algo == "UMAP" and knn_graph is not None:
+        return {"precomputed_knn": knn_graph.as_precomputed_knn()}
+    return {}
+
+
+def reduce_dimensions_incrementally(
+    scaled_raw_data_df: pd.DataFrame,
+    settings: HeatmapSettings,
+    embedding_key: str,
+    knn_graph: Union[KnnGraph, None],
+) -> Union[np.ndarray, None]:
+    """Warm-start from the previous embedding of the same data if only a few
+    items were added or removed. Returns None if a full fit is needed."""
+    with previous_embeddings_lock:
+        previous = previous_embeddings.get(embedding_key)
+    if previous is None:
+        return None
+    previous_item_indexes, previous_dim_red = previous
+
+    previous_positions = previous_item_indexes.get_indexer(scaled_raw_data_df.index)
+    is_known = previous_positions >= 0
+    number_of_known_items = int(is_known.sum())
+    number_of_changed_items = (len(is_known) - number_of_known_items) + (
+        len(previous_item_indexes) - number_of_known_items
+    )
+    if number_of_changed_items == 0:
+        logger.info("Item selection unchanged, reusing previous embedding")
+        return previous_dim_red[previous_positions]
+    if (
+        settings.dimReductionAlgo not in REFINEMENT_ARGUMENTS
+        or number_of_changed_items > MAX_INCREMENTAL_CHANGE_FRACTION * len(is_known)
+        or number_of_known_items < OUT_OF_SAMPLE_NEIGHBORS
+    ):
+        return None
+
+    logger.info(
+        f"Refining previous embedding, {number_of_changed_items} items added or removed"
+    )
+    data = scaled_raw_data_df.values
+    init = np.empty((len(is_known), 2))
+    init[is_known] = previous_dim_red[previous_positions[is_known]]
+    if not is_known.all():
+        init[~is_known] = interpolate_from_neighbors(
+            data[is_known], init[is_known], data[~is_known]
+        )
+    dim_reduction = create_dim_reduction(
+        settings.dimReductionAlgo,
+        settings.dimReductionPreset,
+        init=init,
+        **REFINEMENT_ARGUMENTS[settings.dimReductionAlgo],
+        **get_knn_graph_arguments(settings.dimReductionAlgo, knn_graph),
+    )
+    return dim_reduction.fit_transform(data)
+
+
+def reduce_dimensions(
+    scaled_raw_data_df: pd.DataFrame,
+    settings: HeatmapSettings,
+    strata: Union[pd.Series, None],
+    knn_graph: Union[KnnGraph, None] = None,
+) -> np.ndarray:
+    """Embed the scaled items in two dimensions with the selected algorithm.
+
+    `strata` holds the top-level item collection of every row and is only used
+    by the scalable mode to draw a sample that covers every collection.
+    `knn_graph` replaces the neighbor search of UMAP when fitting all items.
+    With collapseDuplicates, UMAP and TSNE only embed one of identical items,
+    which get identical coordinates anyway. PCA still fits all items, their
+    number weighs into the components.
+    """
+    if (
+        settings.collapseDuplicates
+        and settings.dimReductionAlgo != "PCA"
+        and knn_graph is None
+    ):
+        representatives, inverse, _ = get_duplicate_groups(
+            get_duplicate_ids(scaled_raw_data_df.values)
+        )
+        if MIN_DIM_REDUCTION_SAMPLE_SIZE <= len(representatives) < len(inverse):
+            logger.info(
+                f"Embedding {len(representatives)} distinct of {len(inverse)} items"
+            )
+            dim_red = reduce_dimensions_of_items(
+                scaled_raw_data_df.iloc[representatives],
+                settings,
+                strata.iloc[representatives] if strata is not None else None,
+                knn_graph,
+            )
+            return dim_red[inverse]
+    return reduce_dimensions_of_items(scaled_raw_data_df, settings, strata, knn_graph)
+
+
+def reduce_dimensions_of_items(
+    scaled_raw_data_df: pd.DataFrame,
+    settings: HeatmapSettings,
+    strata: Union[pd.Series, None],
+    knn_graph: Union[KnnGraph, None],
+) -> np.ndarray:
+    if settings.incrementalDimReduction and not settings.scalableDimReduction:
+        embedding_key = get_embedding_key(scaled_raw_data_df, settings)
+        dim_red = reduce_dimensions_incrementally(
+            scaled_raw_data_df, settings, embedding_key, knn_graph
+        )
+        if dim_red is None:
+            dim_red = reduce_dimensions_from_scratch(
+                scaled_raw_data_df, settings, knn_graph
+            )
+        store_previous_embedding(embedding_key, scaled_raw_data_df.index, dim_red)
+        return dim_red
+
+    if settings.scalableDimReduction:
+        return reduce_dimensions_scalable(
+            scaled_raw_data_df.values,
+            settings.dimReductionAlgo,
+            settings.dimReductionPreset,
+            settings.dimReductionSampleSize,
+            settings.dimReductionPcaComponents,
+            strata,
+        )
+
+    return reduce_dimensions_from_scratch(scaled_raw_data_df, settings, knn_graph)
+
+
+def reduce_dimensions_from_scratch(
+    scaled_raw_data_df: pd.DataFrame,
+    settings: HeatmapSettings,
+    knn_graph: Union[KnnGraph, None],
+) -> np.ndarray:
+    dim_reduction = create_dim_reduction(
+        settings.dimReductionAlgo,
+        settings.dimReductionPreset,
+        **get_knn_graph_arguments(settings.dimReductionAlgo, knn_graph),
+        **get_pca_arguments(
+            settings.dimReductionAlgo,
+            settings.dimReductionPreset,
+            scaled_raw_data_df.shape[1],
+        ),
+    )
+    dim_red = dim_reduction.fit_transform(scaled_raw_data_df)
+    if settings.dimReductionAlgo == "PCA":
+        explained_variance = dim_reduction.explained_variance_ratio_
+        logger.info(f"Explained variance by component: {explained_variance}")
+        logger.info(f"Total variance explained: {sum(explained_variance) * 100:.2f}%")
+    return dim_red
+
+
+def reduce_dimensions_scalable(
+    data: np.ndarray,
+    dim_reduction_algo: str,
+    preset: str,
+    sample_size: int,
+    pca_components: int,
+    strata: Union[pd.Series, None],
+) -> np.ndarray:
+    """Pre-project to a few PCA components, fit on a stratified sample and
+    transform the remaining items, so the cost grows linearly with the items."""
+    number_of_items, number_of_attributes = data.shape
+    sample_size = max(sample_size, MIN_DIM_REDUCTION_SAMPLE_SIZE)
+    sample_positions = stratified_sample_positions(strata, number_of_items, sample_size)
+    rest_mask = np.ones(number_of_items, dtype=bool)
+    rest_mask[sample_positions] = False
+
+    pca_components = min(pca_components, len(sample_positions))
+    if number_of_attributes > pca_components:
+        pre_projection = PCA(
+            n_components=pca_components,
+            svd_solver=pca_svd_solver(number_of_attributes),
+            random_state=42,
+        )
+        pre_projection.fit(data[sample_positions])
+        data = pre_projection.transform(data)
+        logger.info(
+            f"Pre-projected {number_of_attributes} attributes to {pca_components} components, "
+            f"variance kept: {sum(pre_projection.explained_variance_ratio_) * 100:.2f}%"
+        )
+
+    logger.info(
+        f"Fitting {dim_reduction_algo} on {len(sample_positions)} of {number_of_items} items"
+    )
+    sample_data = data[sample_positions]
+    dim_reduction = create_dim_reduction(dim_reduction_algo, preset)
+
+    if dim_reduction_algo == "PCA":
+        dim_reduction.fit(sample_data)
+        return dim_reduction.transform(data)
+
+    dim_red = np.empty((number_of_items, 2))
+    sample_dim_red = dim_reduction.fit_transform(sample_data)
+    dim_red[sample_positions] = sample_dim_red
+    if not rest_mask.any():
+        return dim_red
+    if dim_reduction_algo == "UMAP":
+        dim_red[rest_mask] = dim_reduction.transform(data[rest_mask])
+    else:
+        dim_red[rest_mask] = interpolate_from_neighbors(
+            sample_data, sample_dim_red, data[rest_mask]
+        )
+    return dim_red
+
+
+def interpolate_from_neighbors(
+    fitted_data: np.ndarray, fitted_dim_red: np.ndarray, new_data: np.ndarray
+) -> np.ndarray:
+    """Place new items at the distance-weighted mean of their nearest fitted items.
+
+    Used for algorithms like TSNE which have no out-of-sample `transform`.
+    """
+    n_neighbors = min(OUT_OF_SAMPLE_NEIGHBORS, fitted_data.shape[0])
+    nearest_neighbors = NearestNeighbors(n_neighbors=n_neighbors).fit(fitted_data)
+    distances, neighbor_positions = nearest_neighbors.kneighbors(new_data)
+    weights = 1.0 / (distances + 1e-9)
+    weights /= weights.sum(axis=1, keepdims=True)
+    return np.einsum("ij,ijk->ik", weights, fitted_dim_red[neighbor_positions])
@@ -0,0 +1,29 @@
+from typing import Tuple
+
+import numpy as np
+
+
+def get_duplicate_ids(rows: np.ndarray) -> np.ndarray:
+    """Id of every row, equal for identical rows, numbered by first occurrence."""
+    if rows.shape[0] == 0 or rows.shape[1] == 0:
+        return np.zeros(rows.shape[0], dtype=np.int64)
+    # adding 0.0 turns -0.0 into 0.0, so equal values also have equal bytes
+    rows = np.ascontiguousarray(rows + 0.0)
+    row_bytes = rows.view(np.dtype((np.void, rows.dtype.itemsize * rows.shape[1])))
+    _, first_offsets, inverse = np.unique(
+        row_bytes.ravel(), return_index=True, return_inverse=True
+    )
+    ids_by_first_offset = np.empty(len(first_offsets), dtype=np.int64)
+    ids_by_first_offset[np.argsort(first_offsets)] = np.arange(len(first_offsets))
+    return ids_by_first_offset[inverse.ravel()]
+
+
+def get_duplicate_groups(
+    duplicate_ids: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Offset of one representative row per distinct id, the representative of
+    every row as an offset into those, and the number of rows each represents."""
+    _, representatives, inverse, counts = np.unique(
+        duplicate_ids, return_index=True, return_inverse=True, return_counts=True
+    )
+    return representatives, inverse.ravel(), counts
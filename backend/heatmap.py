@@ -9,20 +9,28 @@ warnings.filterwarnings(
 )
 
 import logging
-from typing import Dict, Tuple
+from typing import Dict, List, Tuple, Union
 
 import numpy as np
 import pandas as pd
 import time
-from sklearn.decomposition import PCA
 from sklearn.discriminant_analysis import StandardScaler
-from sklearn.manifold import TSNE
-from umap import UMAP
-from helpers import drop_columns, extract_columns
-from heatmap_types import HeatmapJSON, HeatmapSettings
+from cost_model import record_stage_timings
+from dendrogram import get_dendrogram
+from dim_reduction import reduce_dimensions
+from helpers import drop_columns, extract_columns, stratified_sample_positions
+from heatmap_types import HeatmapJSON, HeatmapSettings, ItemTree
+from item_matrices import ItemMatrices
+from knn_graph import get_knn_graph
+from parallel_clustering import ParallelClustering
+from selection import decode_selection
+from sort_ranks import get_attribute_sort_ranks, get_item_sort_ranks
+from attribute_signatures import get_attribute_signatures
+from clustering_features import get_clustering_features
 from clustering_functions import (
     cluster_items_recursively,
     cluster_attributes_recursively,
+    rounding_precision,
 )
 
 
@@ -40,9 +48,10 @@ def filter_attributes_and_items(
     valid_indexes = list(
         set(settings.selectedItemsRowIndexes).intersection(raw_data_df.index)
     )
+    # without duplicates, which would select a column twice
     valid_columns = [
         col
-        for col in settings.selectedAttributesColumnNames
+        for col in dict.fromkeys(settings.selectedAttributesColumnNames)
         if col in raw_data_df.columns
     ]
     
@@ -111,12 +120,83 @@ def do_scaling(
         raise ValueError("Invalid absRelLog value")
 
 
+def sample_items(
+    item_names_df: pd.DataFrame,
+    hierarchical_rows_metadata_df: pd.DataFrame,
+    selected_columns_raw_data_df: pd.DataFrame,
+    all_columns_raw_data_df: pd.DataFrame,
+    settings: HeatmapSettings,
+    item_sample_size: int,
+) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """Keep a random sample of the items in which every item collection is represented."""
+    if settings.hierarchicalRowsMetadataColumnNames:
+        strata = (
+            hierarchical_rows_metadata_df[settings.hierarchicalRowsMetadataColumnNames]
+            .astype(str)
+            .agg("/".join, axis=1)
+        )
+    else:
+        strata = None
+    sample_positions = stratified_sample_positions(
+        strata, item_names_df.shape[0], item_sample_size
+    )
+    return (
+        item_names_df.iloc[sample_positions],
+        hierarchical_rows_metadata_df.iloc[sample_positions],
+        selected_columns_raw_data_df.iloc[sample_positions],
+        all_columns_raw_data_df.iloc[sample_positions],
+    )
+
+
+def get_attribute_dissimilarities(
+    all_columns_raw_data_df: pd.DataFrame,
+    attribute_stds: pd.Series,
+    sticky_items_row_indexes: List[int],
+    sort_attributes_based_on_sticky_items: bool,
+) -> List[float]:
+    """Std of every attribute, over the sticky items if the attributes are sorted
+    by them, normalized to [0, 1]. Sticky items missing from the data, like
+    unknown rows or rows left out of a sampled heatmap, are ignored."""
+    sticky_items_row_indexes = [
+        index
+        for index in sticky_items_row_indexes
+        if index in all_columns_raw_data_df.index
+    ]
+    if len(sticky_items_row_indexes) >= 2 and sort_attributes_based_on_sticky_items:
+        original_dropped_sticky_df = all_columns_raw_data_df.loc[
+            sticky_items_row_indexes
+        ]
+        std_devs = original_dropped_sticky_df.std()
+    else:
+        std_devs = attribute_stds
+
+    min_dissimilarity = std_devs.min()
+    max_dissimilarity = std_devs.max()
+    if min_dissimilarity == max_dissimilarity:
+        min_dissimilarity = 0
+        max_dissimilarity = 1
+    normalized_dissimilarities = (std_devs - min_dissimilarity) / (
+        max_dissimilarity - min_dissimilarity
+    )
+    return normalized_dissimilarities.tolist()
+
+
 def create_heatmap(
-    original_df: pd.DataFrame, settings: HeatmapSettings, start_heatmap: float
+    original_df: pd.DataFrame,
+    settings: HeatmapSettings,
+    start_heatmap: float,
+    item_sample_size: Union[int, None] = None,
 ) -> HeatmapJSON:
     logger.info("Starting Filtering...")
     start_filtering = start_heatmap
 
+    settings.selectedItemsRowIndexes = decode_selection(
+        settings.selectedItemsRowIndexes, original_df.index
+    )
+    settings.selectedAttributesColumnNames = decode_selection(
+        settings.selectedAttributesColumnNames, original_df.columns
+    )
+
     empty_col_index = original_df.columns[original_df.isnull().all()].tolist()
     if empty_col_index:
         first_empty_col = empty_col_index[0]
@@ -168,6 +248,25 @@ def create_heatmap(
         raw_data_df,
         settings,
     )
+
+    is_sampled = (
+        item_sample_size is not None and item_names_df.shape[0] > item_sample_size
+    )
+    if is_sampled:
+        (
+            item_names_df,
+            hierarchical_rows_metadata_df,
+            selected_columns_raw_data_df,
+            all_columns_raw_data_df,
+        ) = sample_items(
+            item_names_df,
+            hierarchical_rows_metadata_df,
+            selected_columns_raw_data_df,
+            all_columns_raw_data_df,
+            settings,
+            item_sample_size,
+        )
+        logger.info(f"Building sampled heatmap on {item_names_df.shape[0]} items")
     
     logger.info("item_names_df: " + str(item_names_df.shape))
     logger.info("hierarchical_rows_metadata_df: " + str(hierarchical_rows_metadata_df.shape))
@@ -178,10 +277,10 @@ def create_heatmap(
     scaled_raw_data_df = do_scaling(selected_columns_raw_data_df, settings)
 
     if settings.clusterItemsBasedOnStickyAttributes:
+        # in the order of the CSV, the result does not depend on the order sent
+        sticky_attributes = set(settings.stickyAttributesColumnNames)
         sticky_columns = [
-            col
-            for col in settings.stickyAttributesColumnNames
-            if col in scaled_raw_data_df.columns
+            col for col in scaled_raw_data_df.columns if col in sticky_attributes
         ]
         scaled_filtered_sticky_df = scaled_raw_data_df[sticky_columns]
         if not scaled_filtered_sticky_df.empty:
@@ -212,20 +311,18 @@ def create_heatmap(
     if scaled_raw_data_df.shape[1] == 1:
         scaled_raw_data_df["null_col"] = 1
 
-    if settings.dimReductionAlgo == "UMAP":
-        dim_reduction = UMAP(n_components=2, random_state=42)
-        dim_red_df = dim_reduction.fit_transform(scaled_raw_data_df)
-    elif settings.dimReductionAlgo == "TSNE":
-        dim_reduction = TSNE(n_components=2, random_state=42)
-        dim_red_df = dim_reduction.fit_transform(scaled_raw_data_df)
-    elif settings.dimReductionAlgo == "PCA":
-        dim_reduction = PCA(n_components=2, random_state=42)
-        dim_red_df = dim_reduction.fit_transform(scaled_raw_data_df)
-        explained_variance = dim_reduction.explained_variance_ratio_
-        logger.info(f"Explained variance by component: {explained_variance}")
-        logger.info(f"Total variance explained: {sum(explained_variance) * 100:.2f}%")
+    if settings.hierarchicalRowsMetadataColumnNames:
+        dim_reduction_strata = hierarchical_rows_metadata_df[
+            settings.hierarchicalRowsMetadataColumnNames[0]
+        ]
     else:
-        raise ValueError("Invalid dim reduction algorithm")
+        dim_reduction_strata = None
+    knn_graph = None
+    if settings.useKnnGraph:
+        knn_graph = get_knn_graph(scaled_raw_data_df, settings)
+    dim_red_df = reduce_dimensions(
+        scaled_raw_data_df, settings, dim_reduction_strata, knn_graph
+    )
 
     dim_red_df = pd.DataFrame(dim_red_df, index=selected_columns_raw_data_df.index)
     x_centered = dim_red_df[0] - dim_red_df[0].mean()
@@ -235,24 +332,14 @@ def create_heatmap(
     y_scaled = y_centered / (2 * max_range) + 0.5
     dim_red_df = pd.DataFrame({0: x_scaled, 1: y_scaled}, index=dim_red_df.index)
 
-    if (
-        len(settings.stickyItemsRowIndexes) >= 2
-        and settings.sortAttributesBasedOnStickyItems
-    ):
-        original_dropped_sticky_df = all_columns_raw_data_df.loc[
-            settings.stickyItemsRowIndexes
-        ]
-        std_devs = original_dropped_sticky_df.std()
-    else:
-        std_devs = all_columns_raw_data_df.std()
-
-    min_dissimilarity = std_devs.min()
-    max_dissimilarity = std_devs.max()
-    if min_dissimilarity == max_dissimilarity:
-        min_dissimilarity = 0
-        max_dissimilarity = 1
-    normalized_dissimilarities = (std_devs - min_dissimilarity) / (
-        max_dissimilarity - min_dissimilarity
+    # std of every attribute over all items, shared by the dissimilarities and
+    # every node of the attribute hierarchy
+    attribute_stds = all_columns_raw_data_df.std()
+    attribute_dissimilarities = get_attribute_dissimilarities(
+        all_columns_raw_data_df,
+        attribute_stds,
+        settings.stickyItemsRowIndexes,
+        settings.sortAttributesBasedOnStickyItems,
     )
 
     if "null_col" in scaled_raw_data_df.columns:
@@ -260,11 +347,17 @@ def create_heatmap(
 
     if settings.clusterAfterDimRed:
         scaled_raw_data_for_clustering_items_df = dim_red_df.copy()
+        # the graph describes neighborhoods in the scaled data, not in the embedding
+        knn_graph = None
     else:
-        scaled_raw_data_for_clustering_items_df = scaled_raw_data_df.copy()
+        scaled_raw_data_for_clustering_items_df = get_clustering_features(
+            scaled_raw_data_df, settings
+        ).copy()
 
     heatmap_json = HeatmapJSON()
-    heatmap_json.attributeDissimilarities = normalized_dissimilarities.tolist()
+    heatmap_json.isSampled = is_sampled
+    heatmap_json.attributeDissimilarities = attribute_dissimilarities
+    heatmap_json.set_dissimilarity_data(all_columns_raw_data_df, attribute_stds)
 
     heatmap_json.maxHeatmapValue = all_columns_raw_data_df.max().max()
     heatmap_json.minHeatmapValue = all_columns_raw_data_df.min().min()
@@ -282,10 +375,12 @@ def create_heatmap(
     dim_red_df = dim_red_df.copy()
 
     scaled_all_columns_raw_data_df = do_scaling(all_columns_raw_data_df, settings)
-    rotated_raw_data_df = all_columns_raw_data_df.T.reset_index(drop=True).copy()
     rotated_scaled_raw_data_df = scaled_all_columns_raw_data_df.T.reset_index(
         drop=True
     ).copy()
+    attribute_signatures_df = get_attribute_signatures(
+        rotated_scaled_raw_data_df, settings, dim_reduction_strata
+    )
     rotated_hierarchical_columns_metadata_df = (
         hierarchical_columns_metadata_df.T.reset_index(drop=True).copy()
     )
@@ -297,23 +392,71 @@ def create_heatmap(
     )
     all_rotated_column_names_df = pd.DataFrame(all_columns_raw_data_df.columns)
 
-    item_names_and_data = cluster_items_recursively(
+    items_dendrogram = None
+    attributes_dendrogram = None
+    # KD_TREE only splits items, the attributes are clustered with AUTO then
+    attributes_clustering_backend = (
+        "AUTO" if settings.clusteringBackend == "KD_TREE" else settings.clusteringBackend
+    )
+    if settings.clusteringBackend == "DENDROGRAM":
+        # the embedding of clusterAfterDimRed is always split like a KD-tree
+        if not settings.clusterAfterDimRed:
+            items_dendrogram = get_dendrogram(
+                scaled_raw_data_for_clustering_items_df, knn_graph
+            )
+        attributes_dendrogram = get_dendrogram(attribute_signatures_df)
+
+    item_matrices = ItemMatrices.from_frames(
         all_columns_raw_data_df,
         hierarchical_rows_metadata_df,
         item_names_df,
         scaled_raw_data_for_clustering_items_df,
         dim_red_df,
-        settings.itemsClusterSize,
-        settings.clusterItemsByCollections,
-        settings.itemAggregateMethod,
-        settings.hierarchicalRowsMetadataColumnNames,
-        level=0,
+        (
+            settings.hierarchicalRowsMetadataColumnNames
+            if settings.clusterItemsByCollections
+            else []
+        ),
+        settings.approximateMedianError if settings.approximateMedian else None,
+        collapse_duplicates=settings.collapseDuplicates,
     )
+    parallel_clustering = None
+    if settings.parallelClustering:
+        parallel_clustering = ParallelClustering(
+            {
+                "raw_data": item_matrices.raw_data,
+                "scaled_raw_data": item_matrices.scaled_raw_data,
+                "dim_red": item_matrices.dim_red,
+            },
+            knn_graph=knn_graph,
+            dendrogram=items_dendrogram,
+        )
+    try:
+        item_names_and_data = cluster_items_recursively(
+            item_matrices,
+            np.arange(all_columns_raw_data_df.shape[0]),
+            settings.itemsClusterSize,
+            settings.clusterItemsByCollections,
+            settings.itemAggregateMethod,
+            settings.hierarchicalRowsMetadataColumnNames,
+            level=0,
+            knn_graph=knn_graph,
+            dendrogram=items_dendrogram,
+            clustering_backend=settings.clusteringBackend,
+            parallel_clustering=parallel_clustering,
+            cluster_after_dim_red=settings.clusterAfterDimRed,
+        )
+    finally:
+        if parallel_clustering is not None:
+            parallel_clustering.release()
 
     if item_names_and_data is None:
         raise Exception("No items in cluster")
 
-    heatmap_json.itemNamesAndData = item_names_and_data
+    # the result keeps the nodes as arrays, the objects are only needed while building
+    item_tree = ItemTree(item_names_and_data, rounding_precision)
+    del item_names_and_data
+    heatmap_json.itemNamesAndData = item_tree
 
     logger.info(
         f"Clustering items done: {round(time.perf_counter() - start_clustering_items, 2)}"
@@ -322,21 +465,49 @@ def create_heatmap(
     start_clustering_attributes = time.perf_counter()
 
     hierarchical_attributes = cluster_attributes_recursively(
-        rotated_raw_data_df,
-        rotated_scaled_raw_data_df,
+        attribute_stds.values,
+        attribute_signatures_df,
         rotated_hierarchical_columns_metadata_df,
         all_rotated_column_names_df,
-        item_names_and_data,
+        item_tree,
         settings.attributesClusterSize,
         settings.clusterAttributesByCollections,
         settings.attributeAggregateMethod,
         settings.hierarchicalColumnsMetadataRowIndexes,
         0,
-        settings.selectedAttributesColumnNames,
+        set(settings.selectedAttributesColumnNames),
+        dendrogram=attributes_dendrogram,
+        clustering_backend=attributes_clustering_backend,
+        collapse_duplicates=settings.collapseDuplicates,
     )
     heatmap_json.hierarchicalAttributes = hierarchical_attributes
+    if settings.precomputeSortRanks:
+        heatmap_json.itemSortRanks = get_item_sort_ranks(item_tree)
+        heatmap_json.attributeSortRanks = get_attribute_sort_ranks(
+            hierarchical_attributes
+        )
+    end_clustering_attributes = time.perf_counter()
     logger.info(
-        f"Clustering attributes done: {round(time.perf_counter() - start_clustering_attributes, 2)}"
+        f"Clustering attributes done: {round(end_clustering_attributes - start_clustering_attributes, 2)}"
+    )
+
+    stage_timings = {
+        "filtering": start_dim_red - start_filtering,
+        "clusteringItems": start_clustering_attributes - start_clustering_items,
+        "clusteringAttributes": end_clustering_attributes
+        - start_clustering_attributes,
+    }
+    # reused embeddings do not tell anything about the cost of a dim reduction
+    if not settings.incrementalDimReduction:
+        stage_timings["dimReduction"] = start_clustering_items - start_dim_red
+    record_stage_timings(
+        item_names_df.shape[0],
+        selected_columns_raw_data_df.shape[1],
+        settings,
+        stage_timings,
+    )
+    heatmap_json.set_cost_sizes(
+        item_names_df.shape[0], selected_columns_raw_data_df.shape[1]
     )
 
     return heatmap_json
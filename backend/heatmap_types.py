@@ -1,6 +1,10 @@
+import hashlib
 import json
-from typing import List, Literal, Union
+from typing import Dict, List, Literal, Tuple, Union
 import numpy as np
+import pandas as pd
+from helpers import get_dataset_fingerprint
+from selection import get_canonical_selection
 
 
 ScalingType = Literal[
@@ -13,6 +17,22 @@ MedianMaxMinType = Literal["MEDIAN", "MIN", "MAX"]
 
 DimReductionAlgoType = Literal["PCA", "TSNE", "UMAP"]
 
+DimReductionPresetType = Literal["EXACT", "BALANCED", "FAST"]
+
+ClusteringFeatureSpaceType = Literal["FULL", "PCA", "RANDOM_PROJECTION"]
+
+AttributeSignatureType = Literal["FULL", "SAMPLE", "RANDOM_PROJECTION"]
+
+ClusteringBackendType = Literal[
+    "AUTO",
+    "WARD",
+    "KMEANS",
+    "BIRCH",
+    "BISECTING_KMEANS",
+    "KD_TREE",
+    "DENDROGRAM",
+]
+
 StructuralFeatureType = Literal[
     "AMOUNT_OF_TAGS",
     "BINARY_TAG_EXISTS",
@@ -28,6 +48,17 @@ StructuralFeatureType = Literal[
 
 SortOrderAttributes = Literal["HETEROGENIC", "HOMOGENIC", "DESC", "ASC", "ALPHABETICAL"]
 
+# Settings which only control how a result is delivered or computed, or are
+# only used by the client, not the result itself
+NON_RESULT_SETTINGS = [
+    "csvFile",
+    "previewMode",
+    "previewSampleSize",
+    "parallelClustering",
+    "sortOrderAttributes",
+    "sessionId",
+]
+
 
 class ExtendedVectorRepresentation:
     __slots__ = [
@@ -93,6 +124,191 @@ class ItemNameAndData:
         self.children: Union[List[ItemNameAndData], None] = children
 
 
+class ItemTree:
+    """The item hierarchy of a result as one array per field instead of one
+    ItemNameAndData per node.
+
+    Nodes are numbered breadth-first, so the children of node i are the nodes
+    child_offsets[i] to child_offsets[i + 1]. The roots come first. Clusters
+    have index -1. The data of all nodes is one matrix, float32 if that keeps
+    every value rounded to `decimals`. The first integer_columns values of a
+    row are written as integers. The JSON shape is only produced when
+    serializing, through ItemTreeNode views.
+    """
+
+    decimals: int
+    number_of_roots: int
+    parents: np.ndarray
+    child_offsets: np.ndarray
+    indexes: np.ndarray
+    item_names: np.ndarray
+    is_open: np.ndarray
+    amount_of_data_points: np.ndarray
+    dim_reduction: np.ndarray
+    data: np.ndarray
+    integer_columns: np.ndarray
+
+    def __init__(self, roots: "List[ItemNameAndData]", decimals: int):
+        nodes: List[ItemNameAndData] = list(roots)
+        parents: List[int] = [-1] * len(nodes)
+        child_offsets: List[int] = []
+        i = 0
+        while i < len(nodes):
+            child_offsets.append(len(nodes))
+            children = nodes[i].children
+            if children:
+                nodes.extend(children)
+                parents.extend([i] * len(children))
+            i += 1
+        child_offsets.append(len(nodes))
+
+        self.decimals = decimals
+        self.number_of_roots = len(roots)
+        self.parents = np.array(parents, dtype=np.int64)
+        self.child_offsets = np.array(child_offsets, dtype=np.int64)
+        self.indexes = np.array(
+            [-1 if node.index is None else node.index for node in nodes],
+            dtype=np.int64,
+        )
+        self.item_names = np.array([node.itemName for node in nodes], dtype=object)
+        self.is_open = np.array([node.isOpen for node in nodes], dtype=bool)
+        self.amount_of_data_points = np.array(
+            [node.amountOfDataPoints for node in nodes], dtype=np.int64
+        )
+        self.dim_reduction = np.array(
+            [[node.dimReductionX, node.dimReductionY] for node in nodes],
+            dtype=np.float64,
+        ).reshape(len(nodes), 2)
+        self.data = np.empty((len(nodes), 0), dtype=np.float32)
+        self.integer_columns = np.zeros(len(nodes), dtype=np.int64)
+        if nodes:
+            self.append_columns(
+                np.array([node.data for node in nodes], dtype=np.float64),
+                np.array(
+                    [np.asarray(node.data).dtype.kind in "iu" for node in nodes],
+                    dtype=bool,
+                ),
+            )
+
+    def __len__(self) -> int:
+        return self.number_of_roots
+
+    def __getitem__(self, i: int) -> "ItemTreeNode":
+        if not 0 <= i < self.number_of_roots:
+            raise IndexError("root index out of range")
+        return ItemTreeNode(self, i)
+
+    def get_preorder(self) -> np.ndarray:
+        """Nodes in depth-first order, the order of the nodes in the JSON."""
+        number_of_nodes = len(self.parents)
+        levels = [(0, self.number_of_roots)]
+        while levels[-1][0] < levels[-1][1]:
+            start, end = levels[-1]
+            levels.append((self.child_offsets[start], self.child_offsets[end]))
+        levels.pop()
+
+        subtree_sizes = np.ones(number_of_nodes, dtype=np.int64)
+        for start, end in reversed(levels[1:]):
+            np.add.at(subtree_sizes, self.parents[start:end], subtree_sizes[start:end])
+
+        # a node follows its parent and the subtrees of its preceding siblings
+        positions = np.empty(number_of_nodes, dtype=np.int64)
+        for start, end in levels:
+            sizes = subtree_sizes[start:end]
+            preceding = np.cumsum(sizes) - sizes
+            parents = self.parents[start:end]
+            if start == 0:
+                positions[start:end] = preceding
+            else:
+                first_siblings = self.child_offsets[parents] - start
+                positions[start:end] = (
+                    positions[parents] + 1 + preceding - preceding[first_siblings]
+                )
+        preorder = np.empty(number_of_nodes, dtype=np.int64)
+        preorder[positions] = np.arange(number_of_nodes)
+        return preorder
+
+    def get_data(self, number_of_columns: int) -> np.ndarray:
+        """The first columns of every node, as the rounded float64 values."""
+        return np.round(
+            self.data[:, :number_of_columns].astype(np.float64), self.decimals
+        )
+
+    def get_integer_rows(self) -> np.ndarray:
+        """Nodes whose data consists of integers only."""
+        return self.integer_columns == self.data.shape[1]
+
+    def append_columns(self, columns: np.ndarray, integer_rows: np.ndarray) -> None:
+        """Adds rounded data columns to every node, those of integer_rows are
+        truncated to integers."""
+        columns = np.round(columns, self.decimals)
+        columns[integer_rows] = np.trunc(columns[integer_rows])
+        data = np.hstack([self.data.astype(np.float64), columns])
+        self.integer_columns[integer_rows & self.get_integer_rows()] = data.shape[1]
+        compact_data = data.astype(np.float32)
+        # float32 holds about 7 digits, larger values keep the full precision
+        if np.array_equal(
+            np.round(compact_data.astype(np.float64), self.decimals),
+            data,
+            equal_nan=True,
+        ):
+            data = compact_data
+        self.data = data
+
+
+class ItemTreeNode:
+    """Read-only view of one node of an ItemTree with the fields of
+    ItemNameAndData."""
+
+    __slots__ = ["tree", "node"]
+
+    def __init__(self, tree: ItemTree, node: int):
+        self.tree = tree
+        self.node = node
+
+    @property
+    def index(self) -> Union[int, None]:
+        index = int(self.tree.indexes[self.node])
+        return None if index == -1 else index
+
+    @property
+    def itemName(self) -> str:
+        return self.tree.item_names[self.node]
+
+    @property
+    def isOpen(self) -> bool:
+        return bool(self.tree.is_open[self.node])
+
+    @property
+    def data(self) -> List[float]:
+        row = self.tree.data[self.node].astype(np.float64)
+        integer_columns = self.tree.integer_columns[self.node]
+        return (
+            row[:integer_columns].astype(np.int64).tolist()
+            + np.round(row[integer_columns:], self.tree.decimals).tolist()
+        )
+
+    @property
+    def amountOfDataPoints(self) -> int:
+        return int(self.tree.amount_of_data_points[self.node])
+
+    @property
+    def dimReductionX(self) -> float:
+        return float(self.tree.dim_reduction[self.node, 0])
+
+    @property
+    def dimReductionY(self) -> float:
+        return float(self.tree.dim_reduction[self.node, 1])
+
+    @property
+    def children(self) -> "Union[List[ItemTreeNode], None]":
+        start = self.tree.child_offsets[self.node]
+        end = self.tree.child_offsets[self.node + 1]
+        if start == end:
+            return None
+        return [ItemTreeNode(self.tree, child) for child in range(start, end)]
+
+
 def custom_encoder(obj):
     if isinstance(obj, np.float32):
         return float(obj)
@@ -101,7 +317,23 @@ def custom_encoder(obj):
     elif isinstance(obj, np.ndarray):
         return obj.tolist()
     elif isinstance(obj, HeatmapJSON):
-        return obj.__dict__
+        return {
+            key: value for key, value in obj.__dict__.items() if not key.startswith("_")
+        }
+    elif isinstance(obj, ItemTree):
+        return [obj[i] for i in range(len(obj))]
+    elif isinstance(obj, ItemTreeNode):
+        return {
+            "index": obj.index,
+            "itemName": obj.itemName,
+            "isOpen": obj.isOpen,
+            "data": obj.data,
+            "amountOfDataPoints": obj.amountOfDataPoints,
+            "dimReductionX": obj.dimReductionX,
+            "dimReductionY": obj.dimReductionY,
+            # children are encoded one node at a time while the response streams
+            "children": obj.children,
+        }
     elif isinstance(obj, ItemNameAndData):
 
         return {
@@ -170,25 +402,58 @@ class HierarchicalAttribute:
 class HeatmapJSON:
     def __init__(self):
         self.attributeDissimilarities: List[List[float]] = []
-        self.itemNamesAndData: List[ItemNameAndData] = []
+        self.itemNamesAndData: Union[ItemTree, List[ItemNameAndData]] = []
         self.hierarchicalAttributes: List[HierarchicalAttribute] = []
         self.maxHeatmapValue: float = 0
         self.minHeatmapValue: float = 0
         self.minAttributeValues: List[float] = []
         self.maxAttributeValues: List[float] = []
+        # a preview, the full heatmap for the same settings is still being computed
+        self.isApproximate: bool = False
+        # built on a sample of the items, as a preview or to meet maxLatencyMs
+        self.isSampled: bool = False
+        self.itemSortRanks: Union[Dict[str, np.ndarray], None] = None
+        self.attributeSortRanks: Union[Dict[str, np.ndarray], None] = None
+        self.resultId: Union[str, None] = None
+        # not serialized, kept to recompute the dissimilarities for other sticky items
+        self._raw_data_df: Union[pd.DataFrame, None] = None
+        self._attribute_stds: Union[pd.Series, None] = None
+        # not serialized, items and selected attributes the stage timings were recorded for
+        self._cost_sizes: Tuple[int, int] = (0, 0)
 
     def add_cluster(self, cluster: ItemNameAndData):
         self.itemNamesAndData.append(cluster)
 
+    def set_dissimilarity_data(
+        self, raw_data_df: pd.DataFrame, attribute_stds: pd.Series
+    ) -> None:
+        self._raw_data_df = raw_data_df
+        self._attribute_stds = attribute_stds
+
+    def get_dissimilarity_data(
+        self,
+    ) -> Union[Tuple[pd.DataFrame, pd.Series], None]:
+        if self._raw_data_df is None:
+            return None
+        return self._raw_data_df, self._attribute_stds
+
+    def set_cost_sizes(self, number_of_items: int, number_of_attributes: int) -> None:
+        self._cost_sizes = (number_of_items, number_of_attributes)
+
+    def get_cost_sizes(self) -> Tuple[int, int]:
+        return self._cost_sizes
+
 
 class HeatmapSettings:
     csvFile: str
+    datasetFingerprint: Union[str, None]
 
     hierarchicalRowsMetadataColumnNames: List[str]
     hierarchicalColumnsMetadataRowIndexes: List[int]
 
-    selectedItemsRowIndexes: List[str]
-    selectedAttributesColumnNames: List[str]
+    # a list or a compact encoding of the selected positions, see selection.py
+    selectedItemsRowIndexes: Union[List[int], Dict]
+    selectedAttributesColumnNames: Union[List[str], Dict]
 
     stickyAttributesColumnNames: List[str]
     sortAttributesBasedOnStickyItems: bool
@@ -204,14 +469,42 @@ class HeatmapSettings:
     attributesClusterSize: int
     dimReductionAlgo: DimReductionAlgoType
     clusterAfterDimRed: bool
+    dimReductionPreset: DimReductionPresetType
+
+    scalableDimReduction: bool
+    dimReductionSampleSize: int
+    dimReductionPcaComponents: int
+    incrementalDimReduction: bool
+    sessionId: Union[str, None]
+    useKnnGraph: bool
+    clusteringBackend: ClusteringBackendType
+    clusteringFeatureSpace: ClusteringFeatureSpaceType
+    clusteringFeatureDimensions: int
+    attributeSignature: AttributeSignatureType
+    attributeSignatureSize: int
+    parallelClustering: bool
     
     itemAggregateMethod: str # 'mean' or 'sum'
+    approximateMedian: bool
+    approximateMedianError: float
     attributeAggregateMethod: str # 'mean' or 'sum'
 
     scaling: ScalingType
 
+    previewMode: bool
+    previewSampleSize: int
+
+    maxLatencyMs: Union[int, None]
+
+    precomputeSortRanks: bool
+
+    collapseDuplicates: bool
+
     def __init__(self, dict):
         self.csvFile = dict["csvFile"]
+        # Optional: identifies the dataset in cache keys, the backend returns it when the
+        # CSV is registered. Without it the CSV is hashed when a key is first needed.
+        self.datasetFingerprint = dict.get("datasetFingerprint")
 
         self.hierarchicalRowsMetadataColumnNames = dict[
             "hierarchicalRowsMetadataColumnNames"
@@ -239,8 +532,127 @@ class HeatmapSettings:
         self.attributesClusterSize = dict["attributesClusterSize"]
         self.dimReductionAlgo = dict["dimReductionAlgo"]
         self.clusterAfterDimRed = dict["clusterAfterDimRed"]
+
+        # Optional: fit the dim reduction on a sample of PCA pre-projected items
+        self.scalableDimReduction = dict.get("scalableDimReduction", False)
+        self.dimReductionSampleSize = dict.get("dimReductionSampleSize", 10000)
+        self.dimReductionPcaComponents = dict.get("dimReductionPcaComponents", 50)
+
+        # Optional: trade reproducibility for parallel, shorter dim reduction runs
+        self.dimReductionPreset = dict.get("dimReductionPreset", "EXACT")
+
+        # Optional: warm-start from the previous embedding when only a few items changed
+        self.incrementalDimReduction = dict.get("incrementalDimReduction", False)
+        # Optional: warm starts are shared within a session, without one only by equal selections
+        self.sessionId = dict.get("sessionId")
+
+        # Optional: share one kNN graph between UMAP and the clustering of large item sets
+        self.useKnnGraph = dict.get("useKnnGraph", False)
+
+        # Optional: algorithm splitting each cluster, AUTO picks ward, or k-means for large
+        # and BIRCH for very large clusters without a kNN graph, and k-means for the
+        # weighted rows of collapseDuplicates. The 2-D embedding of
+        # clusterAfterDimRed is always cut with KD_TREE. Choosing KD_TREE also cuts the
+        # items without clusterAfterDimRed at medians, the attributes then use AUTO.
+        self.clusteringBackend = dict.get("clusteringBackend", "AUTO")
+
+        # Optional: cluster the items on a projection to fewer dimensions, without clusterAfterDimRed
+        self.clusteringFeatureSpace = dict.get("clusteringFeatureSpace", "FULL")
+        self.clusteringFeatureDimensions = dict.get("clusteringFeatureDimensions", 50)
+
+        # Optional: cluster the attributes on a sample or projection of this many items
+        self.attributeSignature = dict.get("attributeSignature", "FULL")
+        self.attributeSignatureSize = dict.get("attributeSignatureSize", 1000)
+
+        # Optional: cluster large item subtrees in worker processes
+        self.parallelClustering = dict.get("parallelClustering", False)
         
         self.itemAggregateMethod = dict["itemAggregateMethod"]
         self.attributeAggregateMethod = dict["attributeAggregateMethod"]
 
+        # Optional: merge quantile sketches for median item aggregates, within this rank error
+        self.approximateMedian = dict.get("approximateMedian", False)
+        self.approximateMedianError = dict.get("approximateMedianError", 0.01)
+
         self.scaling = dict["scaling"]
+
+        # Optional: answer with a sampled heatmap first and finish the full one in the background
+        self.previewMode = dict.get("previewMode", False)
+        self.previewSampleSize = dict.get("previewSampleSize", 2000)
+
+        # Optional: let the server pick cheaper options to stay within this budget
+        self.maxLatencyMs = dict.get("maxLatencyMs")
+
+        # Optional: send the rank of every tree node under each sort criterion of the client
+        self.precomputeSortRanks = dict.get("precomputeSortRanks", False)
+
+        # Optional: cluster and embed identical items and attributes as one weighted representative
+        self.collapseDuplicates = dict.get("collapseDuplicates", False)
+
+    def get_dataset_fingerprint(self) -> str:
+        if self.datasetFingerprint is None:
+            self.datasetFingerprint = get_dataset_fingerprint(self.csvFile)
+        return self.datasetFingerprint
+
+    def get_canonical_dict(self, columns: Union[pd.Index, None] = None) -> Dict:
+        """The settings the result depends on, equal for requests which only
+        differ in the order of selections or in settings without effect.
+        With the columns of the CSV, selected column names equal their positions."""
+        canonical = {
+            key: value
+            for key, value in self.__dict__.items()
+            if key not in NON_RESULT_SETTINGS
+        }
+        canonical["datasetFingerprint"] = self.get_dataset_fingerprint()
+        canonical["selectedItemsRowIndexes"] = get_canonical_selection(
+            self.selectedItemsRowIndexes
+        )
+        canonical["selectedAttributesColumnNames"] = get_canonical_selection(
+            self.selectedAttributesColumnNames, columns
+        )
+        canonical["stickyItemsRowIndexes"] = sorted(
+            set(self.stickyItemsRowIndexes), key=str
+        )
+        canonical["stickyAttributesColumnNames"] = sorted(
+            set(self.stickyAttributesColumnNames), key=str
+        )
+        if not (
+            self.sortAttributesBasedOnStickyItems and len(self.stickyItemsRowIndexes) >= 2
+        ):
+            canonical["sortAttributesBasedOnStickyItems"] = False
+            canonical["stickyItemsRowIndexes"] = []
+        if not (
+            self.clusterItemsBasedOnStickyAttributes and self.stickyAttributesColumnNames
+        ):
+            canonical["clusterItemsBasedOnStickyAttributes"] = False
+            canonical["stickyAttributesColumnNames"] = []
+        if not self.clusterAttributesByCollections:
+            canonical["hierarchicalColumnsMetadataRowIndexes"] = []
+        if not (self.approximateMedian and self.itemAggregateMethod == "median"):
+            canonical["approximateMedian"] = False
+            canonical["approximateMedianError"] = None
+        if self.clusterAfterDimRed:
+            canonical["clusteringFeatureSpace"] = "FULL"
+        if canonical["clusteringFeatureSpace"] == "FULL":
+            canonical["clusteringFeatureDimensions"] = None
+        if self.attributeSignature == "FULL":
+            canonical["attributeSignatureSize"] = None
+        if self.scalableDimReduction:
+            canonical["incrementalDimReduction"] = False
+        else:
+            canonical["dimReductionSampleSize"] = None
+            canonical["dimReductionPcaComponents"] = None
+        return canonical
+
+    def get_cache_key(
+        self,
+        item_sample_size: Union[int, None] = None,
+        columns: Union[pd.Index, None] = None,
+    ) -> str:
+        """Key of the result, item_sample_size is the number of items it was
+        built on if they were sampled to meet maxLatencyMs."""
+        canonical = self.get_canonical_dict(columns)
+        if item_sample_size is not None:
+            canonical["itemSampleSize"] = item_sample_size
+        settings_str = json.dumps(canonical, sort_keys=True)
+        return hashlib.sha256(settings_str.encode("utf-8")).hexdigest()
@@ -1,6 +1,8 @@
 import gzip
+import hashlib
 import json
-from typing import List
+from typing import List, Union
+import numpy as np
 import pandas as pd
 
 
@@ -21,3 +23,40 @@ def compress_json(data):
     json_str = json.dumps(data).encode("utf-8")
     compressed_data = gzip.compress(json_str)
     return compressed_data
+
+
+def get_dataset_fingerprint(csv_file: str) -> str:
+    return hashlib.sha256(csv_file.encode("utf-8")).hexdigest()
+
+
+def stratified_sample_positions(
+    strata: Union[pd.Series, np.ndarray, None],
+    number_of_rows: int,
+    sample_size: int,
+    random_state: int = 42,
+) -> np.ndarray:
+    """Sorted row positions of a random sample that keeps every stratum represented.
+
+    Each stratum contributes proportionally to its size, but at least one row.
+    """
+    if sample_size >= number_of_rows:
+        return np.arange(number_of_rows)
+
+    if strata is None:
+        codes = np.zeros(number_of_rows, dtype=np.int64)
+    else:
+        codes, _ = pd.factorize(np.asarray(strata), use_na_sentinel=False)
+
+    counts = np.bincount(codes)
+    quotas = np.minimum(
+        counts, np.maximum(1, np.floor(counts * sample_size / number_of_rows))
+    ).astype(int)
+
+    rng = np.random.default_rng(random_state)
+    order = np.argsort(codes, kind="stable")
+    groups = np.split(order, np.cumsum(counts)[:-1])
+    sample = [
+        rng.choice(group, size=quota, replace=False)
+        for group, quota in zip(groups, quotas)
+    ]
+    return np.sort(np.concatenate(sample))
@@ -0,0 +1,283 @@
+from typing import List, Tuple, Union
+
+import numpy as np
+import pandas as pd
+from collection_index import CollectionIndex, split_by_labels
+from duplicates import get_duplicate_ids
+
+
+# Empirically the median rank error of MedianSketch stays below this factor
+# divided by its capacity, for trees of up to a few hundred thousand items.
+MEDIAN_SKETCH_ERROR_FACTOR = 4
+
+
+class ItemMatrices:
+    """Everything the item hierarchy is built from, as one array per role.
+
+    The recursion passes integer positions into these arrays instead of
+    slicing DataFrames. Numeric matrices are stored attributes x items like
+    pandas' column blocks. Columns of a node are gathered with take, which
+    keeps the rows contiguous. Means and sums of a cluster are merged from the
+    sums of its children instead of reducing all of its items at once. They
+    differ from the DataFrame reductions in the last bits, which can change
+    the third decimal of a value rounded exactly at a tie.
+    """
+
+    raw_data: np.ndarray
+    scaled_raw_data: np.ndarray
+    dim_red: np.ndarray
+    item_indexes: pd.Index
+    item_names: np.ndarray
+    collection_index: CollectionIndex
+    median_sketch_capacity: Union[int, None]
+    duplicate_ids: Union[np.ndarray, None]
+
+    def __init__(
+        self,
+        raw_data: np.ndarray,
+        scaled_raw_data: np.ndarray,
+        dim_red: np.ndarray,
+        item_indexes: pd.Index,
+        item_names: np.ndarray,
+        collection_index: CollectionIndex,
+        median_sketch_capacity: Union[int, None] = None,
+        duplicate_ids: Union[np.ndarray, None] = None,
+    ):
+        self.raw_data = raw_data
+        self.scaled_raw_data = scaled_raw_data
+        self.dim_red = dim_red
+        self.item_indexes = item_indexes
+        self.item_names = item_names
+        self.collection_index = collection_index
+        self.median_sketch_capacity = median_sketch_capacity
+        self.duplicate_ids = duplicate_ids
+
+    @classmethod
+    def from_frames(
+        cls,
+        raw_data_df: pd.DataFrame,
+        hierarchical_rows_metadata_df: pd.DataFrame,
+        item_names_df: pd.DataFrame,
+        scaled_raw_data_df: pd.DataFrame,
+        dim_red_df: pd.DataFrame,
+        collection_column_names: List[str],
+        approximate_median_error: Union[float, None] = None,
+        collapse_duplicates: bool = False,
+    ) -> "ItemMatrices":
+        median_sketch_capacity = None
+        if approximate_median_error is not None:
+            if not 0 < approximate_median_error < 1:
+                raise ValueError("approximateMedianError must be between 0 and 1")
+            median_sketch_capacity = int(
+                np.ceil(MEDIAN_SKETCH_ERROR_FACTOR / approximate_median_error)
+            )
+
+        return cls(
+            np.ascontiguousarray(raw_data_df.values.T),
+            np.ascontiguousarray(scaled_raw_data_df.values.T),
+            np.ascontiguousarray(dim_red_df.values.T),
+            raw_data_df.index,
+            item_names_df.iloc[:, 0].values,
+            CollectionIndex.from_frame(
+                hierarchical_rows_metadata_df, collection_column_names
+            ),
+            median_sketch_capacity,
+            # items with identical rows to cluster are clustered as one
+            get_duplicate_ids(scaled_raw_data_df.values) if collapse_duplicates else None,
+        )
+
+    def get_scaled_rows(self, positions: np.ndarray) -> np.ndarray:
+        # same memory order as DataFrame.values, so the clustering sees identical input
+        return self.scaled_raw_data.take(positions, axis=1).T
+
+    def group_by_collection(
+        self, positions: np.ndarray, column_name: str
+    ) -> Tuple[List[Tuple[object, np.ndarray]], np.ndarray]:
+        """Positions of every collection in the given column, in groupby order,
+        and of the items left out of every collection, like NaN keys in groupby."""
+        collections = self.collection_index.collections[
+            self.collection_index.column_names.index(column_name)
+        ]
+        groups = []
+        positions_without_collection = positions[:0]
+        for code, group_positions in self.collection_index.get_runs(
+            positions, column_name
+        ):
+            if code < 0:
+                positions_without_collection = group_positions
+            else:
+                groups.append((collections[code], group_positions))
+        return groups, positions_without_collection
+
+    def take_labels(self, positions: np.ndarray) -> "ItemMatrices":
+        """The non-numeric part of a subtree, the numeric matrices are left out
+        to be shared with a worker instead of pickled."""
+        return ItemMatrices(
+            None,
+            None,
+            None,
+            self.item_indexes[positions],
+            self.item_names[positions],
+            self.collection_index.take(positions),
+            self.median_sketch_capacity,
+            self.duplicate_ids[positions] if self.duplicate_ids is not None else None,
+        )
+
+    def with_numeric(
+        self,
+        raw_data: np.ndarray,
+        scaled_raw_data: np.ndarray,
+        dim_red: np.ndarray,
+    ) -> "ItemMatrices":
+        return ItemMatrices(
+            raw_data,
+            scaled_raw_data,
+            dim_red,
+            self.item_indexes,
+            self.item_names,
+            self.collection_index,
+            self.median_sketch_capacity,
+            self.duplicate_ids,
+        )
+
+
+class MedianSketch:
+    """KLL-style quantile sketch of every attribute of a set of items.
+
+    Level h holds values standing for 2**h items each, one row per attribute.
+    A level above `capacity` values is sorted and every other value moves up a
+    level, so all attributes are compacted with the same array operations.
+    Merging concatenates the levels. The offset of the kept values alternates
+    with the number of compactions, so the result does not depend on which
+    process merged a subtree.
+    """
+
+    capacity: int
+    levels: List[np.ndarray]
+    compactions: List[int]
+
+    def __init__(self, capacity: int, levels: List[np.ndarray], compactions: List[int]):
+        self.capacity = capacity
+        self.levels = levels
+        self.compactions = compactions
+
+    @classmethod
+    def from_values(cls, values: np.ndarray, capacity: int) -> "MedianSketch":
+        sketch = cls(capacity, [values.astype(np.float64)], [0])
+        sketch.compact()
+        return sketch
+
+    def merge(self, other: "MedianSketch") -> None:
+        for h, level in enumerate(other.levels):
+            if h < len(self.levels):
+                self.levels[h] = np.concatenate([self.levels[h], level], axis=1)
+                self.compactions[h] += other.compactions[h]
+            else:
+                self.levels.append(level)
+                self.compactions.append(other.compactions[h])
+        self.compact()
+
+    def compact(self) -> None:
+        h = 0
+        while h < len(self.levels):
+            level = self.levels[h]
+            if level.shape[1] > self.capacity:
+                level = np.sort(level, axis=1)
+                even_length = level.shape[1] - level.shape[1] % 2
+                offset = self.compactions[h] % 2
+                promoted = level[:, offset:even_length:2]
+                self.levels[h] = level[:, even_length:]
+                self.compactions[h] += 1
+                if h + 1 == len(self.levels):
+                    self.levels.append(promoted)
+                    self.compactions.append(0)
+                else:
+                    self.levels[h + 1] = np.concatenate(
+                        [self.levels[h + 1], promoted], axis=1
+                    )
+            h += 1
+
+    def get_median(self) -> np.ndarray:
+        if len(self.levels) == 1:
+            # nothing was compacted yet, the median is exact
+            return np.median(self.levels[0], axis=1)
+        values = np.concatenate(self.levels, axis=1)
+        weights = np.concatenate(
+            [np.full(level.shape[1], 2**h) for h, level in enumerate(self.levels)]
+        )
+        order = np.argsort(values, axis=1)
+        cumulative_weights = np.cumsum(weights[order], axis=1)
+        median_positions = np.argmax(
+            cumulative_weights >= cumulative_weights[:, -1:] / 2, axis=1
+        )
+        return np.take_along_axis(values, order, axis=1)[
+            np.arange(values.shape[0]), median_positions
+        ]
+
+
+# Aggregates that can be merged from the statistics of disjoint item sets.
+# Median needs all values of a node and is aggregated from its rows instead.
+MERGE_FUNCTIONS = {
+    "mean": np.add,
+    "sum": np.add,
+    "max": np.maximum,
+    "min": np.minimum,
+    "binary": np.logical_or,
+}
+
+
+class ItemStatistics:
+    """Mergeable per-attribute statistics of a set of items: the sum for mean
+    and sum, the extreme value for max and min, any value > 0 for binary and
+    a MedianSketch for approximate medians. Every node merges the statistics
+    of its children instead of re-reading all its items."""
+
+    method: str
+    count: int
+    values: Union[np.ndarray, None]
+    median_sketch: Union[MedianSketch, None]
+    dim_red_sum: np.ndarray
+
+    def __init__(self, method: str):
+        self.method = method
+        self.count = 0
+        self.values = None
+        self.median_sketch = None
+        self.dim_red_sum = np.zeros(2)
+
+    @classmethod
+    def from_positions(
+        cls, matrices: ItemMatrices, positions: np.ndarray, method: str
+    ) -> "ItemStatistics":
+        statistics = cls(method)
+        if len(positions) == 0:
+            return statistics
+        statistics.count = len(positions)
+        statistics.dim_red_sum = matrices.dim_red.take(positions, axis=1).sum(axis=1)
+        if method in MERGE_FUNCTIONS:
+            rows = matrices.raw_data.take(positions, axis=1)
+            if method == "binary":
+                rows = rows > 0
+            statistics.values = MERGE_FUNCTIONS[method].reduce(rows, axis=1)
+        elif method == "median" and matrices.median_sketch_capacity is not None:
+            statistics.median_sketch = MedianSketch.from_values(
+                matrices.raw_data.take(positions, axis=1),
+                matrices.median_sketch_capacity,
+            )
+        return statistics
+
+    def merge(self, other: "ItemStatistics") -> None:
+        if other.count == 0:
+            return
+        if self.count == 0:
+            self.count = other.count
+            self.values = other.values
+            self.median_sketch = other.median_sketch
+            self.dim_red_sum = other.dim_red_sum
+            return
+        self.count += other.count
+        self.dim_red_sum = self.dim_red_sum + other.dim_red_sum
+        if self.method in MERGE_FUNCTIONS:
+            self.values = MERGE_FUNCTIONS[self.method](self.values, other.values)
+        elif self.median_sketch is not None:
+            self.median_sketch.merge(other.median_sketch)
@@ -0,0 +1,146 @@
+import hashlib
+import logging
+from typing import Dict, Union
+
+import numpy as np
+import pandas as pd
+from pynndescent import NNDescent
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+from umap.umap_ import nearest_neighbors
+from heatmap_types import HeatmapSettings
+
+
+logger = logging.getLogger("IHECH Logger")
+
+# Matches the default n_neighbors of UMAP, so the graph can replace its own search.
+KNN_GRAPH_NEIGHBORS = 15
+
+# UMAP ignores precomputed neighbors below this many items, so the graph is not worth building.
+KNN_GRAPH_MIN_ITEMS = 4096
+
+# Subsets whose restricted graph falls apart into more components are clustered without it.
+MAX_CONNECTIVITY_COMPONENTS = 50
+
+MAX_KNN_GRAPHS = 5
+knn_graphs: Dict[str, "KnnGraph"] = {}
+
+
+class KnnGraph:
+    """Nearest neighbors of every item, shared by UMAP and the item clustering."""
+
+    item_indexes: pd.Index
+    knn_indices: np.ndarray
+    knn_dists: np.ndarray
+    knn_search_index: NNDescent
+    adjacency: csr_matrix
+
+    def __init__(
+        self,
+        item_indexes: pd.Index,
+        knn_indices: np.ndarray,
+        knn_dists: np.ndarray,
+        knn_search_index: NNDescent,
+    ):
+        self.item_indexes = item_indexes
+        self.knn_indices = knn_indices
+        self.knn_dists = knn_dists
+        self.knn_search_index = knn_search_index
+
+        number_of_items = knn_indices.shape[0]
+        rows = np.repeat(np.arange(number_of_items), knn_indices.shape[1])
+        columns = knn_indices.ravel()
+        valid = columns >= 0
+        adjacency = csr_matrix(
+            (np.ones(valid.sum()), (rows[valid], columns[valid])),
+            shape=(number_of_items, number_of_items),
+        )
+        self.adjacency = ((adjacency + adjacency.T) > 0).astype(np.float64)
+
+    def __getstate__(self):
+        # clustering workers only need the adjacency, the search index is large
+        state = self.__dict__.copy()
+        state["knn_search_index"] = None
+        return state
+
+    def get_shared_arrays(self) -> Dict[str, np.ndarray]:
+        """What clustering workers need of the graph, see from_shared_arrays."""
+        return {
+            "item_indexes": np.asarray(self.item_indexes),
+            "adjacency_data": self.adjacency.data,
+            "adjacency_indices": self.adjacency.indices,
+            "adjacency_indptr": self.adjacency.indptr,
+        }
+
+    @classmethod
+    def from_shared_arrays(cls, arrays: Dict[str, np.ndarray]) -> "KnnGraph":
+        """The graph of a worker, it only supports get_connectivity."""
+        knn_graph = cls.__new__(cls)
+        knn_graph.item_indexes = pd.Index(arrays["item_indexes"])
+        number_of_items = len(knn_graph.item_indexes)
+        knn_graph.knn_indices = None
+        knn_graph.knn_dists = None
+        knn_graph.knn_search_index = None
+        knn_graph.adjacency = csr_matrix(
+            (
+                arrays["adjacency_data"],
+                arrays["adjacency_indices"],
+                arrays["adjacency_indptr"],
+            ),
+            shape=(number_of_items, number_of_items),
+        )
+        return knn_graph
+
+    def as_precomputed_knn(self):
+        return (self.knn_indices, self.knn_dists, self.knn_search_index)
+
+    def get_connectivity(self, item_indexes: pd.Index) -> Union[csr_matrix, None]:
+        """Adjacency of the given items, or None if it is too fragmented to
+        constrain a clustering."""
+        positions = self.item_indexes.get_indexer(item_indexes)
+        connectivity = self.adjacency[positions][:, positions]
+        number_of_components, _ = connected_components(connectivity, directed=False)
+        if number_of_components > MAX_CONNECTIVITY_COMPONENTS:
+            return None
+        return connectivity
+
+
+def get_knn_graph_key(scaled_raw_data_df: pd.DataFrame, settings: HeatmapSettings) -> str:
+    key_parts = [
+        settings.get_dataset_fingerprint(),
+        settings.scaling,
+        ",".join(map(str, scaled_raw_data_df.columns)),
+        ",".join(map(str, scaled_raw_data_df.index)),
+    ]
+    return hashlib.sha256("|".join(key_parts).encode("utf-8")).hexdigest()
+
+
+def get_knn_graph(
+    scaled_raw_data_df: pd.DataFrame, settings: HeatmapSettings
+) -> Union[KnnGraph, None]:
+    """Cached kNN graph of the scaled items, None if too few items to need one."""
+    if scaled_raw_data_df.shape[0] < KNN_GRAPH_MIN_ITEMS:
+        return None
+
+    key = get_knn_graph_key(scaled_raw_data_df, settings)
+    if key in knn_graphs:
+        logger.info("Reusing cached kNN graph")
+        return knn_graphs[key]
+
+    knn_indices, knn_dists, knn_search_index = nearest_neighbors(
+        scaled_raw_data_df.values,
+        n_neighbors=KNN_GRAPH_NEIGHBORS,
+        metric="euclidean",
+        metric_kwds={},
+        angular=False,
+        random_state=np.random.RandomState(42),
+    )
+    knn_graph = KnnGraph(
+        scaled_raw_data_df.index, knn_indices, knn_dists, knn_search_index
+    )
+
+    if len(knn_graphs) >= MAX_KNN_GRAPHS:
+        oldest_key = next(iter(knn_graphs))
+        knn_graphs.pop(oldest_key)
+    knn_graphs[key] = knn_graph
+    return knn_graph
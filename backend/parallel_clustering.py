@@ -0,0 +1,167 @@
+import logging
+import multiprocessing
+import os
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Callable, Dict, Union
+
+import numpy as np
+
+
+logger = logging.getLogger("IHECH Logger")
+
+# Subtrees with fewer items are cheaper to cluster inline than to ship to a worker.
+PARALLEL_MIN_SUBTREE_SIZE = 2000
+
+# Only subtrees down to this level are dispatched, deeper ones are always inline.
+MAX_PARALLEL_LEVEL = 2
+
+MAX_CLUSTERING_WORKERS = os.cpu_count() or 1
+clustering_executor: Union[ProcessPoolExecutor, None] = None
+
+# Objects a worker rebuilt from shared memory, by the block of their first array,
+# so a worker copies them once per request instead of once per subtree.
+MAX_WORKER_OBJECTS = 4
+worker_objects: Dict[str, Any] = {}
+
+
+def get_clustering_executor() -> ProcessPoolExecutor:
+    global clustering_executor
+    if clustering_executor is None:
+        # spawn instead of fork, the server process runs threads
+        clustering_executor = ProcessPoolExecutor(
+            max_workers=MAX_CLUSTERING_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return clustering_executor
+
+
+class SharedArray:
+    """Array copied once into shared memory. Pickling it only sends the name of
+    the block, workers copy the part of their subtree out of it."""
+
+    name: str
+    shape: tuple
+    dtype: np.dtype
+    shared_memory: Union[SharedMemory, None]
+
+    def __init__(self, array: np.ndarray):
+        array = np.ascontiguousarray(array)
+        self.shared_memory = SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, array.dtype, buffer=self.shared_memory.buf)[:] = array
+        self.name = self.shared_memory.name
+        self.shape = array.shape
+        self.dtype = array.dtype
+
+    def __getstate__(self):
+        return {"name": self.name, "shape": self.shape, "dtype": self.dtype}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.shared_memory = None
+
+    def get(self) -> np.ndarray:
+        """Copy of the whole array."""
+        shared_memory = SharedMemory(name=self.name)
+        try:
+            return np.ndarray(self.shape, self.dtype, buffer=shared_memory.buf).copy()
+        finally:
+            shared_memory.close()
+
+    def take(self, positions: np.ndarray, axis: int) -> np.ndarray:
+        shared_memory = SharedMemory(name=self.name)
+        try:
+            return np.take(
+                np.ndarray(self.shape, self.dtype, buffer=shared_memory.buf),
+                positions,
+                axis=axis,
+            )
+        finally:
+            shared_memory.close()
+
+    def release(self) -> None:
+        if self.shared_memory is not None:
+            self.shared_memory.close()
+            self.shared_memory.unlink()
+            self.shared_memory = None
+
+
+def get_shared_object(
+    arrays: Dict[str, SharedArray],
+    name: str,
+    from_shared_arrays: Callable[[Dict[str, np.ndarray]], Any],
+) -> Any:
+    """Worker side of the objects given to ParallelClustering, None if there was
+    none under this name."""
+    prefix = f"{name}:"
+    object_arrays = {
+        key[len(prefix) :]: array
+        for key, array in arrays.items()
+        if key.startswith(prefix)
+    }
+    if not object_arrays:
+        return None
+    key = next(iter(object_arrays.values())).name
+    if key not in worker_objects:
+        if len(worker_objects) >= MAX_WORKER_OBJECTS:
+            worker_objects.pop(next(iter(worker_objects)))
+        worker_objects[key] = from_shared_arrays(
+            {
+                array_name: array.get()
+                for array_name, array in object_arrays.items()
+            }
+        )
+    return worker_objects[key]
+
+
+class ParallelClustering:
+    """Dispatches large subtrees to worker processes, which read the given
+    arrays from shared memory. The arrays are only copied there on the first
+    submit, requests without a large enough subtree never copy them.
+
+    Objects like the kNN graph or the dendrogram are shared the same way,
+    through their get_shared_arrays, instead of being pickled for every
+    subtree. Workers rebuild them with get_shared_object."""
+
+    arrays: Dict[str, np.ndarray]
+    objects: Dict[str, Any]
+    shared_arrays: Union[Dict[str, SharedArray], None]
+
+    def __init__(self, arrays: Dict[str, np.ndarray], **objects):
+        self.arrays = arrays
+        self.objects = {name: obj for name, obj in objects.items() if obj is not None}
+        self.shared_arrays = None
+
+    def should_submit(self, number_of_items: int, level: int) -> bool:
+        return (
+            MAX_CLUSTERING_WORKERS > 1
+            and number_of_items >= PARALLEL_MIN_SUBTREE_SIZE
+            and level <= MAX_PARALLEL_LEVEL
+        )
+
+    def get_shared_arrays(self) -> Dict[str, SharedArray]:
+        if self.shared_arrays is None:
+            self.shared_arrays = {}
+            try:
+                for name, array in self.arrays.items():
+                    self.shared_arrays[name] = SharedArray(array)
+                for name, obj in self.objects.items():
+                    for array_name, array in obj.get_shared_arrays().items():
+                        self.shared_arrays[f"{name}:{array_name}"] = SharedArray(array)
+            except Exception:
+                self.release()
+                raise
+        return self.shared_arrays
+
+    def submit(self, function: Callable, *args, **kwargs) -> Future:
+        """Runs function(arrays, *args, **kwargs) in a worker."""
+        return get_clustering_executor().submit(
+            function, self.get_shared_arrays(), *args, **kwargs
+        )
+
+    def release(self) -> None:
+        if self.shared_arrays is None:
+            return
+        for array in self.shared_arrays.values():
+            array.release()
+        self.shared_arrays = None
@@ -0,0 +1,89 @@
+import gzip
+import json
+import os
+from typing import IO, Union
+
+import zstandard
+
+
+# Largest request body in bytes, compressed as Flask's MAX_CONTENT_LENGTH and
+# decompressed here. A compressed body can expand to any size, larger
+# decompressed bodies are rejected before they are held in memory.
+MAX_REQUEST_BODY_SIZE = int(os.getenv("MAX_REQUEST_BODY_SIZE", 256 * 1024 * 1024))
+
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+class RequestBodyTooLarge(ValueError):
+    pass
+
+
+def get_decompressed_stream(
+    stream: IO[bytes], content_encoding: Union[str, None]
+) -> IO[bytes]:
+    """Reads stream as decoded by its Content-Encoding, without buffering it."""
+    if content_encoding is None or content_encoding in ("", "identity"):
+        return stream
+    if content_encoding == "gzip":
+        return gzip.GzipFile(fileobj=stream, mode="rb")
+    if content_encoding == "zstd":
+        return zstandard.ZstdDecompressor().stream_reader(
+            stream, read_across_frames=True
+        )
+    raise ValueError(f"Unsupported Content-Encoding: {content_encoding}")
+
+
+def read_json_body(
+    stream: IO[bytes],
+    content_encoding: Union[str, None],
+    max_size: int = MAX_REQUEST_BODY_SIZE,
+):
+    """JSON of a request body, decompressed chunk by chunk and rejected as soon
+    as it exceeds max_size bytes.
+
+    The whole decompressed body is held before it is parsed, max_size bounds
+    that memory. Its bytes are released once they are decoded, Werkzeug's
+    request.json would keep them alive next to the parsed JSON.
+    """
+    body = bytearray()
+    decompressed_stream = get_decompressed_stream(stream, content_encoding)
+    while True:
+        chunk = decompressed_stream.read(READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        if len(body) + len(chunk) > max_size:
+            raise RequestBodyTooLarge(
+                f"Request body is larger than {max_size} bytes after decompression"
+            )
+        body += chunk
+    text = body.decode("utf-8")
+    del body
+    return json.loads(text)
+
+
+class StringReader:
+    """Read-only file over a string, for parsing a CSV sent inside the JSON body.
+
+    StringIO and BytesIO copy the whole string first, this returns slices of it.
+    """
+
+    def __init__(self, string: str):
+        self.string = string
+        self.position = 0
+
+    def read(self, size: int = -1) -> str:
+        start = self.position
+        if size is None or size < 0:
+            self.position = len(self.string)
+        else:
+            self.position = min(start + size, len(self.string))
+        return self.string[start : self.position]
+
+    def readline(self) -> str:
+        start = self.position
+        end = self.string.find("\n", start)
+        self.position = len(self.string) if end == -1 else end + 1
+        return self.string[start : self.position]
+
+    def __iter__(self):
+        return iter(self.readline, "")
@@ -0,0 +1,96 @@
+import base64
+from typing import Dict, List, Union
+
+import numpy as np
+import pandas as pd
+
+
+# A selection is either the list of selected row indexes or column names, or
+# one of these encodings of the selected positions in the rows or columns of
+# the uploaded CSV:
+#   {"encoding": "RANGES", "ranges": [[start, stop], ...]}  half-open ranges
+#   {"encoding": "ALL_EXCEPT", "size": n, "positions": [...]}  unselected positions
+#   {"encoding": "BITMAP", "size": n, "bitmap": "..."}  base64 of the selected
+#       positions packed 8 per byte, lowest position in the lowest bit
+Selection = Union[List, Dict]
+
+
+def get_selected_positions(selection: Dict) -> np.ndarray:
+    encoding = selection.get("encoding")
+    if encoding == "RANGES":
+        ranges = np.asarray(selection["ranges"], dtype=np.int64).reshape(-1, 2)
+        if len(ranges) == 0:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([np.arange(start, stop) for start, stop in ranges])
+    if encoding == "ALL_EXCEPT":
+        is_selected = np.ones(selection["size"], dtype=bool)
+        unselected = np.asarray(selection["positions"], dtype=np.int64)
+        # negative positions would silently count from the end
+        if len(unselected) > 0 and (
+            unselected.min() < 0 or unselected.max() >= selection["size"]
+        ):
+            raise ValueError("Unselected positions are outside of the selection size")
+        is_selected[unselected] = False
+        return np.flatnonzero(is_selected)
+    if encoding == "BITMAP":
+        packed = np.frombuffer(base64.b64decode(selection["bitmap"]), dtype=np.uint8)
+        is_selected = np.unpackbits(packed, bitorder="little")
+        if len(is_selected) < selection["size"]:
+            raise ValueError("Selection bitmap is shorter than its size")
+        return np.flatnonzero(is_selected[: selection["size"]])
+    raise ValueError(f"Unknown selection encoding: {encoding}")
+
+
+def decode_selection(selection: Selection, universe: pd.Index) -> List:
+    """Selected values of universe, the row index or the columns of the CSV."""
+    if isinstance(selection, list):
+        return selection
+    positions = get_selected_positions(selection)
+    if len(positions) > 0 and (positions.min() < 0 or positions.max() >= len(universe)):
+        raise ValueError("Selection contains positions outside of the CSV")
+    return universe[positions].tolist()
+
+
+def get_selection_size(selection: Selection) -> int:
+    """Number of selected values, without the CSV to decode them against."""
+    if isinstance(selection, list):
+        return len(selection)
+    encoding = selection.get("encoding")
+    if encoding == "RANGES":
+        return sum(max(stop - start, 0) for start, stop in selection["ranges"])
+    if encoding == "ALL_EXCEPT":
+        return selection["size"] - len(set(selection["positions"]))
+    return len(get_selected_positions(selection))
+
+
+def get_canonical_selection(
+    selection: Selection, universe: Union[pd.Index, None] = None
+) -> Selection:
+    """The same selection sorted and without duplicates. Row indexes and all
+    encodings become ranges, the row index of the CSV is its positions. Column
+    names become ranges of their positions in universe, the columns of the CSV,
+    if it is given and contains all of them."""
+    if isinstance(selection, list):
+        if all(
+            isinstance(value, int) and not isinstance(value, bool) for value in selection
+        ):
+            positions = np.asarray(selection, dtype=np.int64)
+        else:
+            names = list(set(selection))
+            if universe is None:
+                return sorted(names, key=str)
+            positions = universe.get_indexer(names)
+            if (positions < 0).any():
+                return sorted(names, key=str)
+    else:
+        positions = get_selected_positions(selection)
+    positions = np.unique(positions)
+    run_starts = np.flatnonzero(np.diff(positions) != 1) + 1
+    return {
+        "encoding": "RANGES",
+        "ranges": [
+            [int(run[0]), int(run[-1]) + 1]
+            for run in np.split(positions, run_starts)
+            if len(run) > 0
+        ],
+    }
@@ -0,0 +1,106 @@
+import unicodedata
+from typing import Dict, List, Tuple
+
+import numpy as np
+from heatmap_types import HierarchicalAttribute, ItemTree
+
+
+# Criteria of the client's RowSorter and ColumnSorter, by technicalName
+ITEM_SORT_CRITERIA = ["name", "hasChildren", "amountOfChildren"]
+ATTRIBUTE_SORT_CRITERIA = [
+    "name",
+    "hasChildren",
+    "standardDeviation",
+    "originalAttributeOrder",
+]
+
+
+def get_dense_ranks(values: np.ndarray) -> np.ndarray:
+    """Rank of every value among the distinct values, ascending, equal values
+    share a rank and NaN comes last."""
+    _, ranks = np.unique(values, return_inverse=True)
+    return ranks.astype(np.int64)
+
+
+def get_character_group(character: str) -> int:
+    category = unicodedata.category(character)
+    if category[0] in "ZPSC":
+        return 0
+    if category[0] == "N":
+        return 1
+    return 2
+
+
+def get_collation_key(name: str) -> Tuple:
+    """Approximates the root collation of ICU, which localeCompare of the
+    client uses in browsers. Whitespace, punctuation and symbols sort before
+    digits and digits before letters. Names are compared by their letters
+    without accents and case first, then by their accents and then by case,
+    lowercase first. Locale tailorings, like the Swedish å after z, and
+    contractions are not reproduced, such names can be ordered differently
+    than by the client's own comparison."""
+    decomposed = unicodedata.normalize("NFD", name)
+    primary: List[Tuple[int, str]] = []
+    secondary: List[str] = []
+    tertiary: List[int] = []
+    for character in decomposed:
+        if unicodedata.combining(character):
+            if secondary:
+                secondary[-1] += character
+            continue
+        primary.append((get_character_group(character), character.casefold()))
+        secondary.append("")
+        tertiary.append(0 if character == character.casefold() else 1)
+    return (primary, secondary, tertiary, name)
+
+
+def get_name_ranks(names: List[str]) -> np.ndarray:
+    unique_names = sorted(set(names), key=get_collation_key)
+    rank_of_name = {name: rank for rank, name in enumerate(unique_names)}
+    return np.array([rank_of_name[name] for name in names], dtype=np.int64)
+
+
+def get_item_sort_ranks(item_tree: ItemTree) -> Dict[str, np.ndarray]:
+    """Rank of every item node under each criterion, in the order of the nodes
+    in the JSON. Ranks are comparable across the whole tree, so the client
+    orders siblings and sticky rows by comparing integers."""
+    preorder = item_tree.get_preorder()
+    has_children = np.diff(item_tree.child_offsets) > 0
+    return {
+        "name": get_name_ranks(item_tree.item_names[preorder].tolist()),
+        # nodes with children come first
+        "hasChildren": (~has_children[preorder]).astype(np.int64),
+        "amountOfChildren": get_dense_ranks(
+            item_tree.amount_of_data_points[preorder]
+        ),
+    }
+
+
+def get_attribute_sort_ranks(
+    hierarchical_attributes: List[HierarchicalAttribute],
+) -> Dict[str, np.ndarray]:
+    """Like get_item_sort_ranks, for the attribute hierarchy."""
+    attributes: List[HierarchicalAttribute] = []
+    stack = list(reversed(hierarchical_attributes))
+    while stack:
+        attribute = stack.pop()
+        attributes.append(attribute)
+        if attribute.children:
+            stack.extend(reversed(attribute.children))
+
+    return {
+        "name": get_name_ranks([attribute.attributeName for attribute in attributes]),
+        "hasChildren": np.array(
+            [0 if attribute.children else 1 for attribute in attributes],
+            dtype=np.int64,
+        ),
+        "standardDeviation": get_dense_ranks(
+            np.array([attribute.std for attribute in attributes], dtype=np.float64)
+        ),
+        "originalAttributeOrder": get_dense_ranks(
+            np.array(
+                [attribute.originalAttributeOrder for attribute in attributes],
+                dtype=np.float64,
+            )
+        ),
+    }
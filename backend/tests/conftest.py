@@ -0,0 +1,85 @@
+import json
+import os
+import sys
+import time
+from io import StringIO
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+# importing app would otherwise create ihech.log in the working directory
+os.environ["IHECH_LOG_FILE"] = ""
+
+
+def make_csv(number_of_items=60, number_of_attributes=6, seed=0, binary=False) -> str:
+    """A CSV in the upload format: item names and two row metadata columns, an
+    empty column, the attributes, one column metadata row and an empty row."""
+    rng = np.random.default_rng(seed)
+    attributes = [f"Att_{i}" for i in range(number_of_attributes)]
+    header = ["Item_name", "Group", "Sub", ""] + attributes
+    metadata = ["Att_group", "", "", ""] + [
+        f"g{i % 3}" for i in range(number_of_attributes)
+    ]
+    lines = [header, metadata, [""] * len(header)]
+    for i in range(number_of_items):
+        if binary:
+            values = rng.integers(0, 2, number_of_attributes)
+        else:
+            values = np.round(rng.normal(size=number_of_attributes) + i % 4, 3)
+        lines.append([f"Item_{i}", f"G{i % 5}", f"S{i % 2}", ""] + list(values))
+    return "\n".join(",".join(map(str, line)) for line in lines)
+
+
+def make_settings_dict(csv_file: str, **overrides) -> dict:
+    original_df = pd.read_csv(StringIO(csv_file))
+    item_rows = original_df.index[original_df.iloc[:, 0].notna()].tolist()[1:]
+    attributes = [column for column in original_df.columns if column.startswith("Att_")]
+    settings = {
+        "csvFile": csv_file,
+        "hierarchicalRowsMetadataColumnNames": ["Group", "Sub"],
+        "hierarchicalColumnsMetadataRowIndexes": [0],
+        "selectedItemsRowIndexes": item_rows,
+        "selectedAttributesColumnNames": attributes,
+        "stickyAttributesColumnNames": [],
+        "sortAttributesBasedOnStickyItems": False,
+        "sortOrderAttributes": "HETEROGENIC",
+        "stickyItemsRowIndexes": [],
+        "clusterItemsBasedOnStickyAttributes": False,
+        "clusterItemsByCollections": False,
+        "clusterAttributesByCollections": False,
+        "itemsClusterSize": 4,
+        "attributesClusterSize": 3,
+        "dimReductionAlgo": "PCA",
+        "clusterAfterDimRed": False,
+        "itemAggregateMethod": "mean",
+        "attributeAggregateMethod": "mean",
+        "scaling": "STANDARDIZING",
+    }
+    settings.update(overrides)
+    return settings
+
+
+def build_heatmap(settings_dict: dict, **kwargs):
+    """The heatmap for settings_dict, as the client receives it."""
+    from heatmap import create_heatmap
+    from heatmap_types import HeatmapSettings, custom_encoder
+
+    original_df = pd.read_csv(StringIO(settings_dict["csvFile"]))
+    heatmap_json = create_heatmap(
+        original_df, HeatmapSettings(dict(settings_dict)), time.perf_counter(), **kwargs
+    )
+    return json.loads(json.dumps(heatmap_json, default=custom_encoder))
+
+
+def iterate_nodes(nodes):
+    """Every node of the serialized trees in nodes, parents before children."""
+    for node in nodes or []:
+        yield node
+        yield from iterate_nodes(node["children"])
+
+
+@pytest.fixture
+def csv_file() -> str:
+    return make_csv()
@@ -0,0 +1,245 @@
+from io import StringIO
+
+import pandas as pd
+import pytest
+from conftest import build_heatmap, make_csv, make_settings_dict
+
+import app as app_module
+from heatmap_types import HeatmapSettings
+
+
+@pytest.fixture
+def client():
+    app_module.heatmap_cache.clear()
+    app_module.registered_datasets.clear()
+    return app_module.app.test_client()
+
+
+def test_budget_sampled_heatmap_is_final(client, monkeypatch):
+    monkeypatch.setattr(
+        app_module, "fit_settings_to_latency_budget", lambda *args: (20, ["sample"])
+    )
+    settings = make_settings_dict(make_csv(), maxLatencyMs=1)
+
+    first = client.post("/api/heatmap", json={"settings": settings}).get_json()
+    assert first["isSampled"]
+    assert not first["isApproximate"]
+    assert first["itemNamesAndData"][0]["amountOfDataPoints"] == 20
+
+    second = client.post("/api/heatmap", json={"settings": settings}).get_json()
+    assert second == first
+
+
+def test_preview_is_followed_by_full_heatmap(client, monkeypatch):
+    monkeypatch.setattr(
+        app_module, "fit_settings_to_latency_budget", lambda *args: (30, ["sample"])
+    )
+    settings = make_settings_dict(
+        make_csv(), maxLatencyMs=1, previewMode=True, previewSampleSize=20
+    )
+
+    preview = client.post("/api/heatmap", json={"settings": settings}).get_json()
+    assert preview["isApproximate"]
+    assert preview["isSampled"]
+    assert preview["itemNamesAndData"][0]["amountOfDataPoints"] == 20
+
+    # waits for the background computation, which ignores the budget sample
+    full = client.post("/api/heatmap", json={"settings": settings}).get_json()
+    assert not full["isApproximate"]
+    assert not full["isSampled"]
+    assert full["itemNamesAndData"][0]["amountOfDataPoints"] == 60
+
+
+def test_dissimilarities_ignore_unknown_sticky_items(client):
+    settings = make_settings_dict(make_csv())
+    heatmap = client.post("/api/heatmap", json={"settings": settings}).get_json()
+
+    def get_dissimilarities(sticky_items_row_indexes):
+        response = client.post(
+            "/api/heatmap/dissimilarities",
+            json={
+                "resultId": heatmap["resultId"],
+                "stickyItemsRowIndexes": sticky_items_row_indexes,
+            },
+        )
+        assert response.status_code == 200
+        return response.get_json()["attributeDissimilarities"]
+
+    assert get_dissimilarities([3, 5, 99999]) == get_dissimilarities([3, 5])
+    # fewer than two known sticky items fall back to the stds over all items
+    assert get_dissimilarities([3, 99999]) == heatmap["attributeDissimilarities"]
+    assert get_dissimilarities([]) == heatmap["attributeDissimilarities"]
+
+
+def test_dissimilarities_of_uncached_heatmap(client):
+    response = client.post(
+        "/api/heatmap/dissimilarities",
+        json={"resultId": "unknown", "stickyItemsRowIndexes": [3, 5]},
+    )
+    assert response.status_code == 404
+
+
+def test_dissimilarities_of_sampled_heatmap(client, monkeypatch):
+    monkeypatch.setattr(
+        app_module, "fit_settings_to_latency_budget", lambda *args: (20, ["sample"])
+    )
+    settings = make_settings_dict(make_csv(), maxLatencyMs=1)
+    heatmap = client.post("/api/heatmap", json={"settings": settings}).get_json()
+
+    # most of the selected items are not in the sample
+    response = client.post(
+        "/api/heatmap/dissimilarities",
+        json={
+            "resultId": heatmap["resultId"],
+            "stickyItemsRowIndexes": settings["selectedItemsRowIndexes"],
+        },
+    )
+    assert response.status_code == 200
+    assert len(response.get_json()["attributeDissimilarities"]) == 6
+
+
+def test_preview_of_small_data_is_the_full_heatmap(client):
+    settings = make_settings_dict(make_csv(), previewMode=True, previewSampleSize=100)
+    heatmap = client.post("/api/heatmap", json={"settings": settings}).get_json()
+    assert not heatmap["isApproximate"]
+    assert not heatmap["isSampled"]
+    assert heatmap["resultId"] in app_module.heatmap_cache
+    assert not app_module.pending_heatmaps
+
+
+def test_registered_dataset_is_hashed_once(client, monkeypatch):
+    csv_file = make_csv()
+    response = client.post("/api/dataset", json={"csvFile": csv_file})
+    assert response.status_code == 200
+    fingerprint = response.get_json()["datasetFingerprint"]
+
+    def fail(csv_file):
+        raise AssertionError("the CSV was hashed")
+
+    monkeypatch.setattr("heatmap_types.get_dataset_fingerprint", fail)
+    monkeypatch.setattr(app_module, "get_dataset_fingerprint", fail)
+    settings = make_settings_dict(csv_file, datasetFingerprint=fingerprint)
+    del settings["csvFile"]
+    first = client.post("/api/heatmap", json={"settings": settings}).get_json()
+    # a cache miss does not hash it either
+    settings["itemsClusterSize"] = 5
+    assert client.post("/api/heatmap", json={"settings": settings}).status_code == 200
+    settings["itemsClusterSize"] = 4
+    second = client.post(
+        "/api/heatmap", json={"settings": {**settings, "csvFile": csv_file}}
+    ).get_json()
+    assert second == first
+
+
+def test_unregistered_dataset_is_not_found(client):
+    settings = make_settings_dict(make_csv(), datasetFingerprint="0" * 64)
+    del settings["csvFile"]
+    response = client.post("/api/heatmap", json={"settings": settings})
+    assert response.status_code == 404
+
+
+def test_mismatched_client_fingerprint_is_rejected(client):
+    settings = make_settings_dict(make_csv(), datasetFingerprint="0" * 64)
+    response = client.post("/api/heatmap", json={"settings": settings})
+    assert response.status_code == 400
+    assert not app_module.heatmap_cache
+
+    other_csv_file = make_csv(seed=1)
+    fingerprint = client.post(
+        "/api/dataset", json={"csvFile": other_csv_file}
+    ).get_json()["datasetFingerprint"]
+    settings["datasetFingerprint"] = fingerprint
+    response = client.post("/api/heatmap", json={"settings": settings})
+    assert response.status_code == 400
+    assert not app_module.heatmap_cache
+
+
+def test_column_names_and_their_positions_share_the_cached_heatmap(client):
+    csv_file = make_csv()
+    settings = make_settings_dict(csv_file)
+    first = client.post("/api/heatmap", json={"settings": settings}).get_json()
+
+    columns = app_module.registered_datasets[
+        next(iter(app_module.registered_datasets))
+    ].columns
+    positions = columns.get_indexer(settings["selectedAttributesColumnNames"])
+    settings["selectedAttributesColumnNames"] = {
+        "encoding": "RANGES",
+        "ranges": [[int(positions[0]), int(positions[-1]) + 1]],
+    }
+    client.post("/api/heatmap", json={"settings": settings})
+    assert len(app_module.heatmap_cache) == 1
+    assert first["resultId"] in app_module.heatmap_cache
+
+
+def test_estimate_without_csv(client):
+    settings = make_settings_dict(make_csv(), maxLatencyMs=1)
+    del settings["csvFile"]
+    response = client.post("/api/heatmap/estimate", json={"settings": settings})
+    assert response.status_code == 200
+    estimate = response.get_json()
+    assert estimate["estimatedMs"] >= 0
+    assert set(estimate["stagesMs"]) >= {"dimReduction", "clusteringItems"}
+    assert "adjustments" in estimate
+
+
+def switch_to_pca(number_of_items, number_of_attributes, settings):
+    settings.dimReductionAlgo = "PCA"
+    return None, ["dimReductionAlgo: PCA"]
+
+
+def get_columns(csv_file: str) -> pd.Index:
+    return pd.read_csv(StringIO(csv_file), nrows=0).columns
+
+
+def test_budget_adjustments_are_part_of_the_cache_key(client, monkeypatch):
+    monkeypatch.setattr(app_module, "fit_settings_to_latency_budget", switch_to_pca)
+    settings = make_settings_dict(make_csv(), maxLatencyMs=1, dimReductionAlgo="TSNE")
+    heatmap = client.post("/api/heatmap", json={"settings": settings}).get_json()
+
+    columns = get_columns(settings["csvFile"])
+    adjusted = HeatmapSettings({**settings, "dimReductionAlgo": "PCA"})
+    assert heatmap["resultId"] == adjusted.get_cache_key(columns=columns)
+    unadjusted = HeatmapSettings(settings)
+    assert heatmap["resultId"] != unadjusted.get_cache_key(columns=columns)
+
+
+def test_budget_sample_size_is_part_of_the_cache_key(client, monkeypatch):
+    monkeypatch.setattr(
+        app_module, "fit_settings_to_latency_budget", lambda *args: (20, ["sample"])
+    )
+    settings = make_settings_dict(make_csv(), maxLatencyMs=1)
+    heatmap = client.post("/api/heatmap", json={"settings": settings}).get_json()
+    assert heatmap["resultId"] == HeatmapSettings(settings).get_cache_key(
+        20, columns=get_columns(settings["csvFile"])
+    )
+
+
+def test_full_heatmap_after_preview_ignores_budget_adjustments(client, monkeypatch):
+    monkeypatch.setattr(app_module, "fit_settings_to_latency_budget", switch_to_pca)
+    settings = make_settings_dict(make_csv(), dimReductionAlgo="TSNE")
+    preview_settings = {**settings, "maxLatencyMs": 1, "previewMode": True}
+
+    preview = client.post("/api/heatmap", json={"settings": preview_settings}).get_json()
+    assert preview["isApproximate"]
+    assert not preview["isSampled"]
+
+    full = client.post("/api/heatmap", json={"settings": preview_settings}).get_json()
+    expected = build_heatmap(settings)
+    assert not full["isApproximate"]
+    assert full["itemNamesAndData"] == expected["itemNamesAndData"]
+    assert full["itemNamesAndData"] != preview["itemNamesAndData"]
+
+
+def test_json_timing_counts_the_selected_attributes(client, monkeypatch):
+    recorded = []
+    monkeypatch.setattr(
+        app_module,
+        "record_stage_timings",
+        lambda items, attributes, settings, timings: recorded.append((items, attributes)),
+    )
+    settings = make_settings_dict(
+        make_csv(), selectedAttributesColumnNames=["Att_0", "Att_2", "Att_4"]
+    )
+    client.post("/api/heatmap", json={"settings": settings}).get_data()
+    assert recorded == [(60, 3)]
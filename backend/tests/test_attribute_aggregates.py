@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+from conftest import build_heatmap, make_csv, make_settings_dict
+
+import clustering_functions
+from clustering_functions import ATTRIBUTE_AGGREGATE_METHODS, reduce_segments
+
+NAIVE_AGGREGATES = {
+    "mean": lambda rows: rows.mean(axis=1),
+    "sum": lambda rows: rows.sum(axis=1),
+    "max": lambda rows: rows.max(axis=1),
+    "min": lambda rows: rows.min(axis=1),
+    "median": lambda rows: np.median(rows, axis=1),
+    "binary": lambda rows: (rows > 0).any(axis=1).astype(float),
+}
+
+
+@pytest.mark.parametrize("method", ATTRIBUTE_AGGREGATE_METHODS)
+def test_reduce_segments_matches_per_segment_reduction(method):
+    rng = np.random.default_rng(0)
+    data = np.round(rng.normal(size=(6, 10)), 3)
+    segments = [[0, 1, 2], [3], [4, 5, 6, 7, 8, 9, 1, 0, 2], [9, 2], [], [5]]
+    counts = np.array([len(segment) for segment in segments])
+    members = np.concatenate([np.asarray(s, dtype=np.int64) for s in segments])
+
+    columns = reduce_segments(
+        data.T[members], np.cumsum(counts) - counts, counts, method
+    ).T
+
+    for column, segment in enumerate(segments):
+        if segment:
+            expected = NAIVE_AGGREGATES[method](data[:, segment])
+            assert np.allclose(columns[:, column], expected)
+        else:
+            assert np.isnan(columns[:, column]).all()
+
+
+def test_reduce_segments_without_segments():
+    aggregates = reduce_segments(np.empty((0, 3)), np.empty(0), np.empty(0), "mean")
+    assert aggregates.shape == (0, 3)
+
+
+@pytest.mark.parametrize("method", ["mean", "median"])
+def test_aggregate_columns_do_not_depend_on_the_block_size(method, monkeypatch):
+    settings = make_settings_dict(make_csv(), attributeAggregateMethod=method)
+    heatmap = build_heatmap(settings)
+    monkeypatch.setattr(clustering_functions, "AGGREGATE_BLOCK_CELLS", 7)
+    assert build_heatmap(settings) == heatmap
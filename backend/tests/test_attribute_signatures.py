@@ -0,0 +1,63 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+from conftest import build_heatmap, iterate_nodes, make_csv, make_settings_dict
+
+from attribute_signatures import get_attribute_signatures
+
+
+def make_settings(signature, size=10) -> SimpleNamespace:
+    return SimpleNamespace(attributeSignature=signature, attributeSignatureSize=size)
+
+
+@pytest.fixture
+def rotated_df():
+    # one row per attribute, one column per item
+    return pd.DataFrame(np.random.default_rng(0).normal(size=(6, 40)))
+
+
+@pytest.mark.parametrize("signature", ["FULL", "SAMPLE", "RANDOM_PROJECTION"])
+def test_few_items_are_passed_through(rotated_df, signature):
+    assert get_attribute_signatures(rotated_df, make_settings(signature, 40)) is rotated_df
+    assert get_attribute_signatures(rotated_df, make_settings("FULL")) is rotated_df
+
+
+def test_sample_keeps_item_columns(rotated_df):
+    strata = pd.Series(np.arange(40) % 4)
+    signatures = get_attribute_signatures(rotated_df, make_settings("SAMPLE"), strata)
+    # every stratum keeps its share of the size, rounded down
+    assert signatures.shape == (6, 8)
+    assert signatures.equals(rotated_df[signatures.columns])
+    assert set(strata[signatures.columns]) == {0, 1, 2, 3}
+
+
+def test_random_projection(rotated_df):
+    signatures = get_attribute_signatures(rotated_df, make_settings("RANDOM_PROJECTION"))
+    assert signatures.shape == (6, 10)
+    assert signatures.index.equals(rotated_df.index)
+
+
+def test_unknown_signature(rotated_df):
+    with pytest.raises(ValueError):
+        get_attribute_signatures(rotated_df, make_settings("UNKNOWN"))
+
+
+@pytest.mark.parametrize("signature", ["SAMPLE", "RANDOM_PROJECTION"])
+def test_heatmap_keeps_every_attribute(signature):
+    settings = make_settings_dict(make_csv(number_of_attributes=12))
+    heatmap = build_heatmap(settings)
+    signed = build_heatmap(
+        {**settings, "attributeSignature": signature, "attributeSignatureSize": 10}
+    )
+
+    def get_leaf_stds(result):
+        return {
+            node["attributeName"]: node["std"]
+            for node in iterate_nodes(result["hierarchicalAttributes"])
+            if not node["children"]
+        }
+
+    assert get_leaf_stds(signed) == get_leaf_stds(heatmap)
+    assert len(get_leaf_stds(signed)) == 12
@@ -0,0 +1,65 @@
+from io import StringIO
+
+import numpy as np
+import pandas as pd
+import pytest
+from conftest import build_heatmap, iterate_nodes, make_csv, make_settings_dict
+
+from calculate_attribute_std import calculate_attribute_std, get_list_of_item_values_idx
+from heatmap_types import HierarchicalAttribute, ItemNameAndData
+
+
+def make_item(data, children=None) -> ItemNameAndData:
+    return ItemNameAndData(None, "item", False, data, 1, 0.0, 0.0, children)
+
+
+def make_attribute(index, children=None) -> HierarchicalAttribute:
+    return HierarchicalAttribute(f"Att_{index}", index, 0.0, index, False, False, children)
+
+
+def test_stds_equal_those_of_every_column():
+    rng = np.random.default_rng(0)
+    items = [
+        make_item(
+            list(rng.normal(size=3)),
+            [make_item(list(rng.normal(size=3))), make_item(list(rng.normal(size=3)))],
+        ),
+        make_item(list(rng.normal(size=3))),
+    ]
+    attributes = [make_attribute(2, [make_attribute(0), make_attribute(1)])]
+
+    calculate_attribute_std(items, attributes)
+
+    for attribute in [attributes[0], *attributes[0].children]:
+        expected = np.std(get_list_of_item_values_idx(items, attribute.dataAttributeIndex))
+        assert np.isclose(attribute.std, expected)
+
+
+def test_single_item_has_zero_std():
+    attributes = [make_attribute(0)]
+    calculate_attribute_std([make_item([1.5])], attributes)
+    assert attributes[0].std == 0
+
+
+def get_leaves(node):
+    if not node["children"]:
+        return [node]
+    return [leaf for child in node["children"] for leaf in get_leaves(child)]
+
+
+@pytest.mark.parametrize("by_collections", [False, True])
+def test_heatmap_stds_match_the_attribute_columns(by_collections):
+    csv_file = make_csv(number_of_attributes=12)
+    settings = make_settings_dict(csv_file, clusterAttributesByCollections=by_collections)
+    heatmap = build_heatmap(settings)
+    original_df = pd.read_csv(StringIO(csv_file))
+    expected = original_df.loc[settings["selectedItemsRowIndexes"]].astype(
+        {name: float for name in settings["selectedAttributesColumnNames"]}
+    )[settings["selectedAttributesColumnNames"]].std()
+
+    for attribute in iterate_nodes(heatmap["hierarchicalAttributes"]):
+        if attribute["std"] == -1000:
+            # the root has no std of its own
+            continue
+        leaf_stds = expected[[leaf["attributeName"] for leaf in get_leaves(attribute)]]
+        assert np.isclose(attribute["std"], leaf_stds.mean())
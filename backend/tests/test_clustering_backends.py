@@ -0,0 +1,134 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import build_heatmap, make_csv, make_settings_dict
+
+import clustering_backends
+from clustering_backends import CLUSTERING_BACKENDS, MAX_AUTO_WARD_SIZE, cluster_rows
+
+
+def make_data(number_of_rows, number_of_columns, seed=0):
+    rng = np.random.default_rng(seed)
+    data = rng.normal(size=(number_of_rows, number_of_columns))
+    return data, pd.RangeIndex(number_of_rows)
+
+
+def test_auto_keeps_ward_for_embeddings():
+    data, item_indexes = make_data(1500, 2)
+    auto_labels = cluster_rows(data, item_indexes, 4, "AUTO")
+    ward_labels = cluster_rows(data, item_indexes, 4, "WARD")
+    assert np.array_equal(auto_labels, ward_labels)
+
+
+@pytest.mark.parametrize("number_of_rows", [1, 2, 7, 1500])
+def test_kd_tree_splits_into_balanced_groups(number_of_rows):
+    data, item_indexes = make_data(number_of_rows, 2)
+    labels = cluster_rows(data, item_indexes, 4, "KD_TREE")
+    counts = np.bincount(labels)
+    assert len(counts) == min(4, number_of_rows)
+    assert counts.max() - counts.min() <= 1
+
+
+def test_kd_tree_with_unit_weights_matches_unweighted():
+    data, item_indexes = make_data(1001, 2)
+    labels = cluster_rows(data, item_indexes, 5, "KD_TREE")
+    weighted_labels = cluster_rows(
+        data, item_indexes, 5, "KD_TREE", sample_weight=np.ones(1001)
+    )
+    assert np.array_equal(labels, weighted_labels)
+
+
+@pytest.mark.parametrize("clustering_backend", list(CLUSTERING_BACKENDS))
+def test_backends_split_into_at_most_cluster_size_groups(clustering_backend):
+    rng = np.random.default_rng(0)
+    data = np.vstack([rng.normal(size=(50, 3)) + offset for offset in (0, 10, 20)])
+    labels = cluster_rows(data, pd.RangeIndex(150), 3, clustering_backend)
+    assert labels.shape == (150,)
+    # well separated blobs are found by every backend
+    assert len(np.unique(labels)) == 3
+    assert all(len(np.unique(blob)) == 1 for blob in labels.reshape(3, 50))
+
+
+def test_auto_uses_kmeans_for_large_data():
+    data, item_indexes = make_data(MAX_AUTO_WARD_SIZE + 1, 3)
+    auto_labels = cluster_rows(data, item_indexes, 4, "AUTO")
+    kmeans_labels = cluster_rows(data, item_indexes, 4, "KMEANS")
+    assert np.array_equal(auto_labels, kmeans_labels)
+
+
+def test_auto_uses_birch_for_very_large_data(monkeypatch):
+    monkeypatch.setattr(clustering_backends, "MAX_AUTO_KMEANS_SIZE", MAX_AUTO_WARD_SIZE + 1)
+    data, item_indexes = make_data(MAX_AUTO_WARD_SIZE + 2, 3)
+    auto_labels = cluster_rows(data, item_indexes, 4, "AUTO")
+    birch_labels = cluster_rows(data, item_indexes, 4, "BIRCH")
+    assert np.array_equal(auto_labels, birch_labels)
+
+
+@pytest.mark.parametrize(
+    "number_of_rows, weighted_backend",
+    [(100, "KMEANS"), (MAX_AUTO_WARD_SIZE + 2, "BISECTING_KMEANS")],
+)
+def test_auto_uses_a_weighted_backend_for_collapsed_duplicates(
+    monkeypatch, number_of_rows, weighted_backend
+):
+    monkeypatch.setattr(clustering_backends, "MAX_AUTO_KMEANS_SIZE", MAX_AUTO_WARD_SIZE + 1)
+    data, item_indexes = make_data(number_of_rows, 3)
+    sample_weight = np.arange(number_of_rows) % 3 + 1.0
+    auto_labels = cluster_rows(data, item_indexes, 4, "AUTO", sample_weight=sample_weight)
+    weighted_labels = cluster_rows(
+        data, item_indexes, 4, weighted_backend, sample_weight=sample_weight
+    )
+    assert np.array_equal(auto_labels, weighted_labels)
+
+
+def test_auto_clusters_collapsed_duplicates_by_their_weight():
+    rng = np.random.default_rng(0)
+    data = np.repeat(rng.normal(size=(60, 2)), [1] * 59 + [200], axis=0)
+    duplicate_ids = np.repeat(np.arange(60), [1] * 59 + [200])
+    labels = cluster_rows(
+        data, pd.RangeIndex(len(data)), 4, "AUTO", duplicate_ids=duplicate_ids
+    )
+    weighted_labels = cluster_rows(
+        data[:60],
+        pd.RangeIndex(60),
+        4,
+        "KMEANS",
+        sample_weight=np.array([1.0] * 59 + [200.0]),
+    )
+    assert np.array_equal(labels[:60], weighted_labels)
+
+
+def test_unknown_backend():
+    data, item_indexes = make_data(10, 2)
+    with pytest.raises(ValueError):
+        cluster_rows(data, item_indexes, 2, "SPECTRAL")
+
+
+@pytest.mark.parametrize(
+    "clustering_backend", ["BIRCH", "BISECTING_KMEANS", "KD_TREE", "DENDROGRAM"]
+)
+def test_heatmap_with_backend_keeps_every_item(clustering_backend):
+    settings = make_settings_dict(make_csv(), clusteringBackend=clustering_backend)
+    heatmap = build_heatmap(settings)
+    root = heatmap["itemNamesAndData"][0]
+    assert root["amountOfDataPoints"] == 60
+    assert len(root["children"]) <= 4
+
+
+def test_embedding_is_always_split_like_a_kd_tree():
+    settings = make_settings_dict(make_csv(), clusterAfterDimRed=True)
+    heatmap = build_heatmap(settings)
+    root = heatmap["itemNamesAndData"][0]
+    sizes = [child["amountOfDataPoints"] for child in root["children"]]
+    assert max(sizes) - min(sizes) <= 1
+    for clustering_backend in ["KD_TREE", "WARD"]:
+        other = build_heatmap({**settings, "clusteringBackend": clustering_backend})
+        assert other["itemNamesAndData"] == heatmap["itemNamesAndData"]
+
+
+def test_kd_tree_leaves_the_attributes_to_auto():
+    settings = make_settings_dict(make_csv(number_of_attributes=12))
+    heatmap = build_heatmap({**settings, "clusteringBackend": "KD_TREE"})
+    expected = build_heatmap(settings)
+    assert heatmap["hierarchicalAttributes"] == expected["hierarchicalAttributes"]
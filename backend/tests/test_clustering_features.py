@@ -0,0 +1,71 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+from conftest import build_heatmap, iterate_nodes, make_csv, make_settings_dict
+
+import clustering_features
+from clustering_features import get_clustering_features
+
+
+def make_settings(feature_space, dimensions=3, fingerprint="data") -> SimpleNamespace:
+    return SimpleNamespace(
+        get_dataset_fingerprint=lambda: fingerprint,
+        scaling="STANDARDIZING",
+        clusteringFeatureSpace=feature_space,
+        clusteringFeatureDimensions=dimensions,
+    )
+
+
+@pytest.fixture
+def scaled_df():
+    clustering_features.clustering_features.clear()
+    yield pd.DataFrame(np.random.default_rng(0).normal(size=(30, 8)))
+    clustering_features.clustering_features.clear()
+
+
+@pytest.mark.parametrize("feature_space", ["FULL", "PCA", "RANDOM_PROJECTION"])
+def test_few_dimensions_are_passed_through(scaled_df, feature_space):
+    for settings in (make_settings(feature_space, 8), make_settings("FULL")):
+        assert get_clustering_features(scaled_df, settings) is scaled_df
+    few_items_df = scaled_df.iloc[:3]
+    assert get_clustering_features(few_items_df, make_settings(feature_space)) is few_items_df
+
+
+@pytest.mark.parametrize("feature_space", ["PCA", "RANDOM_PROJECTION"])
+def test_projected_features(scaled_df, feature_space):
+    features = get_clustering_features(scaled_df, make_settings(feature_space))
+    assert features.shape == (30, 3)
+    assert features.index.equals(scaled_df.index)
+    assert get_clustering_features(scaled_df, make_settings(feature_space)) is features
+
+
+def test_cache_is_bounded(scaled_df):
+    for i in range(clustering_features.MAX_CLUSTERING_FEATURES + 2):
+        get_clustering_features(scaled_df, make_settings("PCA", fingerprint=str(i)))
+    assert len(clustering_features.clustering_features) == clustering_features.MAX_CLUSTERING_FEATURES
+
+
+def test_unknown_feature_space(scaled_df):
+    with pytest.raises(ValueError):
+        get_clustering_features(scaled_df, make_settings("UNKNOWN"))
+
+
+@pytest.mark.parametrize("feature_space", ["PCA", "RANDOM_PROJECTION"])
+def test_heatmap_keeps_every_item(feature_space):
+    settings = make_settings_dict(make_csv(number_of_attributes=12))
+    heatmap = build_heatmap(settings)
+    projected = build_heatmap(
+        {**settings, "clusteringFeatureSpace": feature_space, "clusteringFeatureDimensions": 3}
+    )
+
+    def get_leaves(result):
+        return sorted(
+            (node["itemName"], node["data"])
+            for node in iterate_nodes(result["itemNamesAndData"])
+            if not node["children"]
+        )
+
+    assert get_leaves(projected) == get_leaves(heatmap)
+    assert projected["itemNamesAndData"][0]["data"] == heatmap["itemNamesAndData"][0]["data"]
@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+from conftest import build_heatmap, make_csv, make_settings_dict
+
+from collection_index import CollectionIndex, split_by_labels
+
+
+def make_metadata() -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    metadata_df = pd.DataFrame(
+        {
+            "Group": rng.choice(["b", "a", "c"], 40),
+            "Sub": rng.choice(["y", "x"], 40).astype(object),
+        }
+    )
+    metadata_df.loc[[3, 17], "Sub"] = np.nan
+    return metadata_df
+
+
+def get_expected_runs(metadata_df: pd.DataFrame, positions: np.ndarray, column_name: str):
+    codes, _ = pd.factorize(metadata_df[column_name], sort=True)
+    return [
+        (code, positions[codes[positions] == code])
+        for code in np.unique(codes[positions])
+    ]
+
+
+def assert_runs_equal(runs, expected_runs):
+    assert len(runs) == len(expected_runs)
+    for (code, positions), (expected_code, expected_positions) in zip(runs, expected_runs):
+        assert code == expected_code
+        assert np.array_equal(positions, expected_positions)
+
+
+def test_runs_of_every_path_match_a_groupby():
+    metadata_df = make_metadata()
+    collection_index = CollectionIndex.from_frame(metadata_df, ["Group", "Sub"])
+    all_positions = np.arange(len(metadata_df))
+
+    group_runs = collection_index.get_runs(all_positions, "Group")
+    assert_runs_equal(group_runs, get_expected_runs(metadata_df, all_positions, "Group"))
+    for _, positions in group_runs:
+        assert_runs_equal(
+            collection_index.get_runs(positions, "Sub"),
+            get_expected_runs(metadata_df, positions, "Sub"),
+        )
+
+
+def test_missing_collections_get_code_minus_one():
+    metadata_df = make_metadata()
+    collection_index = CollectionIndex.from_frame(metadata_df, ["Sub"])
+    code, positions = collection_index.get_runs(np.arange(40), "Sub")[0]
+    assert code == -1
+    assert np.array_equal(positions, [3, 17])
+
+
+def test_positions_of_no_path_are_grouped_directly():
+    metadata_df = make_metadata()
+    collection_index = CollectionIndex.from_frame(metadata_df, ["Group", "Sub"])
+    positions = np.array([0, 5, 9, 21, 30])
+    assert collection_index.get_run_range(positions, 1) is None
+    assert_runs_equal(
+        collection_index.get_runs(positions, "Sub"),
+        get_expected_runs(metadata_df, positions, "Sub"),
+    )
+
+
+def test_empty_positions():
+    collection_index = CollectionIndex.from_frame(make_metadata(), ["Group", "Sub"])
+    assert collection_index.get_runs(np.array([], dtype=np.int64), "Sub") == []
+
+
+def test_take_renumbers_positions():
+    metadata_df = make_metadata()
+    positions = np.arange(10, 30)
+    collection_index = CollectionIndex.from_frame(metadata_df, ["Group"]).take(positions)
+    assert_runs_equal(
+        collection_index.get_runs(np.arange(20), "Group"),
+        get_expected_runs(metadata_df.iloc[positions].reset_index(drop=True), np.arange(20), "Group"),
+    )
+
+
+def test_split_by_labels():
+    groups = split_by_labels(np.array([2, 0, 2, 1, 0]))
+    assert [group.tolist() for group in groups] == [[1, 4], [3], [0, 2]]
+    assert split_by_labels(np.array([], dtype=np.int64)) == []
+
+
+def test_heatmap_clustered_by_collections():
+    heatmap = build_heatmap(make_settings_dict(make_csv(), clusterItemsByCollections=True))
+    (root,) = heatmap["itemNamesAndData"]
+    assert [node["itemName"] for node in root["children"]] == [f"G{i}" for i in range(5)]
+    for group in root["children"]:
+        assert [node["itemName"] for node in group["children"]] == ["S0", "S1"]
+        assert group["amountOfDataPoints"] == 12
@@ -0,0 +1,68 @@
+import pytest
+from conftest import make_csv, make_settings_dict
+
+import cost_model
+from cost_model import (
+    DEFAULT_COEFFICIENTS,
+    MIN_BUDGET_SAMPLE_SIZE,
+    estimate_heatmap_cost,
+    fit_settings_to_latency_budget,
+    get_coefficient,
+    record_stage_timings,
+)
+from heatmap_types import HeatmapSettings
+
+
+@pytest.fixture(autouse=True)
+def clear_observations():
+    for key_observations in cost_model.observations.values():
+        key_observations.clear()
+
+
+def make_settings(**overrides) -> HeatmapSettings:
+    return HeatmapSettings(make_settings_dict(make_csv(), **overrides))
+
+
+def get_total(number_of_items, settings) -> float:
+    return sum(estimate_heatmap_cost(number_of_items, 20, settings).values())
+
+
+def test_estimate_grows_with_the_items():
+    settings = make_settings()
+    stages = estimate_heatmap_cost(1000, 20, settings)
+    assert set(stages) == {
+        "filtering",
+        "dimReduction",
+        "clusteringItems",
+        "clusteringAttributes",
+        "json",
+    }
+    assert get_total(1000, settings) < get_total(100000, settings)
+
+
+def test_generous_budget_keeps_the_settings():
+    settings = make_settings(dimReductionAlgo="UMAP", maxLatencyMs=10**9)
+    assert fit_settings_to_latency_budget(100000, 20, settings) == (None, [])
+    assert settings.dimReductionAlgo == "UMAP"
+    assert settings.dimReductionPreset == "EXACT"
+
+
+def test_tight_budget_switches_to_cheaper_options_and_samples():
+    settings = make_settings(dimReductionAlgo="UMAP", maxLatencyMs=1000)
+    sample_size, adjustments = fit_settings_to_latency_budget(500000, 20, settings)
+    assert settings.dimReductionAlgo == "PCA"
+    assert settings.dimReductionPreset == "FAST"
+    assert len(adjustments) == 3
+    assert MIN_BUDGET_SAMPLE_SIZE <= sample_size < 500000
+    assert get_total(sample_size, settings) <= 1
+    assert get_total(sample_size + 1, settings) > 1
+
+
+def test_recorded_timings_replace_the_defaults():
+    settings = make_settings()
+    assert get_coefficient("json") == DEFAULT_COEFFICIENTS["json"]
+    for number_of_items in (1000, 2000, 4000):
+        record_stage_timings(
+            number_of_items, 10, settings, {"json": 1e-3 * number_of_items}
+        )
+    assert get_coefficient("json") == pytest.approx(1e-4)
@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+from scipy.cluster.hierarchy import fcluster, linkage
+from sklearn.metrics import adjusted_rand_score
+
+from dendrogram import MAX_UNCONSTRAINED_DENDROGRAM_SIZE, get_dendrogram
+
+
+def make_data_df(number_of_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame(
+        rng.normal(size=(number_of_rows, 3)), index=np.arange(number_of_rows) + 2
+    )
+
+
+def test_split_matches_cutting_the_linkage():
+    data_df = make_data_df(200)
+    dendrogram = get_dendrogram(data_df)
+    labels = dendrogram.split(data_df.index, 5)
+    expected = fcluster(linkage(data_df.values, method="ward"), 5, "maxclust")
+    assert adjusted_rand_score(expected, labels) == 1.0
+
+
+def test_split_of_a_subset():
+    data_df = make_data_df(200)
+    dendrogram = get_dendrogram(data_df)
+    subset = data_df.index[::3]
+    labels = dendrogram.split(subset, 4)
+    assert len(labels) == len(subset)
+    assert len(np.unique(labels)) == 4
+    assert len(np.unique(dendrogram.split(subset[:1], 4))) == 1
+
+
+def test_no_dendrogram_for_a_single_row():
+    assert get_dendrogram(make_data_df(1)) is None
+
+
+def test_large_data_needs_a_knn_graph():
+    data_df = make_data_df(MAX_UNCONSTRAINED_DENDROGRAM_SIZE + 1)
+    assert get_dendrogram(data_df) is None
@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+from sklearn.manifold import TSNE
+
+from dim_reduction import (
+    DIM_REDUCTION_PRESETS,
+    create_dim_reduction,
+    get_pca_arguments,
+)
+
+
+@pytest.mark.parametrize("preset", list(DIM_REDUCTION_PRESETS))
+def test_tsne_presets_run_normal_iterations(preset):
+    tsne = create_dim_reduction("TSNE", preset)
+    assert tsne.n_iter > TSNE._EXPLORATION_N_ITER
+
+
+def test_fast_tsne_converges_past_exaggeration():
+    rng = np.random.default_rng(0)
+    data = np.vstack([rng.normal(size=(40, 5)), rng.normal(size=(40, 5)) + 8])
+    tsne = create_dim_reduction("TSNE", "FAST", n_jobs=1, random_state=0)
+    tsne.fit(data)
+    assert tsne.n_iter_ > TSNE._EXPLORATION_N_ITER
+
+
+def test_unknown_preset():
+    with pytest.raises(ValueError):
+        create_dim_reduction("TSNE", "FASTEST")
+
+
+def test_wide_pca_uses_randomized_solver():
+    assert get_pca_arguments("PCA", "EXACT", 20) == {"svd_solver": "auto"}
+    assert get_pca_arguments("PCA", "EXACT", 600) == {"svd_solver": "randomized"}
+    # the preset's solver is kept
+    assert get_pca_arguments("PCA", "FAST", 20) == {}
+    assert get_pca_arguments("UMAP", "EXACT", 600) == {}
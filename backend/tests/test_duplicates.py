@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+from conftest import build_heatmap, iterate_nodes, make_csv, make_settings_dict
+
+from duplicates import get_duplicate_groups, get_duplicate_ids
+
+
+def test_identical_rows_share_an_id():
+    rows = np.array([[1.0, 2.0], [0.0, 1.0], [1.0, 2.0], [-0.0, 1.0], [3.0, 3.0]])
+    assert get_duplicate_ids(rows).tolist() == [0, 1, 0, 1, 2]
+
+
+def test_nan_rows_are_duplicates():
+    rows = np.array([[np.nan, 1.0], [np.nan, 1.0], [np.nan, 2.0]])
+    assert get_duplicate_ids(rows).tolist() == [0, 0, 1]
+
+
+@pytest.mark.parametrize("shape", [(0, 3), (4, 0)])
+def test_empty_rows(shape):
+    assert get_duplicate_ids(np.empty(shape)).tolist() == [0] * shape[0]
+
+
+def test_groups():
+    representatives, inverse, counts = get_duplicate_groups(np.array([0, 1, 0, 2, 1, 0]))
+    assert representatives.tolist() == [0, 1, 3]
+    assert inverse.tolist() == [0, 1, 0, 2, 1, 0]
+    assert counts.tolist() == [3, 2, 1]
+
+
+def get_leaves(heatmap):
+    return sorted(
+        (node["itemName"], node["data"])
+        for node in iterate_nodes(heatmap["itemNamesAndData"])
+        if not node["children"]
+    )
+
+
+def test_collapsed_heatmap_keeps_every_item():
+    settings = make_settings_dict(make_csv(binary=True, number_of_attributes=3))
+    heatmap = build_heatmap(settings)
+    collapsed = build_heatmap({**settings, "collapseDuplicates": True})
+
+    assert get_leaves(collapsed) == get_leaves(heatmap)
+    (root,) = collapsed["itemNamesAndData"]
+    assert root["amountOfDataPoints"] == 60
+    assert np.allclose(root["data"], heatmap["itemNamesAndData"][0]["data"])
+    assert sorted(
+        node["attributeName"] for node in iterate_nodes(collapsed["hierarchicalAttributes"])
+    ) == sorted(node["attributeName"] for node in iterate_nodes(heatmap["hierarchicalAttributes"]))
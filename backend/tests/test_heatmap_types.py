@@ -0,0 +1,101 @@
+from io import StringIO
+
+import pandas as pd
+from conftest import make_csv, make_settings_dict
+
+from heatmap_types import HeatmapSettings
+from helpers import get_dataset_fingerprint
+
+
+def get_cache_key(**overrides) -> str:
+    return HeatmapSettings(make_settings_dict(make_csv(), **overrides)).get_cache_key()
+
+
+def test_cache_key_ignores_selection_order_and_encoding():
+    default_key = get_cache_key()
+    item_rows = list(range(2, 62))
+    assert get_cache_key(selectedItemsRowIndexes=item_rows[::-1]) == default_key
+    assert (
+        get_cache_key(
+            selectedItemsRowIndexes={"encoding": "RANGES", "ranges": [[2, 62]]}
+        )
+        == default_key
+    )
+
+
+def test_cache_key_ignores_settings_without_effect():
+    default_key = get_cache_key()
+    assert get_cache_key(previewMode=True) == default_key
+    assert get_cache_key(sessionId="session") == default_key
+    assert get_cache_key(stickyItemsRowIndexes=[3]) == default_key
+    assert get_cache_key(clusteringFeatureDimensions=10) == default_key
+    assert get_cache_key(attributeSignatureSize=10) == default_key
+
+
+def test_cache_key_depends_on_result_settings():
+    default_key = get_cache_key()
+    assert get_cache_key(itemsClusterSize=5) != default_key
+    assert get_cache_key(selectedItemsRowIndexes=list(range(2, 61))) != default_key
+    assert get_cache_key(csvFile=make_csv(seed=1)) != default_key
+
+
+def test_client_fingerprint_is_used_in_the_cache_key():
+    csv_file = make_csv()
+    fingerprint = get_dataset_fingerprint(csv_file)
+    settings = HeatmapSettings(
+        make_settings_dict(csv_file, datasetFingerprint=fingerprint)
+    )
+    assert settings.datasetFingerprint == fingerprint
+    assert settings.get_cache_key() == get_cache_key()
+
+
+def test_fingerprint_is_only_hashed_without_a_registered_one(monkeypatch):
+    settings = HeatmapSettings(make_settings_dict(make_csv(), datasetFingerprint="f"))
+
+    def fail(csv_file):
+        raise AssertionError("the CSV was hashed")
+
+    monkeypatch.setattr("heatmap_types.get_dataset_fingerprint", fail)
+    settings.get_cache_key()
+
+
+def test_cache_key_equals_for_column_names_and_their_positions():
+    csv_file = make_csv()
+    columns = pd.read_csv(StringIO(csv_file), nrows=0).columns
+    settings_dict = make_settings_dict(csv_file)
+    attributes = settings_dict["selectedAttributesColumnNames"]
+    positions = columns.get_indexer(attributes)
+    encoded = {
+        "encoding": "RANGES",
+        "ranges": [[int(positions[0]), int(positions[-1]) + 1]],
+    }
+
+    def get_key(**overrides):
+        return HeatmapSettings({**settings_dict, **overrides}).get_cache_key(
+            columns=columns
+        )
+
+    assert get_key(selectedAttributesColumnNames=encoded) == get_key()
+    duplicated = attributes[::-1] + attributes
+    assert get_key(selectedAttributesColumnNames=duplicated) == get_key()
+
+
+def test_cache_key_ignores_sticky_order_and_duplicates():
+    settings_dict = make_settings_dict(
+        make_csv(),
+        sortAttributesBasedOnStickyItems=True,
+        clusterItemsBasedOnStickyAttributes=True,
+    )
+
+    def get_key(sticky_items, sticky_attributes):
+        return HeatmapSettings(
+            {
+                **settings_dict,
+                "stickyItemsRowIndexes": sticky_items,
+                "stickyAttributesColumnNames": sticky_attributes,
+            }
+        ).get_cache_key()
+
+    key = get_key([3, 5], ["Att_1", "Att_2"])
+    assert get_key([5, 3, 5], ["Att_2", "Att_1", "Att_2"]) == key
+    assert get_key([3, 6], ["Att_1", "Att_2"]) != key
@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+import pytest
+from conftest import make_csv, make_settings_dict
+
+import dim_reduction
+from dim_reduction import (
+    get_embedding_key,
+    reduce_dimensions_incrementally,
+    store_previous_embedding,
+)
+from heatmap_types import HeatmapSettings
+
+
+@pytest.fixture(autouse=True)
+def clear_previous_embeddings():
+    dim_reduction.previous_embeddings.clear()
+
+
+def make_inputs(dim_reduction_algo="TSNE"):
+    settings = HeatmapSettings(
+        make_settings_dict(
+            make_csv(), dimReductionAlgo=dim_reduction_algo, sessionId="session"
+        )
+    )
+    rng = np.random.default_rng(0)
+    data_df = pd.DataFrame(rng.normal(size=(100, 4)), index=np.arange(100) + 2)
+    return settings, data_df, get_embedding_key(data_df, settings)
+
+
+def test_no_previous_embedding():
+    settings, data_df, key = make_inputs()
+    assert reduce_dimensions_incrementally(data_df, settings, key, None) is None
+
+
+def test_unchanged_selection_reuses_the_embedding():
+    settings, data_df, key = make_inputs()
+    previous_dim_red = np.random.default_rng(1).normal(size=(100, 2))
+    store_previous_embedding(key, data_df.index, previous_dim_red)
+
+    reordered_df = data_df.iloc[::-1]
+    dim_red = reduce_dimensions_incrementally(reordered_df, settings, key, None)
+    assert np.array_equal(dim_red, previous_dim_red[::-1])
+
+
+def test_small_change_refines_the_embedding():
+    settings, data_df, key = make_inputs()
+    previous_dim_red = np.random.default_rng(1).normal(size=(95, 2))
+    store_previous_embedding(key, data_df.index[:95], previous_dim_red)
+
+    dim_red = reduce_dimensions_incrementally(data_df, settings, key, None)
+    assert dim_red.shape == (100, 2)
+    assert np.isfinite(dim_red).all()
+
+
+def test_large_change_needs_a_full_fit():
+    settings, data_df, key = make_inputs()
+    store_previous_embedding(key, data_df.index[:50], np.zeros((50, 2)))
+    assert reduce_dimensions_incrementally(data_df, settings, key, None) is None
+
+
+def test_pca_is_not_refined():
+    settings, data_df, key = make_inputs("PCA")
+    store_previous_embedding(key, data_df.index[:95], np.zeros((95, 2)))
+    assert reduce_dimensions_incrementally(data_df, settings, key, None) is None
+
+
+def test_embedding_key_ignores_the_item_selection_of_a_session():
+    settings, data_df, key = make_inputs()
+    assert get_embedding_key(data_df.iloc[:10], settings) == key
+    assert get_embedding_key(data_df[[0, 1]], settings) != key
+
+    settings.sessionId = "other session"
+    assert get_embedding_key(data_df, settings) != key
+
+
+def test_embedding_key_without_session_includes_the_item_selection():
+    settings, data_df, _ = make_inputs()
+    settings.sessionId = None
+    key = get_embedding_key(data_df, settings)
+    assert get_embedding_key(data_df.iloc[::-1], settings) == key
+    assert get_embedding_key(data_df.iloc[:10], settings) != key
@@ -0,0 +1,62 @@
+from io import StringIO
+
+import numpy as np
+import pandas as pd
+from conftest import build_heatmap, iterate_nodes, make_csv, make_settings_dict
+
+from item_matrices import ItemMatrices
+
+
+def make_matrices() -> ItemMatrices:
+    raw_data_df = pd.DataFrame(
+        [[1.0, 2.0], [3.0, 4.0], [5.0, 6.0], [7.0, 8.0]], index=[10, 11, 12, 13]
+    )
+    metadata_df = pd.DataFrame({"Group": ["b", "a", None, "b"]}, index=raw_data_df.index)
+    item_names_df = pd.DataFrame({"name": ["w", "x", "y", "z"]}, index=raw_data_df.index)
+    dim_red_df = pd.DataFrame(np.zeros((4, 2)), index=raw_data_df.index)
+    return ItemMatrices.from_frames(
+        raw_data_df, metadata_df, item_names_df, raw_data_df * 2, dim_red_df, ["Group"]
+    )
+
+
+def test_matrices_hold_attributes_as_rows():
+    matrices = make_matrices()
+    assert np.array_equal(matrices.raw_data, [[1, 3, 5, 7], [2, 4, 6, 8]])
+    assert np.array_equal(matrices.get_scaled_rows(np.array([3, 0])), [[14, 16], [2, 4]])
+
+
+def test_group_by_collection():
+    matrices = make_matrices()
+    groups, without_collection = matrices.group_by_collection(np.arange(4), "Group")
+    assert [collection for collection, _ in groups] == ["a", "b"]
+    assert [positions.tolist() for _, positions in groups] == [[1], [0, 3]]
+    assert without_collection.tolist() == [2]
+
+
+def test_take_labels_and_with_numeric():
+    matrices = make_matrices()
+    labels = matrices.take_labels(np.array([1, 3]))
+    assert labels.raw_data is None
+    assert labels.item_indexes.tolist() == [11, 13]
+    assert labels.item_names.tolist() == ["x", "z"]
+    restored = labels.with_numeric(matrices.raw_data, None, None)
+    assert restored.raw_data is matrices.raw_data
+
+
+def test_item_tree_covers_every_item_once():
+    csv_file = make_csv()
+    heatmap = build_heatmap(make_settings_dict(csv_file, clusterItemsByCollections=True))
+    original_df = pd.read_csv(StringIO(csv_file))
+    attributes = [f"Att_{i}" for i in range(6)]
+
+    leaves = []
+    for node in iterate_nodes(heatmap["itemNamesAndData"]):
+        if node["children"]:
+            assert node["amountOfDataPoints"] == sum(
+                child["amountOfDataPoints"] for child in node["children"]
+            )
+        else:
+            leaves.append(node["index"])
+            expected = original_df.loc[node["index"], attributes].astype(float)
+            assert np.allclose(node["data"][:6], expected)
+    assert sorted(leaves) == list(range(2, 62))
@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+import pytest
+from conftest import build_heatmap, iterate_nodes, make_csv, make_settings_dict
+
+from collection_index import CollectionIndex
+from item_matrices import MERGE_FUNCTIONS, ItemMatrices, ItemStatistics
+
+NODE_AGGREGATES = {
+    "mean": lambda rows: rows.mean(axis=0),
+    "sum": lambda rows: rows.sum(axis=0),
+    "max": lambda rows: rows.max(axis=0),
+    "min": lambda rows: rows.min(axis=0),
+    "binary": lambda rows: (rows > 0).any(axis=0).astype(float),
+}
+
+
+def make_matrices(number_of_items=20) -> ItemMatrices:
+    rng = np.random.default_rng(0)
+    raw_data = rng.normal(size=(3, number_of_items))
+    return ItemMatrices(
+        raw_data,
+        raw_data,
+        rng.normal(size=(2, number_of_items)),
+        pd.RangeIndex(number_of_items),
+        np.arange(number_of_items).astype(str),
+        CollectionIndex([], [], []),
+    )
+
+
+@pytest.mark.parametrize("method", list(MERGE_FUNCTIONS))
+def test_merged_statistics_equal_those_of_all_items(method):
+    matrices = make_matrices()
+    merged = ItemStatistics(method)
+    for positions in (np.arange(0, 7), np.array([], dtype=np.int64), np.arange(7, 20)):
+        merged.merge(ItemStatistics.from_positions(matrices, positions, method))
+    expected = ItemStatistics.from_positions(matrices, np.arange(20), method)
+
+    assert merged.count == expected.count == 20
+    assert np.allclose(merged.values, expected.values)
+    assert np.allclose(merged.dim_red_sum, expected.dim_red_sum)
+
+
+def test_statistics_of_no_items():
+    statistics = ItemStatistics.from_positions(
+        make_matrices(), np.array([], dtype=np.int64), "mean"
+    )
+    assert statistics.count == 0
+    assert statistics.values is None
+
+
+@pytest.mark.parametrize("method", list(NODE_AGGREGATES))
+def test_node_data_aggregates_its_items(method):
+    settings = make_settings_dict(
+        make_csv(binary=method == "binary"), itemAggregateMethod=method
+    )
+    heatmap = build_heatmap(settings)
+
+    def get_leaf_rows(node):
+        if not node["children"]:
+            return [node["data"][:6]]
+        return [row for child in node["children"] for row in get_leaf_rows(child)]
+
+    for node in iterate_nodes(heatmap["itemNamesAndData"]):
+        expected = NODE_AGGREGATES[method](np.array(get_leaf_rows(node)))
+        assert np.allclose(node["data"][:6], expected, atol=1e-3)
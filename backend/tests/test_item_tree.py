@@ -0,0 +1,76 @@
+import json
+
+import numpy as np
+from conftest import build_heatmap, iterate_nodes, make_csv, make_settings_dict
+
+from heatmap_types import ItemNameAndData, ItemTree, custom_encoder
+
+
+def make_node(name, data, children=None, index=None) -> ItemNameAndData:
+    return ItemNameAndData(index, name, False, data, 1, 0.25, -1.5, children)
+
+
+def make_roots():
+    return [
+        make_node(
+            "cluster",
+            [0.5, 1.125],
+            [
+                make_node("a", [1, 2], index=0),
+                make_node("b", [0.0, 0.25], [make_node("c", [3, -4], index=2)], index=1),
+            ],
+        ),
+        make_node("d", [-7.75, 12345.678], index=3),
+    ]
+
+
+def encode(obj):
+    return json.loads(json.dumps(obj, default=custom_encoder))
+
+
+def test_serialization_matches_the_object_tree():
+    roots = make_roots()
+    assert encode(ItemTree(roots, 3)) == encode(roots)
+
+
+def test_integer_data_stays_integer():
+    nodes = list(iterate_nodes(encode(ItemTree(make_roots(), 3))))
+    assert all(isinstance(value, int) for value in nodes[1]["data"])
+    assert all(isinstance(value, float) for value in nodes[0]["data"])
+
+
+def test_preorder_is_the_depth_first_order():
+    tree = ItemTree(make_roots(), 3)
+    names = tree.item_names[tree.get_preorder()].tolist()
+    assert names == ["cluster", "a", "b", "c", "d"]
+
+
+def test_large_values_keep_full_precision():
+    tree = ItemTree([make_node("big", [123456789.123])], 3)
+    assert tree.data.dtype == np.float64
+    assert tree[0].data == [123456789.123]
+
+
+def test_append_columns():
+    tree = ItemTree(make_roots(), 2)
+    integer_rows = tree.get_integer_rows()
+    tree.append_columns(np.full((5, 1), 0.555), integer_rows)
+    # nodes are numbered breadth-first, a and c have integer data
+    assert tree.item_names[integer_rows].tolist() == ["a", "c"]
+    assert tree.get_data(3)[:, 2].tolist() == [0.56, 0.56, 0.0, 0.56, 0.0]
+    assert tree.get_integer_rows().tolist() == integer_rows.tolist()
+
+
+def test_empty_tree():
+    tree = ItemTree([], 3)
+    assert len(tree) == 0
+    assert encode(tree) == []
+    assert len(tree.get_preorder()) == 0
+
+
+def test_heatmap_items_are_the_selected_items():
+    settings = make_settings_dict(make_csv())
+    heatmap = build_heatmap(settings)
+    leaves = [node for node in iterate_nodes(heatmap["itemNamesAndData"]) if not node["children"]]
+    assert sorted(leaf["itemName"] for leaf in leaves) == sorted(f"Item_{i}" for i in range(60))
+    assert all(leaf["index"] is not None for leaf in leaves)
@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+from conftest import build_heatmap, make_csv, make_settings_dict
+
+import knn_graph as knn_graph_module
+from heatmap_types import HeatmapSettings
+from knn_graph import KnnGraph, get_knn_graph
+
+
+def make_graph(knn_indices) -> KnnGraph:
+    knn_indices = np.array(knn_indices)
+    item_indexes = pd.Index(np.arange(len(knn_indices)) + 2)
+    return KnnGraph(item_indexes, knn_indices, np.ones(knn_indices.shape), None)
+
+
+def test_adjacency_is_symmetric_and_skips_missing_neighbors():
+    graph = make_graph([[1, -1], [2, -1], [0, 1], [-1, -1]])
+    adjacency = graph.adjacency.toarray()
+    assert np.array_equal(adjacency, adjacency.T)
+    assert adjacency[0, 1] == adjacency[1, 0] == 1
+    assert not adjacency[3].any()
+
+
+def test_connectivity_of_a_subset(monkeypatch):
+    # two triangles, 0-1-2 and 3-4-5
+    graph = make_graph([[1, 2], [0, 2], [0, 1], [4, 5], [3, 5], [3, 4]])
+    connectivity = graph.get_connectivity(pd.Index([2, 3, 4]))
+    assert np.array_equal(connectivity.toarray(), [[0, 1, 1], [1, 0, 1], [1, 1, 0]])
+
+    monkeypatch.setattr(knn_graph_module, "MAX_CONNECTIVITY_COMPONENTS", 1)
+    assert graph.get_connectivity(pd.Index([2, 3, 4, 5, 6, 7])) is None
+
+
+def test_graph_is_cached_per_dataset(monkeypatch):
+    monkeypatch.setattr(knn_graph_module, "KNN_GRAPH_MIN_ITEMS", 50)
+    settings = HeatmapSettings(make_settings_dict(make_csv()))
+    rng = np.random.default_rng(0)
+    data_df = pd.DataFrame(rng.normal(size=(60, 4)), index=np.arange(60) + 2)
+
+    graph = get_knn_graph(data_df, settings)
+    assert graph.knn_indices.shape == (60, knn_graph_module.KNN_GRAPH_NEIGHBORS)
+    assert get_knn_graph(data_df, settings) is graph
+    assert get_knn_graph(data_df.iloc[:55], settings) is not graph
+    assert get_knn_graph(data_df.iloc[:40], settings) is None
+
+
+def test_small_data_is_unaffected_by_the_graph():
+    settings = make_settings_dict(make_csv())
+    assert build_heatmap({**settings, "useKnnGraph": True}) == build_heatmap(settings)
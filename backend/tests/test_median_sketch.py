@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+import pytest
+from conftest import build_heatmap, make_csv, make_settings_dict
+
+from item_matrices import ItemMatrices, MedianSketch
+
+
+def get_rank_error(values: np.ndarray, medians: np.ndarray) -> np.ndarray:
+    ranks = (values <= medians[:, None]).mean(axis=1)
+    return np.abs(ranks - 0.5)
+
+
+def test_small_sketch_is_exact():
+    values = np.random.default_rng(0).normal(size=(3, 51))
+    sketch = MedianSketch.from_values(values, 100)
+    assert np.array_equal(sketch.get_median(), np.median(values, axis=1))
+
+
+def test_merged_sketch_stays_within_the_rank_error():
+    values = np.random.default_rng(0).normal(size=(4, 20000))
+    sketch = MedianSketch.from_values(values[:, :1000], 400)
+    for start in range(1000, 20000, 1000):
+        sketch.merge(MedianSketch.from_values(values[:, start : start + 1000], 400))
+    assert (get_rank_error(values, sketch.get_median()) < 0.01).all()
+
+
+def test_merge_order_does_not_matter():
+    values = np.random.default_rng(0).normal(size=(2, 3000))
+    parts = [values[:, :1000], values[:, 1000:2500], values[:, 2500:]]
+
+    def merge_in(order):
+        sketch = MedianSketch.from_values(parts[order[0]], 100)
+        for part in order[1:]:
+            sketch.merge(MedianSketch.from_values(parts[part], 100))
+        return sketch.get_median()
+
+    assert np.array_equal(merge_in([0, 1, 2]), merge_in([2, 1, 0]))
+
+
+@pytest.mark.parametrize("approximate_median_error", [0, 1, 1.5])
+def test_invalid_error(approximate_median_error):
+    data_df = pd.DataFrame(np.zeros((2, 2)))
+    with pytest.raises(ValueError):
+        ItemMatrices.from_frames(
+            data_df,
+            pd.DataFrame(index=data_df.index),
+            pd.DataFrame({"name": ["a", "b"]}),
+            data_df,
+            data_df,
+            [],
+            approximate_median_error,
+        )
+
+
+def test_approximate_median_of_small_data_is_exact():
+    settings = make_settings_dict(make_csv(), itemAggregateMethod="median")
+    approximate = {**settings, "approximateMedian": True}
+    assert build_heatmap(approximate) == build_heatmap(settings)
@@ -0,0 +1,110 @@
+import numpy as np
+import pandas as pd
+from conftest import build_heatmap, make_csv, make_settings_dict
+
+import parallel_clustering
+from dendrogram import Dendrogram, get_dendrogram
+from knn_graph import KnnGraph
+from parallel_clustering import ParallelClustering, SharedArray, get_shared_object
+
+
+def test_shared_array_take():
+    array = np.arange(12, dtype=np.float64).reshape(4, 3)
+    shared_array = SharedArray(array)
+    try:
+        assert np.array_equal(shared_array.take(np.array([3, 1]), axis=0), array[[3, 1]])
+    finally:
+        shared_array.release()
+
+
+def test_small_requests_do_not_copy_to_shared_memory(monkeypatch):
+    def fail(array):
+        raise AssertionError("copied to shared memory")
+
+    monkeypatch.setattr(parallel_clustering, "SharedArray", fail)
+    settings = make_settings_dict(make_csv())
+    assert build_heatmap({**settings, "parallelClustering": True}) == build_heatmap(
+        settings
+    )
+
+
+def test_arrays_are_shared_on_the_first_submit(monkeypatch):
+    monkeypatch.setattr(parallel_clustering, "MAX_CLUSTERING_WORKERS", 2)
+    monkeypatch.setattr(parallel_clustering, "PARALLEL_MIN_SUBTREE_SIZE", 10)
+    shared_arrays = []
+    create_shared_array = SharedArray.__init__
+
+    def count_shared_array(shared_array, array):
+        shared_arrays.append(shared_array)
+        create_shared_array(shared_array, array)
+
+    monkeypatch.setattr(SharedArray, "__init__", count_shared_array)
+    settings = make_settings_dict(make_csv(number_of_items=200), itemsClusterSize=2)
+    sequential = build_heatmap(settings)
+    assert build_heatmap({**settings, "parallelClustering": True}) == sequential
+    # raw data, scaled raw data and the embedding, copied once for all submits
+    assert len(shared_arrays) == 3
+
+
+def test_release_without_submit():
+    parallel = ParallelClustering({"raw_data": np.zeros((2, 2))})
+    parallel.release()
+    assert parallel.shared_arrays is None
+
+
+def test_objects_are_rebuilt_from_shared_memory(monkeypatch):
+    monkeypatch.setattr(parallel_clustering, "worker_objects", {})
+    rng = np.random.default_rng(0)
+    data_df = pd.DataFrame(rng.normal(size=(40, 3)), index=np.arange(40) + 2)
+    knn_indices = np.argsort(
+        ((data_df.values[:, None] - data_df.values[None]) ** 2).sum(axis=2), axis=1
+    )[:, 1:4]
+    knn_graph = KnnGraph(data_df.index, knn_indices, np.ones(knn_indices.shape), None)
+    dendrogram = get_dendrogram(data_df)
+
+    parallel = ParallelClustering({}, knn_graph=knn_graph, dendrogram=dendrogram)
+    try:
+        arrays = parallel.get_shared_arrays()
+        shared_knn_graph = get_shared_object(
+            arrays, "knn_graph", KnnGraph.from_shared_arrays
+        )
+        shared_dendrogram = get_shared_object(
+            arrays, "dendrogram", Dendrogram.from_shared_arrays
+        )
+        # rebuilt once per worker
+        assert get_shared_object(
+            arrays, "dendrogram", Dendrogram.from_shared_arrays
+        ) is shared_dendrogram
+    finally:
+        parallel.release()
+
+    subset = data_df.index[::2]
+    assert (
+        shared_knn_graph.get_connectivity(subset) != knn_graph.get_connectivity(subset)
+    ).nnz == 0
+    assert np.array_equal(
+        shared_dendrogram.split(subset, 4), dendrogram.split(subset, 4)
+    )
+    assert get_shared_object(arrays, "unknown", Dendrogram.from_shared_arrays) is None
+
+
+def test_dendrogram_is_shared_instead_of_pickled(monkeypatch):
+    monkeypatch.setattr(parallel_clustering, "MAX_CLUSTERING_WORKERS", 2)
+    monkeypatch.setattr(parallel_clustering, "PARALLEL_MIN_SUBTREE_SIZE", 10)
+    submitted = []
+    submit = ParallelClustering.submit
+
+    def record_submit(parallel, function, *args, **kwargs):
+        submitted.append(list(args) + list(kwargs.values()))
+        return submit(parallel, function, *args, **kwargs)
+
+    monkeypatch.setattr(ParallelClustering, "submit", record_submit)
+    settings = make_settings_dict(
+        make_csv(number_of_items=200),
+        itemsClusterSize=2,
+        clusteringBackend="DENDROGRAM",
+    )
+    sequential = build_heatmap(settings)
+    assert build_heatmap({**settings, "parallelClustering": True}) == sequential
+    assert submitted
+    assert not any(isinstance(arg, Dendrogram) for args in submitted for arg in args)
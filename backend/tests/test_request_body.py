@@ -0,0 +1,84 @@
+import gzip
+import json
+from io import BytesIO, StringIO
+
+import pandas as pd
+import pytest
+import zstandard
+from conftest import make_csv
+
+from request_body import (
+    MAX_REQUEST_BODY_SIZE,
+    RequestBodyTooLarge,
+    StringReader,
+    read_json_body,
+)
+
+BODY = {"settings": {"csvFile": "a,b\n1,2\n", "itemsClusterSize": 4}}
+
+
+@pytest.mark.parametrize(
+    "content_encoding, compress",
+    [
+        (None, lambda body: body),
+        ("identity", lambda body: body),
+        ("gzip", gzip.compress),
+        ("zstd", lambda body: zstandard.ZstdCompressor().compress(body)),
+    ],
+)
+def test_read_json_body(content_encoding, compress):
+    stream = BytesIO(compress(json.dumps(BODY).encode("utf-8")))
+    assert read_json_body(stream, content_encoding) == BODY
+
+
+def test_decompressed_size_limit():
+    body = json.dumps({"csvFile": "0" * 10000}).encode("utf-8")
+    stream = BytesIO(gzip.compress(body))
+    with pytest.raises(RequestBodyTooLarge):
+        read_json_body(stream, "gzip", max_size=1000)
+
+
+def test_unsupported_content_encoding():
+    with pytest.raises(ValueError):
+        read_json_body(BytesIO(b"{}"), "br")
+
+
+def test_string_reader_parses_like_string_io():
+    csv_file = make_csv()
+    expected = pd.read_csv(StringIO(csv_file))
+    assert pd.read_csv(StringReader(csv_file)).equals(expected)
+
+
+def test_string_reader_reads_lines_and_chunks():
+    reader = StringReader("a,b\n1,2\n3")
+    assert list(reader) == ["a,b\n", "1,2\n", "3"]
+    reader = StringReader("abcdef")
+    assert reader.read(4) == "abcd"
+    assert reader.read() == "ef"
+    assert reader.read(1) == ""
+
+
+def test_limit_matches_the_flask_content_length():
+    import app as app_module
+
+    assert app_module.app.config["MAX_CONTENT_LENGTH"] == MAX_REQUEST_BODY_SIZE
+    assert MAX_REQUEST_BODY_SIZE <= 1024 * 1024 * 1024
+
+
+@pytest.mark.parametrize("content_encoding", [None, "gzip"])
+def test_large_heatmap_request_is_rejected(monkeypatch, content_encoding):
+    import app as app_module
+
+    body = json.dumps({"settings": {"csvFile": "0" * 10000}}).encode("utf-8")
+    headers = {"Content-Type": "application/json"}
+    if content_encoding == "gzip":
+        body = gzip.compress(body)
+        headers["Content-Encoding"] = "gzip"
+        monkeypatch.setattr("request_body.MAX_REQUEST_BODY_SIZE", 1000)
+        monkeypatch.setattr(read_json_body, "__defaults__", (1000,))
+    else:
+        monkeypatch.setitem(app_module.app.config, "MAX_CONTENT_LENGTH", 1000)
+    response = app_module.app.test_client().post(
+        "/api/heatmap", data=body, headers=headers
+    )
+    assert response.status_code == 413
@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+import pytest
+from conftest import build_heatmap, make_csv, make_settings_dict
+
+from dim_reduction import interpolate_from_neighbors, reduce_dimensions_scalable
+from helpers import stratified_sample_positions
+
+
+def test_stratified_sample_covers_every_stratum():
+    strata = pd.Series(["a"] * 500 + ["b"] * 490 + ["c"] * 10)
+    positions = stratified_sample_positions(strata, len(strata), 50)
+    assert np.array_equal(positions, np.unique(positions))
+    assert set(strata.iloc[positions]) == {"a", "b", "c"}
+    assert len(positions) <= 50
+
+
+def test_stratified_sample_of_everything():
+    positions = stratified_sample_positions(None, 20, 50)
+    assert np.array_equal(positions, np.arange(20))
+
+
+def test_interpolation_keeps_fitted_items_in_place():
+    rng = np.random.default_rng(0)
+    fitted_data = rng.normal(size=(30, 4))
+    fitted_dim_red = rng.normal(size=(30, 2))
+    placed = interpolate_from_neighbors(fitted_data, fitted_dim_red, fitted_data[:5])
+    assert np.allclose(placed, fitted_dim_red[:5], atol=1e-6)
+
+
+@pytest.mark.parametrize("dim_reduction_algo", ["PCA", "TSNE"])
+def test_scalable_embedding_places_every_item(dim_reduction_algo):
+    rng = np.random.default_rng(0)
+    data = rng.normal(size=(400, 60))
+    strata = pd.Series(np.arange(400) % 3)
+    dim_red = reduce_dimensions_scalable(
+        data, dim_reduction_algo, "EXACT", 100, 10, strata
+    )
+    assert dim_red.shape == (400, 2)
+    assert np.isfinite(dim_red).all()
+
+
+def test_scalable_heatmap_keeps_every_item():
+    settings = make_settings_dict(
+        make_csv(number_of_items=150),
+        scalableDimReduction=True,
+        dimReductionSampleSize=100,
+        dimReductionPcaComponents=3,
+    )
+    heatmap = build_heatmap(settings)
+    assert heatmap["itemNamesAndData"][0]["amountOfDataPoints"] == 150
+
+
+def test_scalable_mode_matches_default_when_the_sample_is_everything():
+    settings = make_settings_dict(make_csv())
+    scalable_settings = {**settings, "scalableDimReduction": True}
+    assert build_heatmap(scalable_settings) == build_heatmap(settings)
@@ -0,0 +1,110 @@
+import base64
+from io import StringIO
+
+import numpy as np
+import pandas as pd
+import pytest
+from conftest import build_heatmap, make_csv, make_settings_dict
+
+from selection import (
+    decode_selection,
+    get_canonical_selection,
+    get_selected_positions,
+    get_selection_size,
+)
+
+
+def make_bitmap(positions, size) -> dict:
+    is_selected = np.zeros(size, dtype=bool)
+    is_selected[positions] = True
+    bitmap = np.packbits(is_selected, bitorder="little").tobytes()
+    return {"encoding": "BITMAP", "size": size, "bitmap": base64.b64encode(bitmap).decode()}
+
+
+SELECTIONS = [
+    ({"encoding": "RANGES", "ranges": [[2, 5], [8, 9]]}, [2, 3, 4, 8]),
+    ({"encoding": "RANGES", "ranges": []}, []),
+    ({"encoding": "ALL_EXCEPT", "size": 6, "positions": [0, 3, 3]}, [1, 2, 4, 5]),
+    ({"encoding": "ALL_EXCEPT", "size": 3, "positions": []}, [0, 1, 2]),
+    (make_bitmap([0, 7, 9], 11), [0, 7, 9]),
+    (make_bitmap([], 4), []),
+]
+
+
+@pytest.mark.parametrize("selection, positions", SELECTIONS)
+def test_encodings_decode_to_their_positions(selection, positions):
+    assert get_selected_positions(selection).tolist() == positions
+    assert get_selection_size(selection) == len(positions)
+    assert get_canonical_selection(selection) == get_canonical_selection(positions)
+
+
+def test_lists_are_passed_through():
+    assert decode_selection(["b", "a"], pd.Index(["a", "b"])) == ["b", "a"]
+    assert get_selection_size([4, 2, 4]) == 3
+
+
+def test_canonical_selection():
+    assert get_canonical_selection([5, 1, 2, 2, 3]) == {
+        "encoding": "RANGES",
+        "ranges": [[1, 4], [5, 6]],
+    }
+    assert get_canonical_selection([]) == {"encoding": "RANGES", "ranges": []}
+    assert get_canonical_selection(["b", "a", "b"]) == ["a", "b"]
+
+
+def test_column_names_and_their_positions_are_the_same_selection():
+    columns = pd.Index(["name", "a", "b", "c"])
+    positions = {"encoding": "BITMAP", "size": 4, "bitmap": "Cg=="}
+    assert get_canonical_selection(["c", "a", "c"], columns) == {
+        "encoding": "RANGES",
+        "ranges": [[1, 2], [3, 4]],
+    }
+    assert get_canonical_selection(["c", "a"], columns) == get_canonical_selection(
+        positions, columns
+    )
+    # names missing from the CSV stay names
+    assert get_canonical_selection(["x", "a"], columns) == ["a", "x"]
+
+
+@pytest.mark.parametrize(
+    "selection",
+    [
+        {"encoding": "RANGES", "ranges": [[3, 12]]},
+        {"encoding": "RANGES", "ranges": [[-1, 2]]},
+        {"encoding": "ALL_EXCEPT", "size": 12, "positions": []},
+        make_bitmap([10], 11),
+    ],
+)
+def test_positions_outside_of_the_csv(selection):
+    with pytest.raises(ValueError):
+        decode_selection(selection, pd.RangeIndex(10))
+
+
+@pytest.mark.parametrize(
+    "selection",
+    [
+        {"encoding": "ALL_EXCEPT", "size": 5, "positions": [-1]},
+        {"encoding": "ALL_EXCEPT", "size": 5, "positions": [5]},
+        {"encoding": "BITMAP", "size": 9, "bitmap": base64.b64encode(b"\xff").decode()},
+        {"encoding": "UNKNOWN"},
+    ],
+)
+def test_invalid_selections(selection):
+    with pytest.raises(ValueError):
+        get_selected_positions(selection)
+
+
+def test_encoded_selections_give_the_same_heatmap():
+    csv_file = make_csv()
+    settings = make_settings_dict(csv_file)
+    original_df = pd.read_csv(StringIO(csv_file))
+    attributes = settings["selectedAttributesColumnNames"]
+    attribute_positions = [original_df.columns.get_loc(name) for name in attributes]
+    encoded = {
+        **settings,
+        "selectedItemsRowIndexes": {"encoding": "RANGES", "ranges": [[2, 62]]},
+        "selectedAttributesColumnNames": make_bitmap(
+            attribute_positions, len(original_df.columns)
+        ),
+    }
+    assert build_heatmap(encoded) == build_heatmap(settings)
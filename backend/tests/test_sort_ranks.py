@@ -0,0 +1,68 @@
+import numpy as np
+from conftest import build_heatmap, iterate_nodes, make_csv, make_settings_dict
+
+from sort_ranks import (
+    get_attribute_sort_ranks,
+    get_collation_key,
+    get_dense_ranks,
+    get_name_ranks,
+)
+
+
+def assert_ranks_follow(ranks, keys):
+    for i in range(len(keys)):
+        for j in range(len(keys)):
+            assert (ranks[i] < ranks[j]) == (keys[i] < keys[j])
+
+
+def test_dense_ranks_share_ties_and_put_nan_last():
+    ranks = get_dense_ranks(np.array([2.5, np.nan, -1.0, 2.5]))
+    assert ranks.tolist() == [1, 2, 0, 1]
+
+
+def test_name_ranks_ignore_case_first():
+    assert get_name_ranks(["b", "B", "a", "b"]).tolist() == [1, 2, 0, 1]
+
+
+def test_name_ranks_follow_the_root_collation_of_local_compare():
+    names = ["Z", "f", "Éa", "ea", "é", "e", "B", "b", "a", "1", "_x"]
+    ranks = get_name_ranks(names)
+    assert [name for _, name in sorted(zip(ranks, names))] == [
+        "_x", "1", "a", "b", "B", "e", "é", "ea", "Éa", "f", "Z"
+    ]
+
+
+def test_no_attributes():
+    ranks = get_attribute_sort_ranks([])
+    assert all(len(criterion_ranks) == 0 for criterion_ranks in ranks.values())
+
+
+def test_ranks_are_sent_only_when_requested():
+    heatmap = build_heatmap(make_settings_dict(make_csv()))
+    assert heatmap["itemSortRanks"] is None
+    assert heatmap["attributeSortRanks"] is None
+
+
+def test_heatmap_ranks_follow_the_nodes():
+    settings = make_settings_dict(
+        make_csv(), precomputeSortRanks=True, clusterItemsByCollections=True
+    )
+    heatmap = build_heatmap(settings)
+    items = list(iterate_nodes(heatmap["itemNamesAndData"]))
+    item_ranks = heatmap["itemSortRanks"]
+    assert all(len(ranks) == len(items) for ranks in item_ranks.values())
+    assert_ranks_follow(
+        item_ranks["name"], [get_collation_key(item["itemName"]) for item in items]
+    )
+    assert_ranks_follow(item_ranks["hasChildren"], [not item["children"] for item in items])
+    assert_ranks_follow(
+        item_ranks["amountOfChildren"], [item["amountOfDataPoints"] for item in items]
+    )
+
+    attributes = list(iterate_nodes(heatmap["hierarchicalAttributes"]))
+    attribute_ranks = heatmap["attributeSortRanks"]
+    assert_ranks_follow(attribute_ranks["standardDeviation"], [a["std"] for a in attributes])
+    assert_ranks_follow(
+        attribute_ranks["originalAttributeOrder"],
+        [a["originalAttributeOrder"] for a in attributes],
+    )
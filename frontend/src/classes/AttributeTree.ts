@@ -13,6 +13,7 @@ export class AttributeTree {
   maxDepth: number = 0 // keeps track of the maximum depth of the tree; used for several display purposes
   columnsAsArray: Column[] = []
   datasetName: string = '' // the name of the file that was uploaded
+  nodeCount: number = 0 // number of columns built so far; gives every column its nodeIndex
 
   // TODO: for now I just roll with the current data structure. this will likely change later.
   constructor(
@@ -35,6 +36,8 @@ export class AttributeTree {
     parent: Column | null = null,
   ): Column {
     let column: Column
+    // columns are numbered in the order of the backend data, parents before their children
+    const nodeIndex = this.nodeCount++
 
     if (hierarchicalAttribute.children) {
       column = new AggregateColumn(
@@ -60,6 +63,7 @@ export class AttributeTree {
         parent,
       )
     }
+    column.nodeIndex = nodeIndex
     this.originalIndexToColumn.set(hierarchicalAttribute.dataAttributeIndex, column)
     return column
   }
@@ -14,6 +14,7 @@ export abstract class Column {
   nextSibling: Column | null = null
   pixiColumnLabel: PixiColumnLabel | null = null
   heatmapVisibility: boolean = false // whether the row is visible in the heatmap; used for culling
+  nodeIndex: number = -1 // position of the node in the backend data; used to look up its sort ranks
 
   protected constructor(
     name: string,
@@ -3,13 +3,34 @@ import { useMainStore } from '@/stores/mainStore'
 
 export class ColumnSorter {
   private criteria: ColumnSorterCriterion[]
+  // ranks precomputed by the backend per criterion technicalName, indexed by Column.nodeIndex
+  private ranks: Record<string, number[]> | null = null
 
   constructor(criteria: ColumnSorterCriterion[] = []) {
     this.criteria = criteria
   }
 
+  public setRanks(ranks: Record<string, number[]> | null) {
+    this.ranks = ranks
+  }
+
   // Sort method that applies the criteria in order
   public sort(columns: Column[]): Column[] {
+    const criteriaRanks = this.criteria.map((criterion) => this.ranks?.[criterion.technicalName])
+    if (criteriaRanks.every((ranks) => ranks !== undefined)) {
+      // compare the precomputed ranks instead of names and values
+      return columns.sort((column1, column2) => {
+        for (let i = 0; i < criteriaRanks.length; i++) {
+          const ranks = criteriaRanks[i] as number[]
+          const comparison = ranks[column1.nodeIndex] - ranks[column2.nodeIndex]
+          if (comparison !== 0) {
+            return this.criteria[i].reverse ? -comparison : comparison
+          }
+        }
+        return 0
+      })
+    }
+
     return columns.sort((column1, column2) => {
       for (const criterion of this.criteria) {
         const comparison = criterion.compare(column1, column2)
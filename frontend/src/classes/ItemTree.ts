@@ -19,6 +19,7 @@ export class ItemTree {
   colorScheme: any
   rowsAsArray: Row[] = []
   datasetName: string = '' // the name of the file that was uploaded
+  nodeCount: number = 0 // number of rows built so far; gives every row its nodeIndex
 
   constructor(itemNameAndData: any, rowSorter: RowSorter, datasetName: string) {
     this.root = this.buildItemTree(itemNameAndData) as AggregateRow
@@ -37,6 +38,8 @@ export class ItemTree {
 
   buildItemTree(itemNameAndData: any, parent: Row | null = null): Row {
     let row: Row
+    // rows are numbered in the order of the backend data, parents before their children
+    const nodeIndex = this.nodeCount++
 
     if (itemNameAndData.children) {
       // Create the row instance first, without children initially
@@ -74,6 +77,7 @@ export class ItemTree {
       )
     }
 
+    row.nodeIndex = nodeIndex
     return row
   }
 
@@ -28,6 +28,7 @@ export abstract class Row {
   stickyPixiRowLabel: PixiRowLabel | null = null // reference to the corresponding (sticky!) PixiRowLabel for rendering
   pixiBubble: PixiBubble | null = null // reference to the corresponding PixiBubble for rendering
   heatmapVisibility: boolean = false // wheter the row is visible in the heatmap; used for culling
+  nodeIndex: number = -1 // position of the node in the backend data; used to look up its sort ranks
 
   protected constructor(
     name: string,
@@ -3,13 +3,34 @@ import { useMainStore } from '@/stores/mainStore'
 
 export class RowSorter {
   private criteria: RowSorterCriterion[]
+  // ranks precomputed by the backend per criterion technicalName, indexed by Row.nodeIndex
+  private ranks: Record<string, number[]> | null = null
 
   constructor(criteria: RowSorterCriterion[] = []) {
     this.criteria = criteria
   }
 
+  public setRanks(ranks: Record<string, number[]> | null) {
+    this.ranks = ranks
+  }
+
   // Sort method that applies the criteria in order
   public sort(rows: Row[]): Row[] {
+    const criteriaRanks = this.criteria.map((criterion) => this.ranks?.[criterion.technicalName])
+    if (criteriaRanks.every((ranks) => ranks !== undefined)) {
+      // compare the precomputed ranks instead of names and counts
+      return rows.sort((row1, row2) => {
+        for (let i = 0; i < criteriaRanks.length; i++) {
+          const ranks = criteriaRanks[i] as number[]
+          const comparison = ranks[row1.nodeIndex] - ranks[row2.nodeIndex]
+          if (comparison !== 0) {
+            return this.criteria[i].reverse ? -comparison : comparison
+          }
+        }
+        return 0
+      })
+    }
+
     return rows.sort((row1, row2) => {
       for (const criterion of this.criteria) {
         const comparison = criterion.compare(row1, row2)
@@ -194,16 +194,28 @@ export interface HeatmapJSON {
   minHeatmapValue: number
   maxAttributeValues: number[]
   minAttributeValues: number[]
+  // a preview, the full heatmap for the same settings is still being computed
+  isApproximate?: boolean
+  // built on a sample of the items, as a preview or to meet maxLatencyMs
+  isSampled?: boolean
+  // rank of every node under each sorter criterion, indexed by the node's position in the JSON
+  itemSortRanks?: Record<string, number[]> | null
+  attributeSortRanks?: Record<string, number[]> | null
+  // settings cache key of the result, used to refetch parts of it
+  resultId?: string | null
 }
 
 export interface HeatmapSettings {
-  csvFile: string
+  // only sent if the dataset is not registered, the backend then registers it
+  csvFile?: string
+  // returned by registerDataset, names the CSV the backend hashed once
+  datasetFingerprint?: string
 
   hierarchicalRowsMetadataColumnNames: string[]
   hierarchicalColumnsMetadataRowIndexes: number[]
 
-  selectedItemsRowIndexes: number[]
-  selectedAttributesColumnNames: string[]
+  selectedItemsRowIndexes: number[] | SelectionEncoding
+  selectedAttributesColumnNames: string[] | SelectionEncoding
 
   stickyAttributesColumnNames: string[]
   sortAttributesBasedOnStickyItems: boolean
@@ -219,11 +231,36 @@ export interface HeatmapSettings {
   attributesClusterSize: number
   dimReductionAlgo: DimReductionAlgoEnum
   clusterAfterDimRed: boolean
+  dimReductionPreset?: 'EXACT' | 'BALANCED' | 'FAST'
+
+  scalableDimReduction?: boolean
+  dimReductionSampleSize?: number
+  dimReductionPcaComponents?: number
+  incrementalDimReduction?: boolean
+  // warm starts of incrementalDimReduction are only shared within a session
+  sessionId?: string
+  useKnnGraph?: boolean
+  clusteringBackend?: 'AUTO' | 'WARD' | 'KMEANS' | 'BIRCH' | 'BISECTING_KMEANS' | 'KD_TREE' | 'DENDROGRAM'
+  clusteringFeatureSpace?: 'FULL' | 'PCA' | 'RANDOM_PROJECTION'
+  clusteringFeatureDimensions?: number
+  attributeSignature?: 'FULL' | 'SAMPLE' | 'RANDOM_PROJECTION'
+  attributeSignatureSize?: number
+  parallelClustering?: boolean
 
   itemAggregateMethod: string
   attributeAggregateMethod: string
+  approximateMedian?: boolean
+  approximateMedianError?: number
 
   scaling: ScalingEnum
+
+  previewMode?: boolean
+  previewSampleSize?: number
+
+  maxLatencyMs?: number
+
+  precomputeSortRanks?: boolean
+  collapseDuplicates?: boolean
 }
 
 export interface IndexLabelInterface {
@@ -285,9 +322,17 @@ export interface JsonDataTableProfile extends UploadedJsonData {
 
   itemAggregateMethod: string
   attributeAggregateMethod: string
+  approximateMedian?: boolean
+  approximateMedianError?: number
 
   scaling: ScalingEnum
 
+  // show a sampled heatmap first while the backend computes the full one
+  previewMode?: boolean
+
+  // fingerprint of csvFile registered with the backend, before the first request
+  datasetFingerprint?: string | null
+
   defaultSettings: Record<string, any>
 }
 
@@ -307,3 +352,83 @@ export function findRowByIndex(row: ItemNameAndData, index: number): ItemNameAnd
 
   return null
 }
+
+// uploads the CSV once, heatmap requests name it by the returned fingerprint instead of sending it
+export async function registerDataset(csvFile: string): Promise<string> {
+  const requestInit = await createJsonRequestInit(JSON.stringify({ csvFile }))
+  const response = await fetch(`${import.meta.env.VITE_API_URL}/api/dataset`, requestInit)
+  if (!response.ok) {
+    throw new Error(`Registering the dataset failed: ${await response.text()}`)
+  }
+  const { datasetFingerprint } = await response.json()
+  return datasetFingerprint
+}
+
+// bodies below this size are sent as they are, compressing them takes longer than sending them
+export const COMPRESS_REQUEST_BODY_MIN_LENGTH = 1024 * 1024
+
+// gzips large JSON bodies like the uploaded CSV, the backend decompresses them by their Content-Encoding
+export async function createJsonRequestInit(body: string): Promise<RequestInit> {
+  const headers: Record<string, string> = { 'Content-Type': 'application/json' }
+  if (body.length < COMPRESS_REQUEST_BODY_MIN_LENGTH || typeof CompressionStream === 'undefined') {
+    return { method: 'POST', headers, body }
+  }
+  const compressedBody = await new Response(
+    new Blob([body]).stream().pipeThrough(new CompressionStream('gzip')),
+  ).blob()
+  headers['Content-Encoding'] = 'gzip'
+  return { method: 'POST', headers, body: compressedBody }
+}
+
+// compact encodings of selected row or column positions of the CSV, decoded by backend/selection.py
+export type SelectionEncoding =
+  | { encoding: 'RANGES'; ranges: [number, number][] }
+  | { encoding: 'ALL_EXCEPT'; size: number; positions: number[] }
+  | { encoding: 'BITMAP'; size: number; bitmap: string }
+
+// smallest encoding of the given positions out of size, null if listing them is smaller
+export function encodeSelection(positions: number[], size: number): SelectionEncoding | null {
+  const sortedPositions = [...positions].sort((a, b) => a - b)
+  const ranges: [number, number][] = []
+  for (const position of sortedPositions) {
+    const lastRange = ranges[ranges.length - 1]
+    if (lastRange && lastRange[1] === position) {
+      lastRange[1] = position + 1
+    } else {
+      ranges.push([position, position + 1])
+    }
+  }
+
+  // approximate JSON length, every number takes about as many characters as size plus a comma
+  const numberLength = String(size).length + 1
+  const listLength = sortedPositions.length * numberLength
+  const rangesLength = ranges.length * 2 * numberLength
+  const allExceptLength = (size - sortedPositions.length) * numberLength
+  const bitmapLength = Math.ceil(size / 6)
+  const shortestLength = Math.min(rangesLength, allExceptLength, bitmapLength)
+  if (listLength <= shortestLength) {
+    return null
+  }
+
+  if (shortestLength === rangesLength) {
+    return { encoding: 'RANGES', ranges }
+  }
+  if (shortestLength === allExceptLength) {
+    const isSelected = new Uint8Array(size)
+    sortedPositions.forEach((position) => (isSelected[position] = 1))
+    const unselectedPositions: number[] = []
+    isSelected.forEach((selected, position) => {
+      if (!selected) {
+        unselectedPositions.push(position)
+      }
+    })
+    return { encoding: 'ALL_EXCEPT', size, positions: unselectedPositions }
+  }
+  const bytes = new Uint8Array(Math.ceil(size / 8))
+  sortedPositions.forEach((position) => (bytes[position >> 3] |= 1 << (position & 7)))
+  let binary = ''
+  for (let start = 0; start < bytes.length; start += 8192) {
+    binary += String.fromCharCode(...bytes.subarray(start, start + 8192))
+  }
+  return { encoding: 'BITMAP', size, bitmap: btoa(binary) }
+}
@@ -12,6 +12,10 @@ import {
   getDistinctColor,
   interpolateColor,
   type HierarchicalAttribute,
+  createJsonRequestInit,
+  registerDataset,
+  encodeSelection,
+  type SelectionEncoding,
 } from '@/helpers/helpers'
 import { ItemTree } from '@/classes/ItemTree'
 import { Row, AggregateRow, ItemRow } from '@/classes/Row'
@@ -72,6 +76,11 @@ export const useMainStore = defineStore('mainStore', {
       minHeatmapValue: 0 as number,
       maxAttributeValues: [] as number[],
       minAttributeValues: [] as number[],
+      isApproximate: false as boolean,
+      isSampled: false as boolean,
+      itemSortRanks: null as Record<string, number[]> | null | undefined,
+      attributeSortRanks: null as Record<string, number[]> | null | undefined,
+      resultId: null as string | null | undefined,
     },
 
     attributeMap: new Map(),
@@ -86,6 +95,8 @@ export const useMainStore = defineStore('mainStore', {
 
     outOfSync: false,
     reloadingScheduled: false,
+    // settings of the last approximate heatmap, used to fetch the matching full heatmap
+    approximateHeatmapSettings: null as HeatmapSettings | null,
 
     csvUploadOpen: true,
   }),
@@ -304,16 +315,30 @@ export const useMainStore = defineStore('mainStore', {
         console.log('fetchingHeatmap....')
         this.loading = true
         const startTime = new Date().getTime()
-        const settings: HeatmapSettings = this.getCurrentHeatmapSettings()
+        if (!this.activeDataTable.datasetFingerprint) {
+          this.activeDataTable.datasetFingerprint = await registerDataset(
+            this.activeDataTable.csvFile,
+          )
+        }
+        const settings: HeatmapSettings =
+          this.approximateHeatmapSettings ?? this.getCurrentHeatmapSettings()
+        this.approximateHeatmapSettings = null
         console.log('settings sent to backend:', settings)
 
-        const requestInit: RequestInit = {
-          method: 'POST',
-          headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify({ settings }),
+        const requestInit = await createJsonRequestInit(JSON.stringify({ settings }))
+
+        let response = await fetch(`${import.meta.env.VITE_API_URL}/api/heatmap`, requestInit)
+        if (response.status === 404) {
+          // the backend dropped the registered dataset, register it again
+          const datasetFingerprint = await registerDataset(this.activeDataTable.csvFile)
+          this.activeDataTable.datasetFingerprint = datasetFingerprint
+          response = await fetch(
+            `${import.meta.env.VITE_API_URL}/api/heatmap`,
+            await createJsonRequestInit(
+              JSON.stringify({ settings: { ...settings, datasetFingerprint } }),
+            ),
+          )
         }
-
-        const response = await fetch(`${import.meta.env.VITE_API_URL}/api/heatmap`, requestInit)
         if (!response.body) {
           console.error('Error during fetching heatmap', response)
           this.setIsOutOfSync(true)
@@ -365,6 +390,7 @@ export const useMainStore = defineStore('mainStore', {
         const criterion2 = new RowSorterCriterionByHasChildren()
         const criterion3 = new RowSorterCriterionByAmountOfChildren()
         const rowSorter = new RowSorter([criterion2, criterion3, criterion1])
+        rowSorter.setRanks(this.heatmap.itemSortRanks ?? null)
         // criterion2.toggleReverse()
 
         // initialize columnSorter
@@ -373,6 +399,7 @@ export const useMainStore = defineStore('mainStore', {
         const criterionC = new ColumnSorterCriterionByStandardDeviation()
         const criterionD = new ColumnSorterCriterionByHasChildren()
         const columnSorter = new ColumnSorter([criterionA, criterionB, criterionC, criterionD])
+        columnSorter.setRanks(this.heatmap.attributeSortRanks ?? null)
 
         // initialize itemTree with the data received from the backend, starting at the root
         const itemTreeRoot = this.heatmap.itemNamesAndData[0]
@@ -396,6 +423,12 @@ export const useMainStore = defineStore('mainStore', {
         console.log('AttributeTree:', this.attributeTree)
 
         console.log('Done fetching heatmap in', new Date().getTime() - startTime, 'ms.')
+        if (this.heatmap.isApproximate) {
+          // the backend is still computing the full heatmap, fetch it as soon as it is ready
+          console.log('Received approximate heatmap, queuing reload for the full heatmap')
+          this.approximateHeatmapSettings = settings
+          this.reloadingScheduled = true
+        }
         this.setIsOutOfSync(false)
         nextTick(() => {
           this.changeHeatmap()
@@ -511,6 +544,13 @@ export const useMainStore = defineStore('mainStore', {
       }
       this.activeDataTable.clusterAfterDimRed = clusterAfterDim
     },
+    setPreviewMode(previewMode: boolean) {
+      if (!this.activeDataTable) {
+        console.error('No active data table')
+        return
+      }
+      this.activeDataTable.previewMode = previewMode
+    },
     setItemAggregateMethod(itemAggregateMethod: string) {
       if (!this.activeDataTable) {
         console.error('No active data table')
@@ -538,13 +578,13 @@ export const useMainStore = defineStore('mainStore', {
       }
 
       // get selected item names from ItemTree
-      const selectedItemsNames = this.itemTree.getSelectedItems().map(item => item.name)
+      const selectedItemsNames = new Set(this.itemTree.getSelectedItems().map(item => item.name))
       
       let selectedItemsRowIndexes: number[] = []
       // loop over dataset and get all the indexes of the selected items
       this.activeDataTable.df.forEach((row, index) => {
         let itemName = row[this.activeDataTable!.allColumnNames[0]] // first column is the item name column
-        if (selectedItemsNames.includes(itemName)) {
+        if (selectedItemsNames.has(itemName)) {
           selectedItemsRowIndexes.push(index)
         }
       })
@@ -552,6 +592,35 @@ export const useMainStore = defineStore('mainStore', {
       return selectedItemsRowIndexes
     },
 
+    getEncodedSelectedItemsRowIndexes(): number[] | SelectionEncoding {
+      const selectedItemsRowIndexes = this.getSelectedItemsRowIndexes()
+      if (!this.activeDataTable) {
+        return selectedItemsRowIndexes
+      }
+      // row indexes are the positions of the rows in the CSV
+      return (
+        encodeSelection(selectedItemsRowIndexes, this.activeDataTable.df.count()) ??
+        selectedItemsRowIndexes
+      )
+    },
+
+    getEncodedSelectedColumnNames(selectedColumnNames: string[]): string[] | SelectionEncoding {
+      if (!this.activeDataTable) {
+        return selectedColumnNames
+      }
+      const columnNames = this.activeDataTable.df.getColumnNames()
+      const columnPositions = new Map(columnNames.map((columnName, position) => [columnName, position]))
+      const selectedColumnPositions: number[] = []
+      for (const columnName of selectedColumnNames) {
+        const position = columnPositions.get(columnName)
+        if (position === undefined) {
+          return selectedColumnNames
+        }
+        selectedColumnPositions.push(position)
+      }
+      return encodeSelection(selectedColumnPositions, columnNames.length) ?? selectedColumnNames
+    },
+
     getCurrentHeatmapSettings(): HeatmapSettings {
       if (!this.activeDataTable) {
         console.error('No active data table')
@@ -566,7 +635,7 @@ export const useMainStore = defineStore('mainStore', {
       }
 
       return {
-        csvFile: this.activeDataTable.csvFile,
+        datasetFingerprint: this.activeDataTable.datasetFingerprint ?? undefined,
 
         hierarchicalRowsMetadataColumnNames: this.getHierarchicalRowsMetadataColumnNames
           .filter((i) => i.selected)
@@ -575,9 +644,9 @@ export const useMainStore = defineStore('mainStore', {
           .filter((i) => i.selected)
           .map((i) => i.index),
 
-        selectedItemsRowIndexes: this.getSelectedItemsRowIndexes(),
+        selectedItemsRowIndexes: this.getEncodedSelectedItemsRowIndexes(),
 
-        selectedAttributesColumnNames: selectedColumnNames,
+        selectedAttributesColumnNames: this.getEncodedSelectedColumnNames(selectedColumnNames),
 
         stickyAttributesColumnNames: this.activeDataTable.stickyAttributes,
         sortAttributesBasedOnStickyItems: this.activeDataTable.sortAttributesBasedOnStickyItems,
@@ -599,6 +668,10 @@ export const useMainStore = defineStore('mainStore', {
         attributeAggregateMethod: this.activeDataTable.attributeAggregateMethod,
 
         scaling: this.activeDataTable.scaling,
+
+        previewMode: this.activeDataTable.previewMode ?? false,
+
+        precomputeSortRanks: true,
       }
     },
     changeHeatmap(): void {
@@ -814,8 +887,47 @@ export const useMainStore = defineStore('mainStore', {
         }
       }
 
+      if (this.activeDataTable.sortAttributesBasedOnStickyItems) {
+        this.fetchAttributeDissimilarities()
+      }
       this.changeHeatmap()
     },
+    // re-sorts the attributes for the new sticky items without recomputing the heatmap
+    async fetchAttributeDissimilarities() {
+      if (!this.activeDataTable || !this.heatmap.resultId) {
+        return
+      }
+      const resultId = this.heatmap.resultId
+      try {
+        const requestInit: RequestInit = {
+          method: 'POST',
+          headers: { 'Content-Type': 'application/json' },
+          body: JSON.stringify({
+            resultId,
+            stickyItemsRowIndexes: this.activeDataTable.stickyItemIndexes,
+            sortAttributesBasedOnStickyItems: this.activeDataTable.sortAttributesBasedOnStickyItems,
+          }),
+        }
+        const response = await fetch(
+          `${import.meta.env.VITE_API_URL}/api/heatmap/dissimilarities`,
+          requestInit,
+        )
+        if (!response.ok) {
+          // the result is not cached anymore, the next fetch recomputes it
+          this.setIsOutOfSync(true)
+          return
+        }
+        const { attributeDissimilarities } = await response.json()
+        if (this.heatmap.resultId !== resultId) {
+          return
+        }
+        this.heatmap.attributeDissimilarities = attributeDissimilarities
+        this.changeHeatmap()
+      } catch (error) {
+        console.error('Error during fetching attribute dissimilarities', error)
+        this.setIsOutOfSync(true)
+      }
+    },
 
     // used as a trigger from the RowSorter to re-sort the rows
     sortRows() {